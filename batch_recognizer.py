@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+from packed_table import PackedLRTable, SHIFT, REDUCE, ACCEPT
+import lr
+import packed_table
+
+# NumPy is only needed by this module
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _check_numpy():
+    if numpy is None:
+        raise ImportError('batch_recognizer needs NumPy')
+
+
+class DenseLRTable:
+    # A PackedLRTable as NumPy arrays: actions[state, sym_id], plus a last
+    # column of errors that the symbols unknown to the table are mapped to
+    def __init__(self, packed: PackedLRTable):
+        _check_numpy()
+        self.packed = packed
+        actions = numpy.zeros((packed.n_states, packed.width + 1), numpy.int64)
+        actions[:, :packed.width] = numpy.frombuffer(
+            packed.actions, numpy.uint32).reshape(packed.n_states, packed.width)
+        self.actions = actions
+        self.prod_lhs = numpy.array(packed.prod_lhs, numpy.int64)
+        self.prod_len = numpy.array(packed.prod_len, numpy.int64)
+        self.eof = len(packed.terms) - 1
+        self.unknown = packed.width
+
+
+def pack_sentences(dense: DenseLRTable, sentences) -> tuple:
+    # Returns (ids, lengths): ids[i] holds the terminal ids of sentences[i]
+    # padded with '$', with at least one '$' after every sentence
+    _check_numpy()
+    sentences = list(sentences)
+    lengths = numpy.array([len(syms) for syms in sentences], numpy.int64)
+    width = int(lengths.max()) + 1 if len(sentences) else 1
+    ids = numpy.full((len(sentences), width), dense.eof, numpy.int64)
+    term_ids = dict((term, i) for i, term in enumerate(dense.packed.terms))
+    for i, syms in enumerate(sentences):
+        ids[i, :len(syms)] = [term_ids.get(sym, dense.unknown) for sym in syms]
+    return ids, lengths
+
+
+def recognize(dense: DenseLRTable, ids, lengths=None) -> tuple:
+    # ids: 2D array of terminal ids padded with '$' (see pack_sentences), or
+    # the rows of a single length. Every sentence is run by the LR driver in
+    # lockstep: each round takes one action in all the sentences still
+    # running, a shift, reduce, accept or error picked by masks, and drops
+    # the finished ones. Returns (accepted, error_pos): booleans, and the
+    # position of the unexpected symbol or -1.
+    _check_numpy()
+    ids = numpy.asarray(ids, numpy.int64)
+    n, width = ids.shape
+    if lengths is None or int(numpy.max(lengths, initial=0)) >= width:
+        ids = numpy.concatenate([ids, numpy.full((n, 1), dense.eof, numpy.int64)], 1)
+        width += 1
+    actions = dense.actions
+    prod_lhs = dense.prod_lhs
+    prod_len = dense.prod_len
+
+    accepted = numpy.zeros(n, bool)
+    error_pos = numpy.full(n, -1, numpy.int64)
+    stacks = numpy.zeros((n, width + 8), numpy.int64)  # state 0 at the bottom
+    top = numpy.zeros(n, numpy.int64)
+    pos = numpy.zeros(n, numpy.int64)
+    rows = numpy.arange(n)  # the sentences still running
+    while len(rows):
+        if int(top[rows].max()) + 1 >= stacks.shape[1]:
+            stacks = numpy.concatenate([stacks, numpy.zeros_like(stacks)], 1)
+        row_top = top[rows]
+        row_pos = pos[rows]
+        action = actions[stacks[rows, row_top], ids[rows, numpy.minimum(row_pos, width - 1)]]
+        kind = action & 3
+
+        shift = kind == SHIFT
+        shifted = rows[shift]
+        top[shifted] += 1
+        stacks[shifted, top[shifted]] = action[shift] >> 2
+        pos[shifted] += 1
+
+        reduce = kind == REDUCE
+        reduced = rows[reduce]
+        prod = action[reduce] >> 2
+        reduced_top = top[reduced] - prod_len[prod]
+        goto = actions[stacks[reduced, reduced_top], prod_lhs[prod]] >> 2
+        top[reduced] = reduced_top + 1
+        stacks[reduced, reduced_top + 1] = goto
+
+        accept = action == ACCEPT
+        accepted[rows[accept]] = True
+        error = (kind == 0) & ~accept
+        error_pos[rows[error]] = row_pos[error]
+        rows = rows[shift | reduce]
+    return accepted, error_pos
+
+
+def recognize_sentences(dense: DenseLRTable, sentences) -> tuple:
+    return recognize(dense, *pack_sentences(dense, sentences))
+
+
+def main():
+    import bnf_parser
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    grammar = lr.construct_argumented_grammar(bnf_parser.parse(bnf))
+    algo_suit = lr.LR1AlgorithmSuit(grammar)
+    states = lr.construct_states(grammar, algo_suit)
+    dense = DenseLRTable(packed_table.pack_lr_table(
+        grammar, lr.construct_table(grammar, states, algo_suit)))
+    sentences = ['id * ( id + id )', 'id + * id', '( id', '', 'id + x']
+    accepted, error_pos = recognize_sentences(dense, [s.split() for s in sentences])
+    for sentence, ok, pos in zip(sentences, accepted, error_pos):
+        print('  {:20} {}'.format(repr(sentence), 'accepted' if ok else
+                                  'error at {}'.format(pos)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,859 @@
+#!/usr/bin/env python
+import os
+import gc
+import sys
+import json
+import argparse
+import time
+import types
+import tempfile
+import subprocess
+import concurrent.futures
+import tracemalloc
+import bnf_parser
+import left_recursion_eliminator
+import lr
+import ll1
+import incremental
+import incremental_parser
+import packed_table
+import codegen
+import report
+import workloads
+import parse_stats
+import parse_error
+import token_stream
+import compiled_parser
+import parallel_lr
+import forest
+import batch_recognizer
+import parallel_parse
+import ll_star
+import packrat
+import lr_minimize
+import parse_trace
+import table_store
+from parse_error import ParseError
+
+
+def count_productions(grammar) -> int:
+    return sum(len(prodlist) for prodlist in grammar.prods.values())
+
+
+def _timeit(func, repeat=3):
+    # Like timeit, the garbage collector is kept out of the measurements
+    best = None
+    result = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            begin = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - begin
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best, result
+
+
+def bench_left_elim():
+    for name, gen, sizes in (('layered', workloads.gen_layered, (100, 1000, 3000)),
+                             ('expr-cycles', workloads.gen_expr_cycles, (100, 500, 1000))):
+        for size in sizes:
+            grammar = bnf_parser.parse(gen(size))
+            elapsed, elim = _timeit(lambda: left_recursion_eliminator.eliminate(grammar))
+            print('  left_elim {:12} n={:5}: {:5} -> {:5} rules, {:8.2f} ms'.format(
+                name, size, count_productions(grammar), count_productions(elim),
+                elapsed * 1000))
+
+
+def bench_derive():
+    for size in (1000, 10000, 50000):
+        grammar = bnf_parser.parse(workloads.gen_layered(size))
+        elapsed, _ = _timeit(lambda: lr.construct_argumented_grammar(grammar), 10)
+        print('  argumented grammar of {:6} rules: {:8.3f} ms'.format(
+            count_productions(grammar), elapsed * 1000))
+
+
+def _build_context(grammar):
+    lr_grammar = lr.construct_argumented_grammar(grammar)
+    context = dict(grammar=grammar, lr_grammar=lr_grammar)
+    context['first'] = ll1.construct_first(grammar)
+    context['follow'] = ll1.construct_follow(grammar, context['first'])
+    context['lr0_suit'] = lr.LR0AlgorithmSuit(lr_grammar)
+    context['slr1_suit'] = lr.SLR1AlgorithmSuit(lr_grammar)
+    context['lr1_suit'] = lr.LR1AlgorithmSuit(lr_grammar)
+    context['lr0_state'] = lr.construct_states(lr_grammar, context['lr0_suit'])
+    context['lr1_state'] = lr.construct_states(lr_grammar, context['lr1_suit'])
+    return context
+
+
+def bench_incremental():
+    for size in (10, 50, 100):
+        bnf = workloads.gen_expr_cycles(size)
+        context = _build_context(bnf_parser.parse(bnf))
+        edited = bnf_parser.parse(bnf + '\nF{0} := - F{0}'.format(size // 2))
+        full_time, full = _timeit(lambda: _build_context(edited), 1)
+        incr_time, incr = _timeit(lambda: incremental.update_context(context, edited), 1)
+        print('  {:5} rules, {:6} LR(1) states: full {:9.2f} ms, '
+              'incremental {:9.2f} ms'.format(
+                  count_productions(edited), len(full['lr1_state']),
+                  full_time * 1000, incr_time * 1000))
+        assert len(full['lr1_state']) == len(incr['lr1_state'])
+
+
+def bench_reparse():
+    bnf = '''
+    P := P S | S
+    S := E ;
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    table = incremental_parser._build_table(bnf_parser.parse(bnf), lr.LR1AlgorithmSuit)
+    stmt = '( id + id * id ) * id + id ;'.split()
+    for n_stmts in (1000, 10000, 50000):
+        syms = stmt * n_stmts
+        full_time, tree = _timeit(lambda: incremental_parser.parse_tree(table, syms), 1)
+        for where in (0.5, 0.99):
+            pos = int(len(syms) * where) // len(stmt) * len(stmt) + 1
+            edits = [(pos, pos + 1, '( id )'.split())]
+            new_syms = incremental_parser.apply_edits(syms, edits)
+            incr_time, _ = _timeit(lambda: incremental_parser.reparse_tree(
+                table, tree, new_syms, edits))
+            print('  {:7} tokens, edit at {:3.0%}: full {:9.2f} ms, '
+                  'incremental {:8.2f} ms'.format(len(syms), where,
+                                                  full_time * 1000, incr_time * 1000))
+
+
+def _load_module(name, source):
+    module = types.ModuleType(name)
+    exec(compile(source, name, 'exec'), module.__dict__)
+    return module
+
+
+def _build_lr_table(grammar, algo_suit_class=lr.LR1AlgorithmSuit):
+    lr_grammar = lr.construct_argumented_grammar(grammar)
+    algo_suit = algo_suit_class(lr_grammar)
+    states = lr.construct_states(lr_grammar, algo_suit)
+    return lr_grammar, lr.construct_table(lr_grammar, states, algo_suit)
+
+
+def _build_ll1_table(grammar):
+    first = ll1.construct_first(grammar)
+    follow = ll1.construct_follow(grammar, first)
+    return ll1.construct_table(grammar, first, follow)
+
+
+def bench_codegen():
+    grammar = left_recursion_eliminator.eliminate(bnf_parser.parse('''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''))
+    syms = '( id + id * id ) * id + id +'.split() * 20000 + ['id']
+    ll1_table = _build_ll1_table(grammar)
+    ll1_packed = packed_table.pack_ll1_table(grammar, ll1_table)
+    lr_grammar, lr_table = _build_lr_table(grammar)
+    lr_packed = packed_table.pack_lr_table(lr_grammar, lr_table)
+    nop = lambda *args: None
+
+    gen_ll1 = _load_module('gen_ll1', codegen.generate_ll1(ll1_packed))
+    gen_rd = _load_module('gen_rd', codegen.generate_ll1_recursive(ll1_packed))
+    gen_lr = _load_module('gen_lr', codegen.generate_lr(lr_packed))
+    for name, func in (
+            ('ll1.parse', lambda: ll1.parse(grammar, ll1_table, syms, nop)),
+            ('generated LL(1) table', lambda: gen_ll1.parse(syms)),
+            ('generated LL(1) recursive', lambda: gen_rd.parse(syms)),
+            ('lr.parse LR(1)', lambda: lr.parse(lr_table, syms, nop)),
+            ('generated LR(1)', lambda: gen_lr.parse(syms))):
+        elapsed, _ = _timeit(func)
+        print('  {:26}: {:9.0f} tokens/s'.format(name, len(syms) / elapsed))
+
+    # Import time of a module with a big table, from source and from .pyc
+    lr_grammar, lr_table = _build_lr_table(bnf_parser.parse(workloads.gen_expr_cycles(50)))
+    packed = packed_table.pack_lr_table(lr_grammar, lr_table)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, 'big_parser.py'), 'w') as module_file:
+            module_file.write(codegen.generate_lr(packed))
+        for desc in ('first import', 'cached import'):
+            begin = time.perf_counter()
+            subprocess.check_call([sys.executable, '-c', 'import big_parser'],
+                                  cwd=tmp_dir)
+            elapsed = time.perf_counter() - begin
+            print('  {} of {} states x {} symbols: {:7.2f} ms'.format(
+                desc, packed.n_states, packed.width, elapsed * 1000))
+
+
+def _measure_report(func):
+    # Time without tracing, then peak traced memory in a second run
+    elapsed, _ = _timeit(func, 1)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_reports():
+    grammar = bnf_parser.parse(workloads.gen_expr_cycles(2000))
+    lr_grammar = lr.construct_argumented_grammar(grammar)
+    algo_suit = lr.LR1AlgorithmSuit(lr_grammar)
+    states = lr.construct_states(lr_grammar, algo_suit)
+    table = lr.construct_table(lr_grammar, states, algo_suit)
+    print('  {} LR(1) states'.format(len(states)))
+
+    with open(os.devnull, 'w') as null_file:
+        for name, func in (
+                ('str_states', lambda: print(lr.str_states(states), file=null_file)),
+                ('iter_states', lambda: report.write_lines(
+                    lr.iter_states(states), null_file)),
+                ('iter_states_rows jsonl', lambda: report.write_rows(
+                    'states', lr.STATES_COLUMNS, lr.iter_states_rows(states),
+                    null_file)),
+                ('str_table', lambda: print(lr.str_table(table), file=null_file)),
+                ('iter_table', lambda: report.write_lines(
+                    lr.iter_table(table), null_file)),
+                ('iter_table_rows csv', lambda: report.write_rows(
+                    'table', lr.TABLE_COLUMNS, lr.iter_table_rows(table),
+                    null_file, 'csv')),
+                ('dump_dfa', lambda: lr.dump_dfa(states, null_file))):
+            elapsed, peak = _measure_report(func)
+            print('  {:24}: {:9.2f} ms, peak {:9.2f} MiB'.format(
+                name, elapsed * 1000, peak / 1024 / 1024))
+
+
+def bench_parse_stats():
+    grammar = bnf_parser.parse(workloads.gen_json())
+    lr_grammar, table = _build_lr_table(grammar)
+    syms = workloads.gen_sentence(grammar, 100000)
+    nop = lambda *args: None
+    for name, func in (
+            ('lr.parse', lambda: lr.parse(table, syms)),
+            ('lr.parse counting', lambda: parse_stats.collect_lr(table, syms)),
+            ('lr.parse with a callback', lambda: lr.parse(table, syms, nop))):
+        elapsed, _ = _timeit(func)
+        print('  {:26}: {:9.0f} tokens/s'.format(name, len(syms) / elapsed))
+
+
+def bench_recovery():
+    grammar = bnf_parser.parse(workloads.gen_json())
+    elim = left_recursion_eliminator.eliminate(grammar)
+    _, lr_table = _build_lr_table(grammar)
+    ll1_table = _build_ll1_table(elim)
+    clean = workloads.gen_sentence(grammar, 50000)
+    for rate in (0.001, 0.01, 0.05):
+        syms = workloads.corrupt_sentence(clean, sorted(grammar.terms), rate)
+        print('  {:.1%} of the symbols corrupted:'.format(rate))
+        for mode in parse_error.MODES:
+            recovery = parse_error.Recovery(mode)
+            for name, func in (
+                    ('lr.parse', lambda: lr.parse(lr_table, syms, recovery=recovery)),
+                    ('ll1.parse', lambda: ll1.parse(elim, ll1_table, syms,
+                                                    recovery=recovery))):
+                elapsed, errors = _timeit(func)
+                print('    {:9} {:6}: {:9.0f} tokens/s, {} errors'.format(
+                    name, mode, len(syms) / elapsed, len(errors)))
+
+
+def bench_token_stream():
+    grammar = bnf_parser.parse(workloads.gen_json())
+    elim = left_recursion_eliminator.eliminate(grammar)
+    lr_grammar, lr_table = _build_lr_table(grammar)
+    ll1_table = _build_ll1_table(elim)
+    lr_packed = packed_table.pack_lr_table(lr_grammar, lr_table)
+    ll1_packed = packed_table.pack_ll1_table(elim, ll1_table)
+    syms = workloads.gen_sentence(grammar, 200000)
+
+    def read_text():
+        with open(text_path) as text_file:
+            return text_file.read().split()
+
+    def parse_text_packed(packed, parse):
+        sym_ids = packed.sym_ids
+        return parse(packed, [sym_ids[sym] for sym in read_text()])
+
+    def parse_stream(packed, parse):
+        with token_stream.open_token_stream(token_path) as stream:
+            return parse(packed, stream.get_ids(packed.terms))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        text_path = os.path.join(tmp_dir, 'input.syms')
+        token_path = os.path.join(tmp_dir, 'input.tok')
+        with open(text_path, 'w') as text_file:
+            text_file.write(' '.join(syms))
+        with open(text_path) as text_file, open(token_path, 'wb') as output_file:
+            token_stream.convert(text_file, output_file,
+                                 packed_table.construct_terms(grammar))
+        print('  text: {} bytes, token stream: {} bytes'.format(
+            os.path.getsize(text_path), os.path.getsize(token_path)))
+        for name, func in (
+                ('text, lr.parse', lambda: lr.parse(lr_table, read_text())),
+                ('text, packed LR(1)',
+                 lambda: parse_text_packed(lr_packed, packed_table.parse_lr)),
+                ('tokens, packed LR(1)',
+                 lambda: parse_stream(lr_packed, packed_table.parse_lr)),
+                ('text, ll1.parse', lambda: ll1.parse(elim, ll1_table, read_text())),
+                ('text, packed LL(1)',
+                 lambda: parse_text_packed(ll1_packed, packed_table.parse_ll1)),
+                ('tokens, packed LL(1)',
+                 lambda: parse_stream(ll1_packed, packed_table.parse_ll1))):
+            elapsed, peak = _measure_report(func)
+            print('  {:22}: {:9.0f} tokens/s, peak {:8.1f} KiB'.format(
+                name, len(syms) / elapsed, peak / 1024))
+
+
+def bench_threads():
+    # Without free threading the GIL serializes the parses, the benchmark
+    # then shows the cost of sharing one parser instead of a speedup
+    grammar = bnf_parser.parse(workloads.gen_json())
+    parser = compiled_parser.CompiledParser(grammar, 'lr1')
+    inputs = [workloads.gen_sentence(grammar, 20000, seed) for seed in range(16)]
+    id_inputs = [parser.get_ids(syms) for syms in inputs]
+    n_tokens = sum(len(syms) for syms in inputs)
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('  {} inputs, {} tokens, GIL {}'.format(
+        len(inputs), n_tokens, 'enabled' if gil else 'disabled'))
+    for workers in (1, 2, 4, 8):
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for name, func, args in (('parse', parser.parse, inputs),
+                                     ('parse_ids', parser.parse_ids, id_inputs)):
+                elapsed, _ = _timeit(lambda: list(executor.map(func, args)))
+                print('  {} thread(s), {:9}: {:9.0f} tokens/s'.format(
+                    workers, name, n_tokens / elapsed))
+
+
+def bench_parallel_lr():
+    grammar = lr.construct_argumented_grammar(
+        bnf_parser.parse(workloads.gen_expr_cycles(40)))
+    algo_suit = lr.LR1AlgorithmSuit(grammar)
+    elapsed, serial = _timeit(lambda: lr.construct_states(grammar, algo_suit), 1)
+    print('  {} LR(1) states, {} CPUs'.format(len(serial), os.cpu_count()))
+    print('  serial    : {:9.2f} ms'.format(elapsed * 1000))
+    expected = parallel_lr._get_structure(serial)
+    for workers in (1, 2, 4, 8, 16):
+        elapsed, states = _timeit(
+            lambda: parallel_lr.construct_states(grammar, algo_suit, workers), 1)
+        assert parallel_lr._get_structure(states) == expected
+        print('  {:2} workers: {:9.2f} ms'.format(workers, elapsed * 1000))
+
+
+def bench_goto():
+    for n in (20, 100, 400):
+        grammar = lr.construct_argumented_grammar(bnf_parser.parse(workloads.gen_long(n)))
+        for algo_suit_class in (lr.LR0AlgorithmSuit, lr.LR1AlgorithmSuit):
+            algo_suit = algo_suit_class(grammar)
+            elapsed, states = _timeit(lambda: lr.construct_states(grammar, algo_suit))
+            del states
+            tracemalloc.start()
+            states = lr.construct_states(grammar, algo_suit)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('  long({:3}) {:6}: {:5} states, {:9.2f} ms, peak {:8.1f} KiB'.format(
+                n, algo_suit.NAME, len(states), elapsed * 1000, peak / 1024))
+
+
+def bench_forest():
+    # Catalan(m) trees for m operators: counted and the best ones taken from
+    # the O(m^3) forest, against enumerating every tree for the small sizes
+    grammar = bnf_parser.parse(workloads.gen_ambiguous(1))
+    for m in (8, 10, 20, 40, 80):
+        syms = ' op0 '.join(['id'] * (m + 1)).split()
+        parse_time, result = _timeit(lambda: forest.parse(grammar, syms), 1)
+        count_time, count = _timeit(lambda: forest.count_derivations(result), 1)
+        top_time, _ = _timeit(lambda: forest.construct_top_k(result, 10), 1)
+        report_time, _ = _timeit(lambda: list(forest.iter_ambiguities(result)), 1)
+        print('  {:2} operators: {:7} nodes, {:.3g} trees, parse {:8.2f} ms, count '
+              '{:7.2f} ms, top 10 {:8.2f} ms, ambiguities {:7.2f} ms'.format(
+                  m, len(result.families), count, parse_time * 1000,
+                  count_time * 1000, top_time * 1000, report_time * 1000))
+        if m <= 10:
+            elapsed, _ = _timeit(lambda: sum(1 for _ in forest.iter_trees(result)), 1)
+            print('  {:2} operators: enumerating every tree {:8.2f} ms'.format(
+                m, elapsed * 1000))
+
+
+def _try_parse(parse, syms) -> bool:
+    try:
+        parse(syms)
+    except ParseError:
+        return False
+    return True
+
+
+def bench_batch():
+    # Short sentences, half of them with an error, recognized one at a time
+    # or all in lockstep
+    grammar = bnf_parser.parse(workloads.gen_json())
+    lr_grammar, table = _build_lr_table(grammar)
+    packed = packed_table.pack_lr_table(lr_grammar, table)
+    dense = batch_recognizer.DenseLRTable(packed)
+    terms = sorted(grammar.terms)
+    term_ids = dict((term, i) for i, term in enumerate(packed.terms))
+    base = [workloads.gen_sentence(grammar, length, length)
+            for length in range(4, 36)]
+    for n in (1000, 10000, 100000):
+        sentences = [workloads.corrupt_sentence(base[i % len(base)], terms, 0.05, i)
+                     if i % 2 else base[i % len(base)] for i in range(n)]
+        n_syms = sum(len(syms) for syms in sentences)
+        id_lists = [[term_ids[sym] for sym in syms] for syms in sentences]
+        ids, lengths = batch_recognizer.pack_sentences(dense, sentences)
+        for name, func in (
+                ('lr.parse loop', lambda: sum(
+                    _try_parse(lambda syms: lr.parse(table, syms), syms)
+                    for syms in sentences)),
+                ('parse_lr loop', lambda: sum(
+                    _try_parse(lambda ids: packed_table.parse_lr(packed, ids), ids)
+                    for ids in id_lists)),
+                ('batch', lambda: int(batch_recognizer.recognize(
+                    dense, ids, lengths)[0].sum())),
+                ('batch with packing', lambda: int(
+                    batch_recognizer.recognize_sentences(dense, sentences)[0].sum()))):
+            elapsed, accepted = _timeit(func, 1 if n > 10000 else 3)
+            print('  {:6} sentences {:18}: {:9.0f} tokens/s, {} accepted'.format(
+                n, name, n_syms / elapsed, accepted))
+
+
+def _flatten_tree(tree) -> list:
+    result = list()
+    pending = [tree]
+    while pending:
+        tree = pending.pop()
+        if isinstance(tree, tuple):
+            result.append((tree[0], len(tree[1])))
+            pending.extend(reversed(tree[1]))
+        else:
+            result.append(tree)
+    return result
+
+
+def bench_parallel_parse():
+    # A statement per ;, as in a log
+    bnf = '''
+    S := S ; R | R
+    R := let id = E | print E
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    %sync ;
+    '''
+    grammar = bnf_parser.parse(bnf)
+    _, table = _build_lr_table(grammar)
+    statements = [workloads.gen_sentence(grammar, 2 + seed % 30, seed) for seed in range(300)]
+    syms = list()
+    for i in range(20000):
+        syms.extend(statements[i * 7 % len(statements)])
+        syms.append(';')
+    syms.pop()
+    elapsed, _ = _timeit(lambda: lr.parse(table, syms), 1)
+    print('  {} symbols, {} CPUs'.format(len(syms), os.cpu_count()))
+    print('  lr.parse    : {:9.0f} tokens/s'.format(len(syms) / elapsed))
+    elapsed, tree = _timeit(lambda: parallel_parse.parse_values(table, syms), 1)
+    print('  sequential  : {:9.0f} tokens/s'.format(len(syms) / elapsed))
+    expected = _flatten_tree(tree)
+    for workers in (1, 2, 4, 8):
+        elapsed, tree = _timeit(lambda: parallel_parse.parse(
+            table, grammar.sync, syms, workers=workers), 1)
+        assert _flatten_tree(tree) == expected
+        print('  {:2} workers  : {:9.0f} tokens/s'.format(workers, len(syms) / elapsed))
+
+
+def bench_ll_star():
+    # Statements told apart by the operator after a path of any length, an
+    # LL(1) conflict on every statement, with a lookahead cache of
+    # decreasing size
+    grammar = bnf_parser.parse(workloads.gen_paths(8))
+    first = ll1.construct_first(grammar)
+    table = ll1.construct_table(grammar, first, ll1.construct_follow(grammar, first))
+    syms = workloads.gen_sentence(grammar, 20000, 0)
+    _, lr_table = _build_lr_table(grammar)
+    elapsed, _ = _timeit(lambda: lr.parse(lr_table, syms), 1)
+    print('  {} symbols, {} conflicts'.format(
+        len(syms), len(ll_star.Predictor(grammar, table).conflicts)))
+    print('  lr.parse          : {:9.0f} tokens/s'.format(len(syms) / elapsed))
+    for max_states in (10000, 40, 20, 10):
+        predictor = ll_star.Predictor(grammar, table, max_states)
+        elapsed, _ = _timeit(lambda: ll1.parse(grammar, table, syms, predictor=predictor), 1)
+        stats = predictor.stats
+        print('  {:5} DFA states  : {:9.0f} tokens/s, hit rate {:.4f}, {} evictions, '
+              '{:.2f} lookahead per prediction'.format(
+                  max_states, len(syms) / elapsed, stats.get_hit_rate(), stats.evictions,
+                  stats.lookahead / max(stats.predictions, 1)))
+
+
+def bench_packrat():
+    # The grammars both parse once the left recursion is gone; then a long
+    # input with the memo bounded
+    for name in ('expr_tower', 'chain', 'long', 'wide', 'json', 'sql'):
+        gen, size = workloads.GRAMMARS[name]
+        grammar = left_recursion_eliminator.eliminate(bnf_parser.parse(gen(size)))
+        ll1_table = _build_ll1_table(grammar)
+        ll1_packed = packed_table.pack_ll1_table(grammar, ll1_table)
+        term_ids = dict((term, i) for i, term in enumerate(ll1_packed.terms))
+        syms = workloads.gen_sentence(grammar, 5000, 0)
+        ids = [term_ids[sym] for sym in syms]
+        parser = packrat.PackratParser(grammar)
+        nop = lambda *args: None
+        for func_name, func in (
+                ('ll1.parse', lambda: ll1.parse(grammar, ll1_table, syms, nop)),
+                ('parse_ll1', lambda: packed_table.parse_ll1(ll1_packed, ids)),
+                ('packrat', lambda: parser.parse(syms))):
+            elapsed, _ = _timeit(func, 1)
+            print('  {:10} {:5} symbols {:9}: {:9.0f} tokens/s'.format(
+                name, len(syms), func_name, len(syms) / elapsed))
+        print('  {:10} {:5} symbols hit rate {:.4f}, peak memo {} bytes'.format(
+            name, len(syms), parser.stats.get_hit_rate(), parser.stats.peak_memo_bytes))
+    grammar = bnf_parser.parse(workloads.gen_paths(8))
+    syms = workloads.gen_sentence(grammar, 100000, 0)
+    for memory_limit in (None, 1 << 16, 1 << 12, 1 << 8):
+        parser = packrat.PackratParser(grammar, memory_limit)
+        elapsed, _ = _timeit(lambda: parser.parse(syms), 1)
+        stats = parser.stats
+        print('  paths {} symbols, memo limit {:>6}: {:9.0f} tokens/s, hit rate {:.4f}, '
+              'peak memo {} bytes, {} evictions'.format(
+                  len(syms), str(memory_limit), len(syms) / elapsed, stats.get_hit_rate(),
+                  stats.peak_memo_bytes, stats.evictions))
+
+
+def bench_minimize():
+    # LR(1) tables with their equivalent states merged: the time it takes,
+    # the sizes and the packed parse before and after
+    for name in ('json', 'sql', 'expr_tower', 'long', 'wide'):
+        gen, size = workloads.GRAMMARS[name]
+        grammar = bnf_parser.parse(gen(size))
+        lr_grammar, table = _build_lr_table(grammar)
+        elapsed, (minimized, _) = _timeit(lambda: lr_minimize.minimize_table(table), 1)
+        sizes = list(lr_minimize.iter_sizes_rows(lr_grammar, table, minimized))
+        print('  {:10}: minimize {:7.2f} ms, '.format(name, elapsed * 1000) + ', '.join(
+            '{} {} -> {}'.format(*row) for row in sizes))
+        syms = workloads.gen_sentence(grammar, 20000, 0)
+        for table_name, parse_table in (('full', table), ('minimized', minimized)):
+            packed = packed_table.pack_lr_table(lr_grammar, parse_table)
+            term_ids = dict((term, i) for i, term in enumerate(packed.terms))
+            ids = [term_ids[sym] for sym in syms]
+            elapsed, _ = _timeit(lambda: packed_table.parse_lr(packed, ids), 3)
+            print('  {:10}: parse_lr {:9} table {:9.0f} tokens/s'.format(
+                name, table_name, len(ids) / elapsed))
+
+
+def bench_trace():
+    # The steps of an LR parse printed whole against recorded as a trace
+    # and one page of it rendered, as the input grows; the whole print is
+    # quadratic in the input and only timed on the small ones, str_parse
+    # joining it and iter_parse aligning it a page at a time
+    grammar = bnf_parser.parse(workloads.gen_json())
+    _, table = _build_lr_table(grammar)
+    with open(os.devnull, 'w') as null_file:
+        for length in (1000, 4000, 100000, 1000000):
+            syms = workloads.gen_sentence(grammar, length, 0)
+            trace = parse_trace.record_lr(table, syms)
+            page = parse_trace.get_page_count(trace, 50) // 2
+            funcs = [('record_lr', lambda: parse_trace.record_lr(table, syms)),
+                     ('middle page', lambda: report.write_lines(
+                         parse_trace.iter_trace(trace, page), null_file))]
+            if length < 10000:
+                funcs[:0] = [('str_parse', lambda: print(
+                                 lr.str_parse(table, syms), file=null_file)),
+                             ('iter_parse', lambda: report.write_lines(
+                                 lr.iter_parse(table, syms), null_file))]
+            for name, func in funcs:
+                elapsed, peak = _measure_report(func)
+                print('  {:7} tokens {:12}: {:9.2f} ms, peak {:9.2f} MiB'.format(
+                    len(syms), name, elapsed * 1000, peak / 1024 / 1024))
+            print('  {:7} tokens {} steps: {:.2f} bytes/step'.format(
+                len(syms), len(trace), trace.get_byte_size() / len(trace)))
+
+
+def bench_startup():
+    # Latency of a cli.py parse of a small input, the grammar read from the
+    # BNF or from a bundle compiled ahead of time, against the interpreter
+    # alone. The .pyc of the modules are written as an installed tree would.
+    cli_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    with tempfile.TemporaryDirectory() as tmp_dir, open(os.devnull, 'w') as null_file:
+        def run(*args):
+            subprocess.check_call((sys.executable,) + args, env=env, stdout=null_file)
+        elapsed, _ = _timeit(lambda: run('-c', 'pass'), 10)
+        print('  {:11}: python {:7.2f} ms'.format('', elapsed * 1000))
+        for name, size in (('json', 0), ('sql', 0), ('expr_cycles', 20), ('wide', 500)):
+            bnf = workloads.GRAMMARS[name][0](size)
+            paths = dict((ext, os.path.join(tmp_dir, name + ext))
+                         for ext in ('.bnf', '.bundle', '.sym'))
+            with open(paths['.bnf'], 'w') as bnf_file:
+                bnf_file.write(bnf)
+            with open(paths['.sym'], 'w') as sym_file:
+                sym_file.write(' '.join(workloads.gen_sentence(bnf_parser.parse(bnf), 20, 0)))
+            elapsed, _ = _timeit(lambda: run(cli_path, 'compile', paths['.bnf'],
+                                             paths['.bundle'], '--parsers', 'lr1'), 1)
+            print('  {:11}: compile {:7.2f} ms, {} bytes'.format(
+                name, elapsed * 1000, os.path.getsize(paths['.bundle'])))
+            for ext in ('.bnf', '.bundle'):
+                args = (cli_path, paths[ext], '--parse-lr1', paths['.sym'])
+                elapsed, _ = _timeit(lambda: run(*args), 10)
+                print('  {:11}: --parse-lr1 from {:6} {:7.2f} ms'.format(
+                    name, ext[1:], elapsed * 1000))
+
+
+def _measure_kept(func):
+    # The result of func and the memory it keeps allocated
+    tracemalloc.start()
+    result = func()
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return kept, result
+
+
+def bench_table_store():
+    # The 32 sql dialects kept as built, loaded from a packed table each and
+    # from one table store: the memory kept, the load and the parse times
+    def build(n):
+        grammar = bnf_parser.parse(workloads.gen_sql_dialect(n))
+        first = ll1.construct_first(grammar)
+        follow = ll1.construct_follow(grammar, first)
+        lr_grammar = lr.construct_argumented_grammar(grammar)
+        algo_suit = lr.LR1AlgorithmSuit(lr_grammar)
+        states = lr.construct_states(lr_grammar, algo_suit)
+        table = lr.construct_table(lr_grammar, states, algo_suit)
+        return grammar, first, follow, lr_grammar, states, table
+
+    names = ['sql{}'.format(n) for n in range(32)]
+    kept, built = _measure_kept(lambda: [build(n) for n in range(32)])
+    print('  {:28}: {:9.1f} KiB'.format('built, kept', kept / 1024))
+    tables = dict((name, packed_table.pack_lr_table(lr_grammar, table))
+                  for name, (_, _, _, lr_grammar, _, table) in zip(names, built))
+    del built
+    buffers = dict((name, packed.to_bytes()) for name, packed in tables.items())
+    kept, _ = _measure_kept(lambda: [packed_table.PackedLRTable.from_bytes(buf)
+                                     for buf in buffers.values()])
+    print('  {:28}: {:9.1f} KiB, files {:9.1f} KiB'.format(
+        'packed tables, kept', kept / 1024,
+        sum(len(buf) for buf in buffers.values()) / 1024))
+
+    syms = workloads.gen_sentence(bnf_parser.parse(workloads.gen_sql_dialect(31)), 100000)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'sql.store')
+
+        def write():
+            with open(path, 'wb') as output_file:
+                table_store.write_table_store(tables, output_file)
+        elapsed, _ = _timeit(write, 1)
+        with table_store.open_table_store(path) as store:
+            stats = dict(table_store.iter_stats_rows(store))
+            print('  {:28}: {:9.2f} ms, {} of {} rows unique'.format(
+                'store, written', elapsed * 1000, stats['unique rows'], stats['rows']))
+        kept, store = _measure_kept(lambda: table_store.open_table_store(path))
+        kept_tables, stored = _measure_kept(lambda: [store.get(name) for name in names])
+        print('  {:28}: {:9.1f} KiB, file {:9.1f} KiB mapped'.format(
+            'store, kept', (kept + kept_tables) / 1024, os.path.getsize(path) / 1024))
+
+        elapsed, _ = _timeit(lambda: [packed_table.PackedLRTable.from_bytes(buf)
+                                      for buf in buffers.values()])
+        print('  {:28}: {:9.2f} us per grammar'.format(
+            'load packed table', elapsed / len(names) * 1e6))
+        elapsed, _ = _timeit(lambda: [store.get(name) for name in names])
+        print('  {:28}: {:9.2f} us per grammar'.format(
+            'load from store', elapsed / len(names) * 1e6))
+
+        packed = tables['sql31']
+        ids = [packed.sym_ids[sym] for sym in syms]
+        elapsed, _ = _timeit(lambda: packed_table.parse_lr(packed, ids))
+        print('  {:28}: {:9.0f} tokens/s'.format('parse packed table', len(ids) / elapsed))
+        ids = [store.term_ids[sym] for sym in syms]
+        elapsed, _ = _timeit(lambda: table_store.parse_lr(stored[-1], ids))
+        print('  {:28}: {:9.0f} tokens/s'.format('parse from store', len(ids) / elapsed))
+        store.close()
+
+
+# (grammar, size) pairs timed by the suite, sizes are multiplied by --scale
+SUITE = (
+    ('expr_cycles', 20),
+    ('expr_tower', 12),
+    ('chain', 100),
+    ('wide', 500),
+    ('json', 0),
+    ('sql', 0),
+    ('ambiguous', 6),
+)
+
+
+def _time_phase(results: dict, key: str, func):
+    # Drivers may fail on tables with conflicts since they take the first
+    # action; those phases are recorded as None.
+    try:
+        elapsed, result = _timeit(func, 1)
+    except (AssertionError, IndexError, KeyError, ParseError):
+        results[key] = None
+        return None
+    if results.get(key, elapsed) is not None:
+        results[key] = min(results.get(key, elapsed), elapsed)
+    return result
+
+
+def _run_workload(results: dict, name: str, bnf: str, length: int):
+    nop = lambda *args: None
+    measure = lambda phase, func: _time_phase(results, name + '.' + phase, func)
+
+    grammar = measure('parse_bnf', lambda: bnf_parser.parse(bnf))
+    syms = workloads.gen_sentence(grammar, length)
+    elim = measure('left_elim', lambda: left_recursion_eliminator.eliminate(grammar))
+    first = measure('first', lambda: ll1.construct_first(elim))
+    follow = measure('follow', lambda: ll1.construct_follow(elim, first))
+    ll1_table = measure('ll1_table', lambda: ll1.construct_table(elim, first, follow))
+
+    lr_grammar = measure('lr_grammar', lambda: lr.construct_argumented_grammar(grammar))
+    lr0_suit = lr.LR0AlgorithmSuit(lr_grammar)
+    lr0_states = measure('lr0_states', lambda: lr.construct_states(lr_grammar, lr0_suit))
+    lr0_table = measure('lr0_table', lambda: lr.construct_table(
+        lr_grammar, lr0_states, lr0_suit))
+    slr1_table = measure('slr1_table', lambda: lr.construct_table(
+        lr_grammar, lr0_states, lr.SLR1AlgorithmSuit(lr_grammar)))
+    lr1_suit = lr.LR1AlgorithmSuit(lr_grammar)
+    lr1_states = measure('lr1_states', lambda: lr.construct_states(lr_grammar, lr1_suit))
+    lr1_table = measure('lr1_table', lambda: lr.construct_table(
+        lr_grammar, lr1_states, lr1_suit))
+
+    measure('parse_ll1', lambda: ll1.parse(elim, ll1_table, syms, nop))
+    for phase, table in (('parse_lr0', lr0_table), ('parse_slr1', slr1_table),
+                         ('parse_lr1', lr1_table)):
+        measure(phase, lambda: lr.parse(table, syms, nop))
+
+
+def run_suite(scale=1.0, length=2000, rounds=5) -> dict:
+    # The whole suite runs once per round and the best time of every phase
+    # is kept, so that no phase is measured only while the machine is busy.
+    results = dict()
+    for _ in range(rounds):
+        for name, size in SUITE:
+            bnf = workloads.GRAMMARS[name][0](int(size * scale))
+            _run_workload(results, name, bnf, int(length * scale))
+    for key, elapsed in results.items():
+        if elapsed is None:
+            print('  {:32}: failed'.format(key))
+        else:
+            print('  {:32}: {:10.3f} ms'.format(key, elapsed * 1000))
+    return results
+
+
+def save_baseline(path: str, results: dict, meta: dict):
+    with open(path, 'w') as baseline_file:
+        json.dump(dict(meta=meta, results=results), baseline_file,
+                  indent=2, sort_keys=True)
+
+
+def compare_baseline(baseline: dict, results: dict, tolerance=0.25,
+                     min_time=1e-3) -> list:
+    # Returns the keys that got slower than tolerance allows. Phases where
+    # both timings are below min_time are too noisy to be compared.
+    regressions = list()
+    old_results = baseline['results']
+    for key in sorted(set(old_results) | set(results)):
+        old = old_results.get(key)
+        new = results.get(key)
+        if key not in results:
+            print('  {:32}: missing'.format(key))
+            continue
+        if old is None or new is None:
+            if (old is None) != (new is None):
+                print('  {:32}: {} -> {}'.format(
+                    key, 'failed' if old is None else 'ok',
+                    'failed' if new is None else 'ok'))
+            if old is not None:
+                regressions.append(key)
+            continue
+        if old < min_time and new < min_time:
+            continue
+        ratio = new / old
+        if ratio > 1 + tolerance:
+            status = 'REGRESSION'
+            regressions.append(key)
+        elif ratio < 1 / (1 + tolerance):
+            status = 'faster'
+        else:
+            continue
+        print('  {:32}: {:10.3f} -> {:10.3f} ms ({:.2f}x) {}'.format(
+            key, old * 1000, new * 1000, ratio, status))
+    return regressions
+
+BENCHMARKS = dict(
+    left_elim=bench_left_elim,
+    derive=bench_derive,
+    incremental=bench_incremental,
+    reparse=bench_reparse,
+    codegen=bench_codegen,
+    reports=bench_reports,
+    parse_stats=bench_parse_stats,
+    recovery=bench_recovery,
+    token_stream=bench_token_stream,
+    threads=bench_threads,
+    parallel_lr=bench_parallel_lr,
+    goto=bench_goto,
+    forest=bench_forest,
+    batch=bench_batch,
+    parallel_parse=bench_parallel_parse,
+    ll_star=bench_ll_star,
+    packrat=bench_packrat,
+    minimize=bench_minimize,
+    trace=bench_trace,
+    startup=bench_startup,
+    table_store=bench_table_store,
+)
+
+
+def parse_input(args):
+    parser = argparse.ArgumentParser(
+        description='Benchmark grammar processing and parsing.')
+    parser.add_argument('names', metavar='NAME', nargs='*',
+                        help='Benchmarks to run, the suite by default, or any '
+                             'of ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--save', metavar='JSON_FILE',
+                        help='Save the suite timings as a baseline')
+    parser.add_argument('--compare', metavar='JSON_FILE',
+                        help='Compare the suite timings with a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Slowdown ratio over 1 reported as a regression')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiply grammar sizes and input lengths')
+    parser.add_argument('--length', type=int, default=2000,
+                        help='Length of the parsed sentences')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='Run the suite this many times and keep the best')
+    result = parser.parse_args(args)
+    for name in result.names:
+        if name != 'suite' and name not in BENCHMARKS:
+            parser.error('unknown benchmark ' + name)
+    return result
+
+
+def main():
+    args = parse_input(sys.argv[1:])
+    names = args.names or ['suite']
+    for name in names:
+        if name != 'suite':
+            print(name + ':')
+            BENCHMARKS[name]()
+            continue
+
+        print('suite:')
+        results = run_suite(args.scale, args.length, args.rounds)
+        meta = dict(python=sys.version.split()[0], scale=args.scale,
+                    length=args.length, rounds=args.rounds)
+        if args.save:
+            save_baseline(args.save, results, meta)
+        if args.compare:
+            with open(args.compare) as baseline_file:
+                baseline = json.load(baseline_file)
+            if baseline['meta'] != meta:
+                print('warning: baseline taken with ' + json.dumps(baseline['meta']))
+            print('compare with {}:'.format(args.compare))
+            regressions = compare_baseline(baseline, results, args.tolerance)
+            if regressions:
+                print('{} regressions'.format(len(regressions)))
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,14 @@
 #!/usr/bin/env python
 from enum import Enum
-from grammar import Grammar
+from grammar import Grammar, GrammarBuilder
+import instrument
 
 
 class _BNFParser:
     '''
-    bnf  := prod end | prod bnf
+    bnf  := prod end | prod bnf | sync end | sync bnf
     prod := nterm ':=' rhs
+    sync := '%sync' syms
     syms := sym | sym syms
     rhs  := syms | syms '|' rhs
     '''
@@ -19,9 +21,10 @@ class _BNFParser:
     def __init__(self, buf: str):
         self.pos = 0
         self.tokens = self.tokenize(buf)
-        self.grammar = Grammar()
+        self.builder = GrammarBuilder()
         self.parse_bnf()
-        self.fix_grammar()
+        self.grammar = self.builder.build()
+        self.check_grammar()
 
     def peek(self):
         if self.pos < len(self.tokens):
@@ -36,12 +39,11 @@ class _BNFParser:
     def unget(self, n=1):
         self.pos -= n
 
-    def fix_grammar(self):
-        all_syms = set()
-        for prodlist in self.grammar.prods.values():
-            for prod in prodlist:
-                all_syms.update(prod.syms)
-        self.grammar.terms = all_syms - self.grammar.prods.keys() - set('@')
+    def check_grammar(self):
+        unknown = self.grammar.sync - self.grammar.terms
+        if unknown:
+            raise SyntaxError("Synchronizing symbols must be terminals: " +
+                              " ".join(sorted(unknown)))
 
     def parse_rhs(self):
         result = list()
@@ -62,21 +64,32 @@ class _BNFParser:
         if token[0] != self.Token.SYM:
             raise SyntaxError("Nonterminal expected, got " + str(token))
         nterm = token[1]
-        if not self.grammar.start:
-            self.grammar.start = nterm
+        if not self.builder.start:
+            self.builder.start = nterm
 
         token = self.get()
         if token[0] != self.Token.KEYWORD or token[1] != ':=':
             raise SyntaxError("Keyword ':=' expected, got " + str(token))
 
+        alternatives = list()
         while True:
             if self.peek()[0] == self.Token.END:
-                return
+                break
             prod_list = self.parse_rhs()
             if not len(prod_list):
                 raise SyntaxError("Empty right hand side of production "
                                   "for nonterminal " + nterm)
-            self.grammar.add_production(nterm, prod_list)
+            alternatives.append(prod_list)
+        self.builder.add_productions(nterm, alternatives)
+
+    def parse_sync(self):
+        self.get()
+        syms = list()
+        while self.peek()[0] == self.Token.SYM:
+            syms.append(self.get()[1])
+        if not syms:
+            raise SyntaxError("Terminals expected after '%sync'")
+        self.builder.sync.update(syms)
 
     def parse_bnf(self):
         while True:
@@ -86,6 +99,8 @@ class _BNFParser:
                     return
                 else:
                     self.get()
+            elif token == (self.Token.SYM, '%sync'):
+                self.parse_sync()
             else:
                 self.parse_prod()
 
@@ -126,6 +141,7 @@ class _BNFParser:
         return result
 
 
+@instrument.timed('bnf_parser.parse')
 def parse(bnf: str) -> Grammar:
     parser = _BNFParser(bnf)
     return parser.grammar
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import os
+import pickle
+import hashlib
+
+# A bundle keeps what `cli.py compile` built for a grammar: the grammar, its
+# terminals, which number the token streams, and the tables of the parsers
+# chosen, named like the artifacts of cli.py. A run loading it parses no
+# BNF and builds nothing it holds. Layout: MAGIC, the digest of the modules
+# that build the artifacts, then the artifacts as a pickled dict; the
+# bundles are only valid for the version of the modules that wrote them,
+# the others are rejected as stale.
+MAGIC = b'TPB1'
+MODULES = ('bundle', 'grammar', 'll1', 'lr', 'lr_minimize', 'packed_table')
+
+# The artifacts kept for every parser, besides the grammar and terminals
+PARSERS = dict(
+    ll1=('first', 'follow', 'll1_table', 'll1_packed'),
+    lr0=('lr_grammar', 'lr0_table', 'lr0_packed'),
+    slr1=('lr_grammar', 'slr1_table', 'slr1_packed'),
+    lr1=('lr_grammar', 'lr1_table', 'lr1_packed'),
+)
+# The tables of the LR parsers with their states merged, kept for the
+# bundles built with minimize along with the merge of the states
+MINIMIZED = dict(lr0='lr0_minimized', slr1='slr1_minimized', lr1='lr1_minimized')
+
+
+def get_digest() -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    for name in MODULES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name + '.py'),
+                  'rb') as module_file:
+            digest.update(module_file.read())
+    return digest.digest()
+
+
+def is_bundle(path: str) -> bool:
+    with open(path, 'rb') as input_file:
+        return input_file.read(4) == MAGIC
+
+
+def write_bundle(get, output_file, parsers=tuple(PARSERS), minimize=False):
+    # get(key): the artifact named key, built if needed, like the one of
+    # cli.py; minimize: whether the LR tables of get are minimized, which
+    # the bundle records as the artifact 'minimize'
+    keys = ['grammar', 'terms']
+    for parser in parsers:
+        keys.extend(key for key in PARSERS[parser] if key not in keys)
+        if minimize and parser in MINIMIZED:
+            keys.append(MINIMIZED[parser])
+    artifacts = dict((key, get(key)) for key in keys)
+    artifacts['minimize'] = minimize
+    output_file.write(MAGIC + get_digest())
+    pickle.dump(artifacts, output_file, pickle.HIGHEST_PROTOCOL)
+
+
+def read_bundle(input_file) -> dict:
+    # Raises ValueError if input_file is not a bundle or a stale one
+    if input_file.read(4) != MAGIC:
+        raise ValueError('Not a grammar bundle')
+    if input_file.read(16) != get_digest():
+        raise ValueError('Stale grammar bundle, written by other versions of the modules')
+    return pickle.load(input_file)
+
+
+def main():
+    import io
+    import bnf_parser
+    import lr
+    import packed_table
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    grammar = bnf_parser.parse(bnf)
+    lr_grammar = lr.construct_argumented_grammar(grammar)
+    algo_suit = lr.SLR1AlgorithmSuit(lr_grammar)
+    table = lr.construct_table(lr_grammar, lr.construct_states(lr_grammar, algo_suit),
+                               algo_suit)
+    context = dict(grammar=grammar, terms=packed_table.construct_terms(grammar),
+                   lr_grammar=lr_grammar, slr1_table=table,
+                   slr1_packed=packed_table.pack_lr_table(lr_grammar, table))
+
+    output_file = io.BytesIO()
+    write_bundle(context.__getitem__, output_file, ('slr1',))
+    print('{} bytes'.format(len(output_file.getvalue())))
+    output_file.seek(0)
+    artifacts = read_bundle(output_file)
+    print('  ' + ', '.join(sorted(artifacts)))
+    print(lr.str_parse(artifacts['slr1_table'], 'id * ( id + id )'.split()))
+
+
+if __name__ == '__main__':
+    main()
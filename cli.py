@@ -1,17 +1,54 @@
 #!/usr/bin/env python
+import os
 import sys
 import argparse
-import ll1
-import lr
-import bnf_parser
-import left_recursion_eliminator
+import importlib.util
+import report
+import parse_error
+
+
+def _lazy_import(name: str):
+    # The module, run on the first use of one of its attributes: a command
+    # only loads the engines it uses. It is registered as imported so that
+    # the engines importing it get the same module; an import statement
+    # runs it though, the engines import what only their main() uses in
+    # main().
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = sys.modules[name] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+pickle = _lazy_import('pickle')
+ll1 = _lazy_import('ll1')
+lr = _lazy_import('lr')
+bnf_parser = _lazy_import('bnf_parser')
+left_recursion_eliminator = _lazy_import('left_recursion_eliminator')
+incremental = _lazy_import('incremental')
+packed_table = _lazy_import('packed_table')
+codegen = _lazy_import('codegen')
+instrument = _lazy_import('instrument')
+parse_stats = _lazy_import('parse_stats')
+token_stream = _lazy_import('token_stream')
+parallel_lr = _lazy_import('parallel_lr')
+forest = _lazy_import('forest')
+ll_star = _lazy_import('ll_star')
+packrat = _lazy_import('packrat')
+lr_minimize = _lazy_import('lr_minimize')
+parse_trace = _lazy_import('parse_trace')
+bundle = _lazy_import('bundle')
 
 
 def parse_input(args):
     parser = argparse.ArgumentParser(
         description='Demonstrate processing and parsing of various grammars.')
     parser.add_argument('bnf', metavar='BNF_FILE',
-                        help='The input grammar written in BNF')
+                        help='The input grammar written in BNF, or a bundle '
+                             'written by `cli.py compile`')
     parser.add_argument('-e', '--left-elim', action='store_true',
                         help='Eliminate left recursion on the input grammar')
     parser.add_argument('-g', '--grammar', action='store_true',
@@ -20,6 +57,19 @@ def parse_input(args):
                         help='Print the FIRST set')
     parser.add_argument('-F', '--follow', action='store_true',
                         help='Print the FOLLOW set')
+    parser.add_argument('--format', choices=report.FORMATS, default='text',
+                        help='Output format of the reports')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the time and counters of every phase to stderr')
+    parser.add_argument('--profile-trace', metavar='JSON_FILE',
+                        help='Write the phases as a Chrome trace to JSON_FILE')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='Also record the peak memory of every phase')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Build the LR states in JOBS worker processes')
+    parser.add_argument('--cache', metavar='CACHE_FILE',
+                        help='Reuse the artifacts of the previous run stored in '
+                             'CACHE_FILE and update them for the edited grammar')
 
     parser.add_argument('--ll1-table', action='store_true',
                         help='Print the LL(1) table')
@@ -51,8 +101,16 @@ def parse_input(args):
     parser.add_argument('--lr1-dfa', action='store_true',
                         help='Export the LR(1) DFA graph')
 
+    parser.add_argument('--minimize', action='store_true',
+                        help='Merge the equivalent states of the LR tables, '
+                             'report the sizes saved and use the merged states '
+                             'everywhere')
     parser.add_argument('--parse-old', action='store_true',
                         help='Demonstrate LR parsing in the old style')
+    parser.add_argument('--pack-tokens', nargs=2, metavar=('SYM_FILE', 'TOKEN_FILE'),
+                        help='Convert the symbols of SYM_FILE to a binary token '
+                             'stream numbered like the packed tables; token '
+                             'streams are accepted wherever a SYM_FILE is')
     parser.add_argument('--parse-ll1', dest='ll1_sym', metavar='SYM_FILE',
                         help='Demonstrate the parsing of the LL(1) grammar')
     parser.add_argument('--parse-lr0', dest='lr0_sym', metavar='SYM_FILE',
@@ -61,20 +119,121 @@ def parse_input(args):
                         help='Demonstrate the parsing of the SLR(1) grammar')
     parser.add_argument('--parse-lr1', dest='lr1_sym', metavar='SYM_FILE',
                         help='Demonstrate the parsing of the LR(1) grammar')
+    parser.add_argument('--parse-forest', dest='forest_sym', metavar='SYM_FILE',
+                        help='Parse with the Earley parser, which takes any '
+                             'grammar, and report the ambiguities and the best '
+                             'trees')
+    parser.add_argument('--parse-packrat', dest='packrat_sym', metavar='SYM_FILE',
+                        help='Parse with the packrat parser, the alternatives '
+                             'being an ordered choice, and print the memo '
+                             'statistics')
+    parser.add_argument('--memo-limit', type=int, metavar='BYTES',
+                        help='Memory of the packrat memo, a sliding window '
+                             'over the input (default: unbounded)')
+    parser.add_argument('--top-k', type=int, default=3, metavar='K',
+                        help='Number of trees printed by --parse-forest, the '
+                             'ones with the fewest productions (default: 3)')
+    parser.add_argument('--ll-star', action='store_true',
+                        help='Pick the production of the LL(1) conflicts by '
+                             'looking further ahead in --parse-ll1 and print '
+                             'the statistics of the lookahead cache')
+    parser.add_argument('--parse-stats', action='store_true',
+                        help='Count state visits and reductions while parsing '
+                             'and print the hottest ones instead of the steps')
+    parser.add_argument('--recover', choices=parse_error.MODES,
+                        help='Recover from syntax errors while parsing and '
+                             'print all of them instead of the steps')
+    parser.add_argument('--parse-heat', action='store_true',
+                        help='Export the DFA graph of the LR parses with the '
+                             'states colored by their visits')
+    parser.add_argument('--trace', action='store_true',
+                        help='Record the steps of --parse-ll1/lr0/slr1/lr1 to '
+                             'BNF_FILE.<parser>.trace and print one page of '
+                             'them instead of all')
+    parser.add_argument('--show-trace', metavar='TRACE_FILE',
+                        help='Print the steps of a recorded trace')
+    parser.add_argument('--diff-trace', nargs=2, metavar=('TRACE_FILE', 'OTHER_FILE'),
+                        help='Print the steps around the first difference of '
+                             'two recorded traces')
+    parser.add_argument('--trace-page', type=int, metavar='N',
+                        help='Page of the trace printed, from 1 (default: the '
+                             'first one for --trace, all for --show-trace)')
+    parser.add_argument('--page-size', type=int, default=50, metavar='STEPS',
+                        help='Steps per page of the traces and of the parses '
+                             'printed, aligned a page at a time (default: 50)')
+
+    parser.add_argument('--gen-ll1', metavar='PY_FILE',
+                        help='Generate a table-driven LL(1) parser module')
+    parser.add_argument('--gen-ll1-rd', metavar='PY_FILE',
+                        help='Generate a recursive descent LL(1) parser module')
+    parser.add_argument('--gen-lr0', metavar='PY_FILE',
+                        help='Generate an LR(0) parser module')
+    parser.add_argument('--gen-slr1', metavar='PY_FILE',
+                        help='Generate an SLR(1) parser module')
+    parser.add_argument('--gen-lr1', metavar='PY_FILE',
+                        help='Generate an LR(1) parser module')
     return parser.parse_args(args)
 
 
+def _title(args, text):
+    if args.format == 'text':
+        print(text)
+
+
+def _report(args, name, lines, columns, rows):
+    # lines and rows are generators, only the one for the format is consumed
+    if args.format == 'text':
+        report.write_lines(lines, sys.stdout)
+    else:
+        report.write_rows(name, columns, rows, sys.stdout, args.format)
+
+
+def _report_first(args, name, grammar, first):
+    lines = ll1.iter_first(grammar, first) if name == 'first' \
+        else ll1.iter_follow(grammar, first)
+    _report(args, name, lines, ll1.FIRST_COLUMNS, ll1.iter_first_rows(grammar, first))
+
+
+def _get_states(args, get, prefix, states_key):
+    # The states numbered as in the table of prefix
+    if not args.minimize:
+        return get(states_key)
+    return lr_minimize.merge_states(get(states_key), get(prefix + '_minimized')[1])
+
+
+def _report_lr(args, prefix, get):
+    if getattr(args, prefix + '_state'):
+        states = _get_states(args, get, prefix, prefix + '_state')
+        _report(args, prefix + '_states', lr.iter_states(states),
+                lr.STATES_COLUMNS, lr.iter_states_rows(states))
+    if getattr(args, prefix + '_transition'):
+        states = _get_states(args, get, prefix, prefix + '_state')
+        _report(args, prefix + '_transitions', lr.iter_transitions(states),
+                lr.TRANSITIONS_COLUMNS, lr.iter_transitions_rows(states))
+    if getattr(args, prefix + '_table'):
+        table = get(prefix + '_table')
+        _report(args, prefix + '_table', lr.iter_table(table),
+                lr.TABLE_COLUMNS, lr.iter_table_rows(table))
+    if getattr(args, prefix + '_dfa'):
+        with open('{}.{}.dot'.format(args.bnf, prefix), 'w') as export_file:
+            lr.dump_dfa(_get_states(args, get, prefix, prefix + '_state'), export_file)
+
+
 def process_ll(args, get):
     if args.first or args.follow or args.ll1_table or args.ll1_conflict:
-        print('LL(1):')
+        _title(args, 'LL(1):')
     if args.first:
-        print(ll1.str_first(get('grammar'), get('first')))
+        _report_first(args, 'first', get('grammar'), get('first'))
     if args.follow:
-        print(ll1.str_follow(get('grammar'), get('follow')))
+        _report_first(args, 'follow', get('grammar'), get('follow'))
     if args.ll1_table:
-        print(ll1.str_table(get('ll1_table')))
+        table = get('ll1_table')
+        _report(args, 'll1_table', ll1.iter_table(table),
+                ll1.TABLE_COLUMNS, ll1.iter_table_rows(table))
     if args.ll1_conflict:
-        print(ll1.str_conflicts(get('ll1_conflict')))
+        conflicts = get('ll1_conflict')
+        _report(args, 'll1_conflict', ll1.iter_conflicts(conflicts),
+                ll1.TABLE_COLUMNS, ll1.iter_conflicts_rows(conflicts))
 
 
 def process_lr(args, get):
@@ -83,61 +242,225 @@ def process_lr(args, get):
         print(get('lr_grammar'))
 
     if args.lr0_state or args.lr0_transition or args.lr0_table:
-        print('LR(0):')
-    if args.lr0_state:
-        print(lr.str_states(get('lr0_state')))
-    if args.lr0_transition:
-        print(lr.str_transitions(get('lr0_state')))
-    if args.lr0_table:
-        print(lr.str_table(get('lr0_table')))
-    if args.lr0_dfa:
-        lr.dump_dfa(get('lr0_state'), open(args.bnf + '.lr0.dot', 'w'))
+        _title(args, 'LR(0):')
+    _report_lr(args, 'lr0', get)
 
     if args.slr1_table:
-        print('SLR(1):')
-        print(lr.str_table(get('slr1_table')))
+        _title(args, 'SLR(1):')
+        table = get('slr1_table')
+        _report(args, 'slr1_table', lr.iter_table(table),
+                lr.TABLE_COLUMNS, lr.iter_table_rows(table))
 
 
 def process_lr1(args, get):
     if args.lr1_state or args.lr1_transition or args.lr1_table:
-        print('LR(1):')
-    if args.lr1_state:
-        print(lr.str_states(get('lr1_state')))
-    if args.lr1_transition:
-        print(lr.str_transitions(get('lr1_state')))
-    if args.lr1_table:
-        print(lr.str_table(get('lr1_table')))
-    if args.lr1_dfa:
-        lr.dump_dfa(get('lr1_state'), open(args.bnf + '.lr1.dot', 'w'))
+        _title(args, 'LR(1):')
+    _report_lr(args, 'lr1', get)
+
+
+def _report_parse_stats(args, prefix, stats):
+    if args.format == 'text':
+        report.write_lines(parse_stats.iter_report(stats), sys.stdout)
+        return
+    report.write_rows(prefix + '_hot_states', parse_stats.STATES_COLUMNS,
+                      parse_stats.iter_states_rows(stats), sys.stdout, args.format)
+    report.write_rows(prefix + '_hot_productions', parse_stats.PRODUCTIONS_COLUMNS,
+                      parse_stats.iter_productions_rows(stats), sys.stdout, args.format)
+
+
+def _report_errors(args, prefix, errors):
+    _report(args, prefix + '_errors', parse_error.iter_errors(errors),
+            parse_error.ERRORS_COLUMNS, parse_error.iter_errors_rows(errors))
+
+
+def _read_syms(path):
+    if token_stream.is_token_stream(path):
+        return token_stream.open_token_stream(path)
+    return open(path).read().split()
+
+
+def _parse_packed(args, packed, syms, parse):
+    # Token streams are parsed straight from the mapped ids unless the
+    # options need the symbol names
+    if not isinstance(syms, token_stream.TokenStream) or \
+       args.recover or args.parse_stats or args.parse_heat:
+        return False
+    prods = parse(packed, syms.get_ids(packed.terms))
+    print('  {} tokens, {} productions'.format(len(syms), len(prods)))
+    return True
+
+
+def _report_trace(args, name, trace, page):
+    if page is None:
+        begin, end = 0, len(trace)
+    else:
+        begin, end = (page - 1) * args.page_size, page * args.page_size
+    replay = parse_trace.TraceReplay(trace)
+    _report(args, name, parse_trace.iter_trace(trace, page, args.page_size, replay=replay),
+            parse_trace.TRACE_COLUMNS,
+            parse_trace.iter_trace_rows(trace, begin, end, replay=replay))
+
+
+def _write_trace(args, prefix, trace):
+    path = '{}.{}.trace'.format(args.bnf, prefix)
+    with open(path, 'wb') as trace_file:
+        trace_file.write(trace.to_bytes())
+    print('  {} steps, {} bytes, written to {}'.format(
+        len(trace), trace.get_byte_size(), path))
+    _report_trace(args, prefix + '_trace', trace, args.trace_page or 1)
+
+
+def _process_parse_lr(args, get, prefix, states_key, path):
+    syms = _read_syms(path)
+    if _parse_packed(args, get(prefix + '_packed'), syms, packed_table.parse_lr):
+        return
+    table = get(prefix + '_table')
+    if args.recover:
+        errors = lr.parse(table, syms, recovery=parse_error.Recovery(args.recover))
+        _report_errors(args, prefix, errors)
+        return
+    if args.trace:
+        _write_trace(args, prefix, parse_trace.record_lr(table, syms))
+        return
+    if not args.parse_stats and not args.parse_heat:
+        report.write_lines(lr.iter_parse(table, syms, args.parse_old, args.page_size),
+                           sys.stdout)
+        return
+    stats = parse_stats.collect_lr(table, syms)
+    if args.parse_stats:
+        _report_parse_stats(args, prefix, stats)
+    if args.parse_heat:
+        with open('{}.{}.heat.dot'.format(args.bnf, prefix), 'w') as export_file:
+            parse_stats.dump_heat_dfa(_get_states(args, get, prefix, states_key), stats,
+                                      export_file)
 
 
 def process_parse(args, get):
-    get_syms = lambda path: open(path).read().split()
+    if args.pack_tokens:
+        sym_path, token_path = args.pack_tokens
+        with open(sym_path) as text_file, open(token_path, 'wb') as output_file:
+            token_stream.convert(text_file, output_file, get('terms'))
     if args.ll1_sym:
-        print('Parse of LL(1):')
-        print(ll1.str_parse(get('grammar'), get('ll1_table'), get_syms(args.ll1_sym)))
+        _title(args, 'Parse of LL(1):')
+        syms = _read_syms(args.ll1_sym)
+        if _parse_packed(args, get('ll1_packed'), syms, packed_table.parse_ll1):
+            pass
+        elif args.ll_star:
+            predictor = ll_star.Predictor(get('grammar'), get('ll1_table'))
+            recovery = parse_error.Recovery(args.recover, follow=get('follow')) \
+                if args.recover else None
+            errors = ll1.parse(get('grammar'), get('ll1_table'), syms,
+                               recovery=recovery, predictor=predictor)
+            if recovery:
+                _report_errors(args, 'll1', errors)
+            _report(args, 'll_star', ll_star.iter_stats(predictor),
+                    ll_star.STATS_COLUMNS, ll_star.iter_stats_rows(predictor))
+        elif args.recover:
+            recovery = parse_error.Recovery(args.recover, follow=get('follow'))
+            _report_errors(args, 'll1', ll1.parse(
+                get('grammar'), get('ll1_table'), syms, recovery=recovery))
+        elif args.parse_stats:
+            _report_parse_stats(args, 'll1', parse_stats.collect_ll1(
+                get('grammar'), get('ll1_table'), syms))
+        elif args.trace:
+            _write_trace(args, 'll1', parse_trace.record_ll1(
+                get('grammar'), get('ll1_table'), syms))
+        else:
+            report.write_lines(ll1.iter_parse(get('grammar'), get('ll1_table'), syms,
+                                              args.page_size), sys.stdout)
     if args.lr0_sym:
-        print('Parse of LR(0):')
-        print(lr.str_parse(get('lr0_table'), get_syms(args.lr0_sym), args.parse_old))
+        _title(args, 'Parse of LR(0):')
+        _process_parse_lr(args, get, 'lr0', 'lr0_state', args.lr0_sym)
     if args.slr1_sym:
-        print('Parse of SLR(1):')
-        print(lr.str_parse(get('slr1_table'), get_syms(args.slr1_sym), args.parse_old))
+        _title(args, 'Parse of SLR(1):')
+        _process_parse_lr(args, get, 'slr1', 'lr0_state', args.slr1_sym)
     if args.lr1_sym:
-        print('Parse of LR(1):')
-        print(lr.str_parse(get('lr1_table'), get_syms(args.lr1_sym), args.parse_old))
+        _title(args, 'Parse of LR(1):')
+        _process_parse_lr(args, get, 'lr1', 'lr1_state', args.lr1_sym)
+    if args.forest_sym:
+        _title(args, 'Parse forest:')
+        result = forest.parse(get('grammar'), _read_syms(args.forest_sym))
+        counts = forest.construct_counts(result)
+        _report(args, 'forest_ambiguities', forest.iter_ambiguities_report(result, counts),
+                forest.AMBIGUITIES_COLUMNS, forest.iter_ambiguities(result, counts))
+        if counts[result.root] != float('inf'):
+            trees = forest.construct_top_k(result, args.top_k)
+            _report(args, 'forest_trees', forest.iter_trees_report(trees),
+                    forest.TREES_COLUMNS, forest.iter_trees_rows(trees))
+    if args.packrat_sym:
+        _title(args, 'Parse of packrat:')
+        syms = _read_syms(args.packrat_sym)
+        parser = packrat.PackratParser(get('grammar'), args.memo_limit)
+        prods = parser.parse(syms)
+        print('  {} tokens, {} productions'.format(len(syms), len(prods)))
+        _report(args, 'packrat', packrat.iter_stats(parser),
+                packrat.STATS_COLUMNS, packrat.iter_stats_rows(parser))
 
 
-def main():
-    args = parse_input(sys.argv[1:])
-    grammar = bnf_parser.parse(open(args.bnf).read())
+def _read_trace(path):
+    with open(path, 'rb') as trace_file:
+        return parse_trace.ParseTrace.from_bytes(trace_file.read())
 
-    if args.left_elim:
-        grammar = left_recursion_eliminator.eliminate(grammar)
-    if args.grammar:
-        print(grammar)
 
-    context = dict(grammar=grammar)
+def process_trace(args, get):
+    if args.show_trace:
+        _title(args, 'Trace {}:'.format(args.show_trace))
+        _report_trace(args, 'trace', _read_trace(args.show_trace), args.trace_page)
+    if args.diff_trace:
+        _title(args, 'Diff of {} and {}:'.format(*args.diff_trace))
+        print(parse_trace.str_diff(*map(_read_trace, args.diff_trace)))
+
+
+def process_codegen(args, get):
+    def write(path, source):
+        with open(path, 'w') as output_file:
+            output_file.write(source)
+    if args.gen_ll1:
+        write(args.gen_ll1, codegen.generate_ll1(get('ll1_packed')))
+    if args.gen_ll1_rd:
+        write(args.gen_ll1_rd, codegen.generate_ll1_recursive(get('ll1_packed')))
+    if args.gen_lr0:
+        write(args.gen_lr0, codegen.generate_lr(get('lr0_packed'), 'an LR(0)'))
+    if args.gen_slr1:
+        write(args.gen_slr1, codegen.generate_lr(get('slr1_packed'), 'an SLR(1)'))
+    if args.gen_lr1:
+        write(args.gen_lr1, codegen.generate_lr(get('lr1_packed'), 'an LR(1)'))
+
+
+def _get_table(args, get, prefix):
+    if args.minimize:
+        return get(prefix + '_minimized')[0]
+    return get(prefix + '_full_table')
+
+
+def process_minimize(args, get):
+    # The sizes of the tables the other options used
+    if not args.minimize:
+        return
+    for prefix, name in (('lr0', 'LR(0)'), ('slr1', 'SLR(1)'), ('lr1', 'LR(1)')):
+        if not any(getattr(args, prefix + suffix, None) for suffix in (
+                '_state', '_transition', '_table', '_dfa', '_sym')) and \
+           not getattr(args, 'gen_' + prefix):
+            continue
+        _title(args, 'Minimization of {}:'.format(name))
+        table = get(prefix + '_full_table')
+        minimized = get(prefix + '_minimized')[0]
+        _report(args, prefix + '_minimize',
+                lr_minimize.iter_sizes(get('lr_grammar'), table, minimized),
+                lr_minimize.SIZES_COLUMNS,
+                lr_minimize.iter_sizes_rows(get('lr_grammar'), table, minimized))
+
+
+def _new_getter(args, context: dict):
+    # get(key): the artifact named key, built on the first call from the
+    # grammar of the context and the ones it needs
+    grammar = context['grammar']
+    construct_states = lr.construct_states
+    if args.jobs > 1:
+        construct_states = lambda grammar, algo_suit: parallel_lr.construct_states(
+            grammar, algo_suit, args.jobs)
     builder = dict(
+        terms=lambda: packed_table.construct_terms(grammar),
         first=lambda: ll1.construct_first(grammar),
         follow=lambda: ll1.construct_follow(grammar, get('first')),
         ll1_table=lambda: ll1.construct_table(grammar, get('first'), get('follow')),
@@ -148,23 +471,117 @@ def main():
         slr1_suit=lambda: lr.SLR1AlgorithmSuit(get('lr_grammar')),
         lr1_suit=lambda: lr.LR1AlgorithmSuit(get('lr_grammar')),
 
-        lr0_state=lambda: lr.construct_states(get('lr_grammar'), get('lr0_suit')),
-        lr1_state=lambda: lr.construct_states(get('lr_grammar'), get('lr1_suit')),
-        lr0_table=lambda: lr.construct_table(get('lr_grammar'), get('lr0_state'), get('lr0_suit')),
-        lr1_table=lambda: lr.construct_table(get('lr_grammar'), get('lr1_state'), get('lr1_suit')),
-        slr1_table=lambda: lr.construct_table(get('lr_grammar'), get('lr0_state'),
-                                              get('slr1_suit')),
+        lr0_state=lambda: construct_states(get('lr_grammar'), get('lr0_suit')),
+        lr1_state=lambda: construct_states(get('lr_grammar'), get('lr1_suit')),
+        lr0_full_table=lambda: lr.construct_table(get('lr_grammar'), get('lr0_state'),
+                                                  get('lr0_suit')),
+        lr1_full_table=lambda: lr.construct_table(get('lr_grammar'), get('lr1_state'),
+                                                  get('lr1_suit')),
+        slr1_full_table=lambda: lr.construct_table(get('lr_grammar'), get('lr0_state'),
+                                                   get('slr1_suit')),
+        lr0_minimized=lambda: lr_minimize.minimize_table(get('lr0_full_table')),
+        lr1_minimized=lambda: lr_minimize.minimize_table(get('lr1_full_table')),
+        slr1_minimized=lambda: lr_minimize.minimize_table(get('slr1_full_table')),
+        lr0_table=lambda: _get_table(args, get, 'lr0'),
+        lr1_table=lambda: _get_table(args, get, 'lr1'),
+        slr1_table=lambda: _get_table(args, get, 'slr1'),
+
+        ll1_packed=lambda: packed_table.pack_ll1_table(grammar, get('ll1_table')),
+        lr0_packed=lambda: packed_table.pack_lr_table(get('lr_grammar'), get('lr0_table')),
+        slr1_packed=lambda: packed_table.pack_lr_table(get('lr_grammar'), get('slr1_table')),
+        lr1_packed=lambda: packed_table.pack_lr_table(get('lr_grammar'), get('lr1_table')),
     )
 
     def get(key):
         if key not in context:
-            context[key] = builder[key]()
+            with instrument.phase(key):
+                context[key] = builder[key]()
         return context[key]
+    return get
+
+
+def _read_grammar(args):
+    grammar = bnf_parser.parse(open(args.bnf).read())
+    if args.left_elim:
+        grammar = left_recursion_eliminator.eliminate(grammar)
+    return grammar
+
+
+def parse_compile_input(args):
+    parser = argparse.ArgumentParser(
+        prog='cli.py compile',
+        description='Build the tables of a grammar ahead of time into a bundle '
+                    'that the other commands take instead of the BNF.')
+    parser.add_argument('bnf', metavar='BNF_FILE',
+                        help='The input grammar written in BNF')
+    parser.add_argument('output', metavar='BUNDLE_FILE',
+                        help='The bundle written')
+    parser.add_argument('-e', '--left-elim', action='store_true',
+                        help='Eliminate left recursion on the input grammar')
+    parser.add_argument('--parsers', nargs='+', choices=tuple(bundle.PARSERS),
+                        default=tuple(bundle.PARSERS),
+                        help='Parsers whose tables are built (default: all)')
+    parser.add_argument('--minimize', action='store_true',
+                        help='Merge the equivalent states of the LR tables')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Build the LR states in JOBS worker processes')
+    return parser.parse_args(args)
+
+
+def compile_main(args):
+    args = parse_compile_input(args)
+    get = _new_getter(args, dict(grammar=_read_grammar(args)))
+    with open(args.output, 'wb') as output_file:
+        bundle.write_bundle(get, output_file, args.parsers, args.minimize)
+
+
+def main():
+    if sys.argv[1:2] == ['compile']:
+        compile_main(sys.argv[2:])
+        return
+    args = parse_input(sys.argv[1:])
+    if args.profile or args.profile_trace:
+        instrument.enable(args.profile_memory)
+    if bundle.is_bundle(args.bnf):
+        if args.left_elim:
+            sys.exit('--left-elim is chosen when compiling the bundle')
+        with open(args.bnf, 'rb') as bundle_file:
+            try:
+                context = bundle.read_bundle(bundle_file)
+            except ValueError as e:
+                sys.exit('{}: {}'.format(args.bnf, e))
+        if args.minimize != context.pop('minimize'):
+            sys.exit('--minimize is chosen when compiling the bundle')
+        grammar = context['grammar']
+    else:
+        grammar = _read_grammar(args)
+        context = dict(grammar=grammar)
+        if args.cache and os.path.exists(args.cache):
+            with open(args.cache, 'rb') as cache_file:
+                context = incremental.update_context(pickle.load(cache_file), grammar)
+    if args.grammar:
+        print(grammar)
+    get = _new_getter(args, context)
+
+    for name, process in (('ll', process_ll), ('lr', process_lr), ('lr1', process_lr1),
+                          ('parse', process_parse), ('trace', process_trace),
+                          ('codegen', process_codegen),
+                          ('minimize', process_minimize)):
+        with instrument.phase('process_' + name):
+            process(args, get)
+
+    if args.cache:
+        with open(args.cache, 'wb') as cache_file:
+            pickle.dump(context, cache_file, pickle.HIGHEST_PROTOCOL)
 
-    process_ll(args, get)
-    process_lr(args, get)
-    process_lr1(args, get)
-    process_parse(args, get)
+    if instrument.enabled:
+        records = instrument.disable()
+        if args.profile:
+            print('Profile:', file=sys.stderr)
+            report.write_lines(instrument.iter_summary(records), sys.stderr)
+        if args.profile_trace:
+            with open(args.profile_trace, 'w') as trace_file:
+                instrument.dump_chrome_trace(records, trace_file)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+import zlib
+from string import Template
+from packed_table import PackedLRTable, PackedLL1Table, _to_le_bytes
+import ll1
+import lr
+import packed_table
+
+
+_HEADER = '''\
+# Generated by codegen.py from $name table, do not edit.
+import sys
+import zlib
+from array import array
+
+TERMS = $terms
+NTERMS = $nterms
+# PRODUCTIONS[prod_id] = (nterm, syms)
+PRODUCTIONS = $prods
+_EOF = $eof
+_SYM_IDS = dict((sym, i) for i, sym in enumerate(TERMS))
+
+
+def _load(data):
+    result = array('I')
+    result.frombytes(zlib.decompress(data))
+    if sys.byteorder != 'little':
+        result.byteswap()
+    return result
+
+
+def _error(sym, pos, expected=()):
+    msg = 'Unexpected symbol {} at {}'.format(TERMS[sym], pos)
+    if expected:
+        msg += ', expected ' + ' '.join(TERMS[i] for i in expected)
+    raise SyntaxError(msg)
+
+
+def _to_ids(syms):
+    try:
+        return [_SYM_IDS[sym] for sym in syms]
+    except KeyError as e:
+        raise SyntaxError('Unknown symbol ' + str(e))
+'''
+
+_LR_DRIVER = '''
+_PROD_LHS = $prod_lhs
+_PROD_LEN = $prod_len
+_ACTIONS = _load($data)
+
+
+def parse_ids(ids):
+    # Returns the ids of the reduced productions, in reduction order
+    actions = _ACTIONS
+    prod_lhs = _PROD_LHS
+    prod_len = _PROD_LEN
+    n = len(ids)
+    stack = [0]
+    output = []
+    pos = 0
+    sym = ids[0] if n else _EOF
+    while True:
+        action = actions[stack[-1] * $width + sym]
+        kind = action & 3
+        if kind == 1:
+            stack.append(action >> 2)
+            pos += 1
+            sym = ids[pos] if pos < n else _EOF
+        elif kind == 2:
+            prod = action >> 2
+            length = prod_len[prod]
+            if length:
+                del stack[-length:]
+            stack.append(actions[stack[-1] * $width + prod_lhs[prod]] >> 2)
+            output.append(prod)
+        elif action == 4:
+            return output
+        else:
+            _error(sym, pos)
+
+
+def parse(syms):
+    return parse_ids(_to_ids(syms))
+'''
+
+_LL1_DRIVER = '''
+# _PROD_RHS[prod_id] = symbol ids of the right hand side, reversed;
+# nonterminal ids are offset by len(TERMS)
+_PROD_RHS = $prod_rhs
+_TABLE = _load($data)
+
+
+def parse_ids(ids):
+    # Returns the ids of the expanded productions, in leftmost order
+    table = _TABLE
+    prod_rhs = _PROD_RHS
+    n = len(ids)
+    stack = [$start]
+    output = []
+    pos = 0
+    sym = ids[0] if n else _EOF
+    while stack:
+        top = stack.pop()
+        if top < $n_terms:
+            if top != sym:
+                _error(sym, pos, (top,))
+            pos += 1
+            sym = ids[pos] if pos < n else _EOF
+        else:
+            prod = table[(top - $n_terms) * $n_terms + sym] - 1
+            if prod < 0:
+                _error(sym, pos)
+            stack.extend(prod_rhs[prod])
+            output.append(prod)
+    if pos < n:
+        _error(sym, pos, (_EOF,))
+    return output
+
+
+def parse(syms):
+    return parse_ids(_to_ids(syms))
+'''
+
+_LL1_RD_DRIVER = '''
+
+def parse_ids(ids):
+    # Returns the ids of the expanded productions, in leftmost order
+    ids = list(ids)
+    ids.append(_EOF)
+    output = []
+    pos = _parse_$start(ids, 0, output)
+    if ids[pos] != _EOF:
+        _error(ids[pos], pos, (_EOF,))
+    return output
+
+
+def parse(syms):
+    return parse_ids(_to_ids(syms))
+'''
+
+
+def _format_data(arr) -> str:
+    return repr(zlib.compress(_to_le_bytes(arr), 9))
+
+
+def _format_header(packed, name: str) -> str:
+    return Template(_HEADER).substitute(
+        name=name, terms=repr(packed.terms), nterms=repr(packed.nterms),
+        prods=repr(packed.prods), eof=packed.terms.index('$'))
+
+
+def generate_lr(packed: PackedLRTable, name='an LR') -> str:
+    driver = Template(_LR_DRIVER).substitute(
+        prod_lhs=repr(packed.prod_lhs), prod_len=repr(packed.prod_len),
+        data=_format_data(packed.actions), width=packed.width)
+    return _format_header(packed, name) + driver
+
+
+def _get_prod_ids(packed: PackedLL1Table, prod) -> list:
+    return [packed.sym_ids[sym] for sym in prod[1] if sym != '@']
+
+
+def generate_ll1(packed: PackedLL1Table) -> str:
+    prod_rhs = tuple(tuple(reversed(_get_prod_ids(packed, prod)))
+                     for prod in packed.prods)
+    driver = Template(_LL1_DRIVER).substitute(
+        prod_rhs=repr(prod_rhs), data=_format_data(packed.table),
+        start=packed.sym_ids[packed.start], n_terms=len(packed.terms))
+    return _format_header(packed, 'an LL(1)') + driver
+
+
+def _generate_ll1_function(packed: PackedLL1Table, nterm_id: int) -> list:
+    n_terms = len(packed.terms)
+    dispatch = dict()
+    for term_id in range(n_terms):
+        prod_id = packed.get_production(nterm_id, term_id)
+        if prod_id >= 0:
+            dispatch[term_id] = prod_id
+    nterm = packed.nterms[nterm_id]
+    self_id = n_terms + nterm_id
+
+    lines = ['', '',
+             '# ' + nterm,
+             '_DISPATCH_{} = {!r}'.format(nterm_id, dispatch),
+             '', '',
+             'def _parse_{}(ids, pos, output):'.format(nterm_id),
+             '    while True:',
+             '        prod = _DISPATCH_{}.get(ids[pos])'.format(nterm_id)]
+    keyword = 'if'
+    for prod_id in sorted(set(dispatch.values())):
+        sym_ids = _get_prod_ids(packed, packed.prods[prod_id])
+        lines.append('        {} prod == {}:'.format(keyword, prod_id))
+        lines.append('            # {} → {}'.format(
+            nterm, ' '.join(packed.prods[prod_id][1])))
+        lines.append('            output.append({})'.format(prod_id))
+        keyword = 'elif'
+        # A tail call to the same nonterminal becomes the next iteration
+        tail_call = bool(sym_ids) and sym_ids[-1] == self_id
+        if tail_call:
+            sym_ids = sym_ids[:-1]
+        for i, sym_id in enumerate(sym_ids):
+            if sym_id < n_terms and i == 0:
+                # Already checked by the dispatch
+                lines.append('            pos += 1')
+            elif sym_id < n_terms:
+                lines.append('            if ids[pos] != {}:'.format(sym_id))
+                lines.append('                _error(ids[pos], pos, ({},))'.format(sym_id))
+                lines.append('            pos += 1')
+            else:
+                lines.append('            pos = _parse_{}(ids, pos, output)'.format(
+                    sym_id - n_terms))
+        lines.append('            continue' if tail_call else '            return pos')
+    expected = tuple(sorted(dispatch))
+    if dispatch:
+        lines.append('        else:')
+        lines.append('            _error(ids[pos], pos, {!r})'.format(expected))
+    else:
+        lines.append('        _error(ids[pos], pos)')
+    return lines
+
+
+def generate_ll1_recursive(packed: PackedLL1Table) -> str:
+    lines = list()
+    for nterm_id in range(len(packed.nterms)):
+        lines.extend(_generate_ll1_function(packed, nterm_id))
+    driver = Template(_LL1_RD_DRIVER).substitute(
+        start=packed.nterms.index(packed.start))
+    return _format_header(packed, 'an LL(1)') + '\n'.join(lines) + '\n' + driver
+
+
+def main():
+    import bnf_parser
+    bnf = '''
+    E  := T E'
+    E' := + T E' | @
+    T  := F T'
+    T' := * F T' | @
+    F  := ( E ) | id
+    '''
+    grammar = bnf_parser.parse(bnf)
+    first = ll1.construct_first(grammar)
+    follow = ll1.construct_follow(grammar, first)
+    table = ll1.construct_table(grammar, first, follow)
+    print(generate_ll1_recursive(packed_table.pack_ll1_table(grammar, table)))
+
+    lr_grammar = lr.construct_argumented_grammar(grammar)
+    algo_suit = lr.LR1AlgorithmSuit(lr_grammar)
+    states = lr.construct_states(lr_grammar, algo_suit)
+    table = lr.construct_table(lr_grammar, states, algo_suit)
+    print(generate_lr(packed_table.pack_lr_table(lr_grammar, table), 'an LR(1)'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+from types import MappingProxyType
+from grammar import Grammar
+from parse_error import Recovery
+import ll1
+import lr
+import packed_table
+
+# algorithm: LR algorithm suit class, None for LL(1)
+ALGORITHMS = dict(
+    lr0=lr.LR0AlgorithmSuit,
+    slr1=lr.SLR1AlgorithmSuit,
+    lr1=lr.LR1AlgorithmSuit,
+    ll1=None,
+)
+
+
+def _freeze_array(arr) -> memoryview:
+    return memoryview(arr.tobytes()).cast(arr.typecode)
+
+
+def _freeze_lr_table(table: list) -> tuple:
+    # Rows become read-only mappings of tuples, in the order lr.parse picks
+    # the actions from the sets
+    return tuple(MappingProxyType(dict((sym, tuple(actions))
+                                       for sym, actions in row.items() if actions))
+                 for row in table)
+
+
+def _freeze_ll1_table(table: dict):
+    return MappingProxyType(dict((nterm, tuple(pairs)) for nterm, pairs in table.items()))
+
+
+def _freeze_follow(follow: dict):
+    return MappingProxyType(dict((nterm, frozenset(terms)) for nterm, terms in follow.items()))
+
+
+class CompiledParser:
+    # The tables of a grammar for one algorithm, read-only after construction.
+    # The parse methods keep their state in locals, so one parser is shared
+    # by any number of threads without locking. Pickling rebuilds the tables,
+    # e.g. for a subinterpreter or a process pool.
+    __slots__ = ('grammar', 'algorithm', 'table', 'packed', 'follow')
+
+    def __init__(self, grammar: Grammar, algorithm='lr1'):
+        if algorithm not in ALGORITHMS:
+            raise ValueError('Unknown algorithm ' + algorithm)
+        set_attr = lambda name, value: object.__setattr__(self, name, value)
+        set_attr('grammar', grammar)
+        set_attr('algorithm', algorithm)
+        first = ll1.construct_first(grammar)
+        follow = ll1.construct_follow(grammar, first)
+        set_attr('follow', _freeze_follow(follow))
+        if algorithm == 'll1':
+            table = ll1.construct_table(grammar, first, follow)
+            packed = packed_table.pack_ll1_table(grammar, table)
+            set_attr('table', _freeze_ll1_table(table))
+            set_attr('packed', packed_table.PackedLL1Table(
+                packed.start, packed.terms, packed.nterms, packed.prods,
+                _freeze_array(packed.table)))
+        else:
+            lr_grammar = lr.construct_argumented_grammar(grammar)
+            algo_suit = ALGORITHMS[algorithm](lr_grammar)
+            states = lr.construct_states(lr_grammar, algo_suit)
+            table = lr.construct_table(lr_grammar, states, algo_suit)
+            packed = packed_table.pack_lr_table(lr_grammar, table)
+            set_attr('table', _freeze_lr_table(table))
+            set_attr('packed', packed_table.PackedLRTable(
+                packed.terms, packed.nterms, packed.prods,
+                _freeze_array(packed.actions)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledParser is read-only')
+
+    def __delattr__(self, name):
+        raise AttributeError('CompiledParser is read-only')
+
+    def __reduce__(self):
+        return CompiledParser, (self.grammar, self.algorithm)
+
+    def __repr__(self):
+        return 'CompiledParser({})'.format(self.algorithm)
+
+    def parse(self, syms, callback=None, stats=None, recovery: Recovery=None) -> list:
+        # Same as lr.parse and ll1.parse; returns the errors recovered from
+        if self.algorithm == 'll1':
+            if recovery is not None and recovery.follow is None:
+                recovery = Recovery(recovery.mode, recovery.max_cost,
+                                    recovery.window, self.follow)
+            return ll1.parse(self.grammar, self.table, syms, callback, stats, recovery)
+        return lr.parse(self.table, syms, callback, stats, recovery)
+
+    def parse_ids(self, ids) -> list:
+        # ids: terminal ids of self.packed.terms, see token_stream. Returns
+        # the ids of the productions in self.packed.prods, reduced or
+        # expanded in order.
+        if self.algorithm == 'll1':
+            return packed_table.parse_ll1(self.packed, ids)
+        return packed_table.parse_lr(self.packed, ids)
+
+    def get_ids(self, syms) -> list:
+        sym_ids = self.packed.sym_ids
+        return [sym_ids[sym] for sym in syms]
+
+
+def main():
+    import threading
+    import bnf_parser
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    parser = CompiledParser(bnf_parser.parse(bnf), 'slr1')
+    syms = 'id * ( id + id ) + id'.split()
+    results = list()
+    threads = [threading.Thread(target=lambda: results.append(
+        parser.parse_ids(parser.get_ids(syms)))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print('{}: {} threads, {} distinct results'.format(
+        parser, len(results), len(set(map(tuple, results)))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+import math
+import heapq
+import itertools
+from collections import defaultdict
+from grammar import Grammar
+from lr import LR0Item
+from packed_table import _index_productions
+from parse_error import ParseError
+import instrument
+import ll1
+
+# Nodes of the shared packed forest:
+#   (nterm, start, end)         symbol node, its families are the
+#                               intermediate nodes of the productions
+#                               deriving syms[start:end]
+#   (prod_id, dot, start, end)  intermediate node, the first dot symbols of
+#                               the production derive syms[start:end]; its
+#                               families are (left, right) pairs: the
+#                               intermediate node with one symbol less (None
+#                               for the first symbol) and the symbol node or
+#                               the input position of the terminal
+# Intermediate nodes with dot 0 are the empty productions.
+
+
+class Forest:
+    def __init__(self, syms: list, prods: list, families: dict, root, cyclic=True):
+        self.syms = syms
+        self.prods = prods
+        self.families = families  # families[node] = {family: None}, in order
+        self.root = root
+        self.cyclic = cyclic  # whether the grammar has some A =>+ A
+
+    def is_symbol(self, node) -> bool:
+        return isinstance(node[0], str)
+
+    def get_children(self, node) -> list:
+        # The child nodes of every family of node; the terminals are leaves
+        # and left out
+        if node[0].__class__ is str:
+            return [(family,) for family in self.families[node]]
+        if node[1] == 0:
+            return [()]
+        result = list()
+        for left, right in self.families[node]:
+            if right.__class__ is int:
+                result.append((left,) if left is not None else ())
+            else:
+                result.append((left, right) if left is not None else (right,))
+        return result
+
+    def get_edges(self, node, cost) -> list:
+        # [(cost, child nodes)] of the hyperedges below node
+        if node[0].__class__ is str:
+            prods = self.prods
+            return [(cost(prods[family[0]]), (family,)) for family in self.families[node]]
+        return [(0, children) for children in self.get_children(node)]
+
+    def get_label(self, node) -> str:
+        if self.is_symbol(node):
+            return node[0]
+        return str(LR0Item(self.prods[node[0]], node[1]))
+
+
+def _construct_nullable(grammar: Grammar) -> set:
+    first = ll1.construct_first(grammar)
+    return set(nterm for nterm in grammar.prods if '@' in first[nterm])
+
+
+def _is_cyclic(grammar: Grammar, prods: list, nullable: set) -> bool:
+    # Whether some nonterminal derives itself, through productions whose
+    # other symbols are all nullable; only then can forests have cycles
+    units = defaultdict(set)
+    for prod in prods:
+        for i, sym in enumerate(prod.syms):
+            if sym in grammar.prods and all(
+                    other in nullable for other in prod.syms[:i] + prod.syms[i + 1:]):
+                units[prod.nterm].add(sym)
+    done = set()
+    for nterm in list(units):
+        path = set()
+        stack = [(nterm, False)]
+        while stack:
+            nterm, leaving = stack.pop()
+            if leaving:
+                path.discard(nterm)
+                done.add(nterm)
+                continue
+            if nterm in path:
+                return True
+            if nterm in done:
+                continue
+            path.add(nterm)
+            stack.append((nterm, True))
+            stack.extend((sym, False) for sym in units[nterm])
+    return False
+
+
+@instrument.timed('forest.parse')
+def parse(grammar: Grammar, syms: list) -> Forest:
+    # Earley parser recording the forest as it advances items; empty
+    # nonterminals are stepped over when predicted (Aycock and Horspool).
+    # O(n^3) time and forest size for n input symbols.
+    prods = _index_productions(grammar)
+    bodies = [() if prod.syms == ('@',) else prod.syms for prod in prods]
+    by_nterm = defaultdict(list)
+    for prod_id, prod in enumerate(prods):
+        by_nterm[prod.nterm].append(prod_id)
+    nullable = _construct_nullable(grammar)
+
+    n = len(syms)
+    sets = [list() for _ in range(n + 1)]  # sets[j] = [(prod_id, dot, start)]
+    seen = [set() for _ in range(n + 1)]
+    waiting = [dict() for _ in range(n + 1)]  # waiting[j][nterm] = [items]
+    families = dict()
+
+    def add(j, item, family):
+        if family is not None:
+            families.setdefault(item + (j,), dict())[family] = None
+        if item not in seen[j]:
+            seen[j].add(item)
+            sets[j].append(item)
+
+    for prod_id in by_nterm[grammar.start]:
+        add(0, (prod_id, 0, 0), None)
+    for j in range(n + 1):
+        items = sets[j]
+        idx = 0
+        while idx < len(items):
+            prod_id, dot, start = items[idx]
+            idx += 1
+            body = bodies[prod_id]
+            if dot == len(body):
+                nterm = prods[prod_id].nterm
+                node = (nterm, start, j)
+                families.setdefault(node, dict())[(prod_id, dot, start, j)] = None
+                parents = waiting[start].get(nterm, ())
+                for parent_id, parent_dot, parent_start in list(parents):
+                    left = (parent_id, parent_dot, parent_start, start) if parent_dot else None
+                    add(j, (parent_id, parent_dot + 1, parent_start), (left, node))
+                continue
+            sym = body[dot]
+            left = (prod_id, dot, start, j) if dot else None
+            if sym in grammar.prods:
+                parents = waiting[j].get(sym)
+                if parents is None:
+                    parents = waiting[j][sym] = list()
+                    for child_id in by_nterm[sym]:
+                        add(j, (child_id, 0, j), None)
+                parents.append((prod_id, dot, start))
+                if sym in nullable:
+                    add(j, (prod_id, dot + 1, start), (left, (sym, j, j)))
+            elif j < n and syms[j] == sym:
+                add(j + 1, (prod_id, dot + 1, start), (left, j))
+        if j < n and not sets[j + 1]:
+            break
+
+    root = (grammar.start, 0, n)
+    if root not in families:
+        pos = max(j for j in range(n + 1) if sets[j])
+        expected = set(bodies[prod_id][dot] for prod_id, dot, _ in sets[pos]
+                       if dot < len(bodies[prod_id])
+                       and bodies[prod_id][dot] not in grammar.prods)
+        raise ParseError(syms[pos] if pos < n else '$', pos, sorted(expected))
+    if instrument.enabled:
+        instrument.count('items', sum(len(items) for items in sets))
+        instrument.count('nodes', len(families))
+    return Forest(syms, prods, families, root, _is_cyclic(grammar, prods, nullable))
+
+
+def construct_counts(forest: Forest) -> dict:
+    # counts[node] = number of derivations, for the nodes under the root;
+    # math.inf everywhere if the forest has a cycle (through unit or empty
+    # productions), since the root then has infinitely many.
+    counts = dict()
+    on_stack = object()
+    stack = [(forest.root, None)]
+    while stack:
+        node, families = stack.pop()
+        if families is not None:
+            total = 0
+            for children in families:
+                product = 1
+                for child in children:
+                    product *= counts[child]
+                total += product
+            counts[node] = total
+            continue
+        if node in counts:
+            continue
+        counts[node] = on_stack
+        families = forest.get_children(node)
+        stack.append((node, families))
+        for children in families:
+            for child in children:
+                count = counts.get(child)
+                if count is None:
+                    stack.append((child, None))
+                elif count is on_stack:
+                    return dict((node, math.inf) for node in counts)
+    return counts
+
+
+def count_derivations(forest: Forest):
+    return construct_counts(forest)[forest.root]
+
+
+# Column names of the rows yielded by iter_ambiguities()
+AMBIGUITIES_COLUMNS = ('start', 'end', 'node', 'alternatives', 'derivations')
+
+
+def iter_ambiguities(forest: Forest, counts: dict=None):
+    # Nodes under the root with more than one family: a symbol derived by
+    # several productions, or a production split in several ways. Innermost
+    # spans first.
+    counts = counts if counts is not None else construct_counts(forest)
+    nodes = [node for node in counts if len(forest.families.get(node, ())) > 1]
+    nodes.sort(key=lambda node: (node[-1] - node[-2], node[-2]))
+    for node in nodes:
+        yield (node[-2], node[-1], forest.get_label(node), len(forest.families[node]),
+               counts[node])
+
+
+def iter_ambiguities_report(forest: Forest, counts: dict=None):
+    counts = counts if counts is not None else construct_counts(forest)
+    yield '  Derivations: {}'.format(counts[forest.root])
+    for start, end, label, alternatives, derivations in iter_ambiguities(forest, counts):
+        yield '  [{}, {}) {}: {} alternatives, {} derivations'.format(
+            start, end, label, alternatives, derivations)
+
+
+class _KBest:
+    # Lazy k-best derivations of the forest (Huang and Chiang, Better k-best
+    # parsing, algorithm 3), with a stack of (node, k) requests instead of
+    # recursion. derivs[node] = [(cost, edge, ranks)] in increasing cost,
+    # ranks being the derivation of each child of the edge.
+    def __init__(self, forest: Forest, cost):
+        self.forest = forest
+        self.cost = cost
+        self.edges = dict()
+        self.derivs = dict()
+        self.heaps = dict()
+        self.seen = dict()
+        self.last = dict()  # derivation whose successors are not queued yet
+
+    def _is_ready(self, node, rank, stack) -> bool:
+        # Whether derivs[node][rank] is there or will never be; queues a
+        # request for it otherwise
+        derivs = self.derivs.get(node)
+        if derivs is not None and (len(derivs) > rank or self._is_exhausted(node)):
+            return True
+        stack.append((node, rank + 1))
+        return False
+
+    def _is_exhausted(self, node) -> bool:
+        return not self.heaps[node] and self.last[node] is None
+
+    def _push(self, node, edge: int, ranks: tuple):
+        edge_cost, children = self.edges[node][edge]
+        if (edge, ranks) in self.seen[node]:
+            return
+        cost = edge_cost
+        for child, rank in zip(children, ranks):
+            if rank >= len(self.derivs[child]):
+                return
+            cost += self.derivs[child][rank][0]
+        self.seen[node].add((edge, ranks))
+        heapq.heappush(self.heaps[node], (cost, edge, ranks))
+
+    def ensure(self, node, k):
+        stack = [(node, k)]
+        while stack:
+            node, k = stack[-1]
+            if node not in self.derivs:
+                edges = self.edges.get(node)
+                if edges is None:
+                    edges = self.edges[node] = self.forest.get_edges(node, self.cost)
+                all_derivs = self.derivs
+                missing = [(child, 1) for _, children in edges for child in children
+                           if child not in all_derivs]
+                if missing:
+                    stack.extend(missing)
+                    continue
+                # Every node under the root has a derivation, and the best
+                # ones of the edges are never queued again as successors
+                heap = [(edge_cost + sum(all_derivs[child][0][0] for child in children),
+                         edge, (0,) * len(children))
+                        for edge, (edge_cost, children) in enumerate(edges)]
+                heapq.heapify(heap)
+                all_derivs[node] = list()
+                self.heaps[node] = heap
+                self.seen[node] = set()
+                self.last[node] = None
+            derivs = self.derivs[node]
+            if len(derivs) >= k:
+                stack.pop()
+                continue
+            last = self.last[node]
+            if last is not None:
+                _, edge, ranks = last
+                children = self.edges[node][edge][1]
+                if not all([self._is_ready(child, rank + 1, stack)
+                            for child, rank in zip(children, ranks)]):
+                    continue
+                for i in range(len(ranks)):
+                    self._push(node, edge, ranks[:i] + (ranks[i] + 1,) + ranks[i + 1:])
+                self.last[node] = None
+            if not self.heaps[node]:
+                stack.pop()
+                continue
+            deriv = heapq.heappop(self.heaps[node])
+            derivs.append(deriv)
+            self.last[node] = deriv
+
+    def get(self, node, rank):
+        self.ensure(node, rank + 1)
+        derivs = self.derivs[node]
+        return derivs[rank] if rank < len(derivs) else None
+
+    def build_tree(self, node, rank) -> tuple:
+        # (nterm, [children]) with the terminals as strings; the families of
+        # the intermediate nodes are walked from the last symbol back
+        forest = self.forest
+        tree = (node[0], list())
+        stack = [(node, rank, tree[1])]
+        while stack:
+            node, rank, children = stack.pop()
+            _, edge, ranks = self.derivs[node][rank]
+            inter, inter_rank = list(forest.families[node])[edge], ranks[0]
+            reversed_children = list()
+            while inter[1] > 0:
+                _, inter_edge, inter_ranks = self.derivs[inter][inter_rank]
+                left, right = list(forest.families[inter])[inter_edge]
+                if isinstance(right, tuple):
+                    child = (right[0], list())
+                    stack.append((right, inter_ranks[-1], child[1]))
+                    reversed_children.append(child)
+                else:
+                    reversed_children.append(forest.syms[right])
+                if left is None:
+                    break
+                inter, inter_rank = left, inter_ranks[0]
+            children.extend(reversed(reversed_children))
+        return tree
+
+
+def _unit_cost(prod) -> int:
+    return 1
+
+
+def iter_trees(forest: Forest, cost=None):
+    # Yields (cost, tree) in increasing cost, cost(production) being the
+    # cost of every use of the production (1 by default: the trees with the
+    # fewest productions first). Only the derivations needed for the next
+    # tree are built, so taking the k best of exponentially many is cheap.
+    if forest.cyclic and count_derivations(forest) == math.inf:
+        raise ValueError('The forest has cycles')
+    kbest = _KBest(forest, cost or _unit_cost)
+    rank = 0
+    while True:
+        deriv = kbest.get(forest.root, rank)
+        if deriv is None:
+            return
+        yield deriv[0], kbest.build_tree(forest.root, rank)
+        rank += 1
+
+
+def construct_top_k(forest: Forest, k: int, cost=None) -> list:
+    return list(itertools.islice(iter_trees(forest, cost), k))
+
+
+# Column names of the rows yielded by iter_trees_rows()
+TREES_COLUMNS = ('rank', 'cost', 'tree')
+
+
+def iter_trees_rows(trees: list):
+    for rank, (cost, tree) in enumerate(trees):
+        yield rank, cost, str_tree(tree)
+
+
+def iter_trees_report(trees: list):
+    for rank, cost, tree in iter_trees_rows(trees):
+        yield '  #{} ({}): {}'.format(rank, cost, tree)
+
+
+_CLOSE = object()  # the end of a subtree in str_tree
+
+
+def _quote_sym(sym: str) -> str:
+    # The symbols that could be taken for the parentheses of the tree, a
+    # quoted symbol or two symbols are quoted, with \ escaping \ and '
+    if sym[:1] == "'" or any(c in '()' or c.isspace() for c in sym):
+        return "'" + sym.replace('\\', '\\\\').replace("'", "\\'") + "'"
+    return sym
+
+
+def str_tree(tree) -> str:
+    # (nterm child ...) with the symbols quoted by _quote_sym
+    if isinstance(tree, str):
+        return _quote_sym(tree)
+    parts = list()
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        if tree is _CLOSE:
+            parts[-1] += ')'
+        elif isinstance(tree, str):
+            parts.append(_quote_sym(tree))
+        else:
+            parts.append('(' + _quote_sym(tree[0]))
+            stack.append(_CLOSE)
+            stack.extend(reversed(tree[1]))
+    return ' '.join(parts)
+
+
+def main():
+    import bnf_parser
+    bnf = '''
+    S := NP VP
+    NP := NP PP | n
+    VP := v NP | VP PP
+    PP := p NP
+    '''
+    grammar = bnf_parser.parse(bnf)
+    syms = 'n v n p n p n'.split()
+    forest = parse(grammar, syms)
+    print('\n'.join(iter_ambiguities_report(forest)))
+    # Prepositional phrases attach to the closest noun rather than the verb
+    cost = lambda prod: 2 if prod.syms == ('VP', 'PP') else 1
+    print('\n'.join(iter_trees_report(construct_top_k(forest, 3, cost))))
+
+if __name__ == '__main__':
+    main()
@@ -1,42 +1,98 @@
 #!/usr/bin/env python
-from collections import defaultdict
+from collections import ChainMap
+from operator import itemgetter
+from types import MappingProxyType
 
 
 class Grammar:
-    def __init__(self):
-        self.start = None
-        self.terms = set()   # terminals
-        # prods[nterm] = list of Production objects
-        self.prods = defaultdict(list)
-
-    def add_production(self, nterm, syms):
-        production = Production(nterm, syms)
-        self.prods[nterm].append(production)
+    # Immutable: the grammars changed from it are made by derive() and the
+    # new ones by GrammarBuilder. A derived grammar only stores its changes,
+    # in the first map of its chain, the rest is shared with the base
+    # grammar; the maps are never written once the grammar is made.
+    __slots__ = ('_start', '_terms', '_sync', '_prods', '_view')
+
+    def __init__(self, start: str, terms, prods, sync=frozenset()):
+        # prods[nterm] = iterable of Production objects
+        self._init(start, frozenset(terms), frozenset(sync),
+                   ChainMap(dict((nterm, tuple(prodlist)) for nterm, prodlist in prods.items())))
+
+    def _init(self, start: str, terms: frozenset, sync: frozenset, prods: ChainMap):
+        self._start = start
+        self._terms = terms  # terminals
+        self._sync = sync  # terminals the input can be split at, see parallel_parse
+        self._prods = prods
+        self._view = MappingProxyType(prods)
+
+    @property
+    def start(self) -> str:
+        return self._start
+
+    @property
+    def terms(self) -> frozenset:
+        return self._terms
+
+    @property
+    def sync(self) -> frozenset:
+        return self._sync
+
+    @property
+    def prods(self):
+        # prods[nterm] = tuple of Production objects, read-only
+        return self._view
+
+    def __reduce__(self):
+        return _load_grammar, (self._start, self._terms, self._sync, self._prods.maps)
 
     def is_nonterminal(self, symbol: str) -> bool:
-        return symbol in self.prods
+        return symbol in self._prods
 
     def is_terminal(self, symbol: str) -> bool:
-        return symbol in self.terms
+        return symbol in self._terms
 
     def get_alt_nonterminal(self, nonterm: str) -> str:
         nonterm += "'"
-        while nonterm in self.prods:
+        while nonterm in self._prods:
             nonterm += "'"
         return nonterm
 
     def get_start_prodctions(self):
-        return self.prods[self.start]
-
-    def duplicate(self):
-        from copy import deepcopy
-        return deepcopy(self)
+        return self._prods[self._start]
+
+    def derive(self, start=None, prods=None):
+        # The grammar with the productions of the nonterminals of prods
+        # replaced or added, prods[nterm] = iterable of Production objects,
+        # and start if given. The terminals are those of the productions of
+        # the result, only the changed ones are looked at unless a terminal
+        # may no longer be referenced.
+        changes = dict((nterm, tuple(prodlist)) for nterm, prodlist in prods.items()) \
+            if prods else dict()
+        chain = self._prods.new_child(changes)
+        terms = self._terms
+        if changes:
+            used = set(sym for prodlist in changes.values() for prod in prodlist
+                       for sym in prod.syms if sym != '@' and sym not in chain)
+            added = used - terms
+            dropped = set(sym for nterm in changes for prod in self._prods.get(nterm, ())
+                          for sym in prod.syms if sym in terms and sym not in used)
+            dropped -= self._sync
+            if dropped:
+                dropped -= set(sym for prodlist in chain.values() for prod in prodlist
+                               for sym in prod.syms)
+            dropped.update(nterm for nterm in changes if nterm in terms)
+            if dropped or added:
+                terms = (terms - dropped) | added
+        result = Grammar.__new__(Grammar)
+        result._init(self._start if start is None else start, frozenset(terms), self._sync,
+                     chain)
+        return result
 
     def __str__(self):
         result = "Grammar:\n"
         result += "  Start: " + self.start
         result += "\n  Terminals: " + " ".join(self.terms)
         result += "\n  Nonterminals: " + " ".join(self.prods.keys())
+        if self.sync:
+            result += "\n  Sync: " + " ".join(sorted(self.sync))
         result += "\n  Productions:"
         for prodlist in self.prods.values():
             for prod in prodlist:
@@ -44,34 +100,54 @@ class Grammar:
         return result
 
 
-class Production:
-    def __init__(self, nterm: str, syms: list):
-        self.nterm = nterm
-        self.syms = Production.remove_eps(syms)
+def _load_grammar(start: str, terms: frozenset, sync: frozenset, maps: list) -> Grammar:
+    grammar = Grammar.__new__(Grammar)
+    grammar._init(start, terms, sync, ChainMap(*maps))
+    return grammar
+
+
+class GrammarBuilder:
+    # Collects the productions of a new grammar, see bnf_parser; the
+    # terminals are the symbols of the productions that are not
+    # nonterminals.
+    def __init__(self):
+        self.start = None
+        self.sync = set()
+        self.prods = dict()  # prods[nterm] = list of Production objects
 
-    def __eq__(self, other):
-        return self.nterm == other.nterm and self.syms == other.syms
+    def add_productions(self, nterm, syms_list):
+        self.prods.setdefault(nterm, list()).extend(
+            Production(nterm, syms) for syms in syms_list)
 
-    def __ne__(self, other):
-        return not self == other
+    def build(self) -> Grammar:
+        syms = set(sym for prodlist in self.prods.values() for prod in prodlist
+                   for sym in prod.syms)
+        return Grammar(self.start, syms - set(self.prods) - {'@'}, self.prods, self.sync)
 
-    def __hash__(self):
-        result = hash(self.nterm)
-        for sym in self.syms:
-            result ^= hash(sym)
-        return result
+
+class Production(tuple):
+    __slots__ = ()
+
+    def __new__(cls, nterm: str, syms):
+        return tuple.__new__(cls, (nterm, Production.remove_eps(syms)))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    nterm = property(itemgetter(0))
+    syms = property(itemgetter(1))
 
     @staticmethod
-    def remove_eps(syms: list) -> list:
+    def remove_eps(syms) -> tuple:
         for sym in syms:
             if sym != '@':
                 break
         else:
-            return ['@']
-        return list(filter(lambda x: x != '@', syms))
+            return ('@',)
+        return tuple(filter(lambda x: x != '@', syms))
 
     def __repr__(self):
-        return "Production({}, {})".format(self.nterm, self.syms)
+        return "Production({}, {})".format(self.nterm, list(self.syms))
 
     def __str__(self):
         return "{} → {}".format(self.nterm, " ".join(self.syms))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+from grammar import Grammar
+import instrument
+import ll1
+import lr
+
+
+def diff_grammars(old: Grammar, new: Grammar) -> tuple:
+    # Returns (removed, added) lists of Productions
+    removed = list()
+    added = list()
+    for nterm in old.prods:
+        if nterm not in new.prods:
+            removed.extend(old.prods[nterm])
+    for nterm, prodlist in new.prods.items():
+        old_prods = old.prods.get(nterm, ())
+        if old_prods == prodlist:
+            continue
+        old_set = set(old_prods)
+        new_set = set(prodlist)
+        removed.extend(filter(lambda x: x not in new_set, old_prods))
+        added.extend(filter(lambda x: x not in old_set, prodlist))
+    return removed, added
+
+
+@instrument.timed('incremental.update_context')
+def update_context(context: dict, grammar: Grammar) -> dict:
+    # context is the dict of compiled artifacts kept by cli.py, built for
+    # the previous version of the grammar. Returns a context for the new
+    # grammar where FIRST/FOLLOW and the LR states are updated in place of
+    # being rebuilt; tables are left to be rebuilt from them.
+    old_grammar = context['grammar']
+    result = dict(grammar=grammar)
+    if old_grammar.start != grammar.start:
+        return result
+    removed, added = diff_grammars(old_grammar, grammar)
+    changed_prods = removed + added
+    changed = set(prod.nterm for prod in changed_prods)
+
+    if 'first' in context:
+        first, first_changed = ll1.update_first(grammar, context['first'], changed)
+        result['first'] = first
+        if 'follow' in context:
+            result['follow'] = ll1.update_follow(
+                grammar, first, context['follow'], changed_prods, first_changed)
+
+    if 'lr_grammar' not in context:
+        return result
+    lr_grammar = lr.construct_argumented_grammar(grammar)
+    result['lr_grammar'] = lr_grammar
+    result['lr0_suit'] = lr.LR0AlgorithmSuit(lr_grammar)
+    if 'slr1_suit' in context:
+        old_suit = context['slr1_suit']
+        first, first_changed = ll1.update_first(lr_grammar, old_suit.first, changed)
+        follow = ll1.update_follow(lr_grammar, first, old_suit.follow,
+                                   changed_prods, first_changed)
+        result['slr1_suit'] = lr.SLR1AlgorithmSuit(lr_grammar, first, follow)
+    lr1_first_changed = set()
+    if 'lr1_suit' in context:
+        first, lr1_first_changed = ll1.update_first(
+            lr_grammar, context['lr1_suit'].first, changed)
+        result['lr1_suit'] = lr.LR1AlgorithmSuit(lr_grammar, first)
+
+    if 'lr0_state' in context:
+        result['lr0_state'] = lr.update_states(
+            lr_grammar, context['lr0_state'], result['lr0_suit'], changed)
+    if 'lr1_state' in context:
+        result['lr1_state'] = lr.update_states(
+            lr_grammar, context['lr1_state'], result['lr1_suit'], changed,
+            lr1_first_changed)
+    return result
+
+
+def main():
+    import bnf_parser
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    grammar = bnf_parser.parse(bnf)
+    lr_grammar = lr.construct_argumented_grammar(grammar)
+    suit = lr.LR1AlgorithmSuit(lr_grammar)
+    context = dict(grammar=grammar, lr_grammar=lr_grammar, lr1_suit=suit,
+                   lr1_state=lr.construct_states(lr_grammar, suit))
+
+    new_grammar = bnf_parser.parse(bnf + 'F := - F\n')
+    print(diff_grammars(grammar, new_grammar))
+    new_context = update_context(context, new_grammar)
+    print(lr.str_states(new_context['lr1_state']))
+
+
+if __name__ == '__main__':
+    main()
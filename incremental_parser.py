@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+from grammar import Grammar
+from lr import LRAction
+from parse_error import ParseError
+import lr
+
+
+class LRNode:
+    __slots__ = ('sym', 'children', 'state', 'length')
+
+    def __init__(self, sym: str, children: tuple, state: int, length: int):
+        self.sym = sym
+        self.children = children  # empty for terminals and eps productions
+        self.state = state  # state below the node when it was pushed
+        self.length = length  # number of input symbols covered
+
+    def __repr__(self):
+        return "LRNode({}, {}, {})".format(self.sym, self.state, self.length)
+
+
+def _get_action(table: list, state: int, sym: str, pos: int) -> LRAction:
+    actions = table[state].get(sym)
+    if not actions:
+        raise ParseError(sym, pos, lr.get_expected(table[state]))
+    return tuple(actions)[0]
+
+
+class _SubtreeReuse:
+    # Walks the old tree from left to right and offers the largest subtree
+    # starting at the current position that is not touched by any edit.
+    def __init__(self, tree: LRNode, edits: list):
+        self.pending = [(tree, 0)]  # (node, start in the old input)
+        self.edits = sorted(edits, key=lambda x: x[0])
+
+    def is_damaged(self, start: int, end: int) -> bool:
+        # The last reduction of a node depends on the symbol right after it,
+        # so that symbol is part of the damaged range as well.
+        for edit_start, edit_end, _ in self.edits:
+            if not (end < edit_start or start >= edit_end):
+                return True
+        return False
+
+    def get_new_pos(self, old_pos: int) -> int:
+        result = old_pos
+        for edit_start, edit_end, new_syms in self.edits:
+            if edit_end <= old_pos:
+                result += len(new_syms) - (edit_end - edit_start)
+        return result
+
+    def get_candidate(self, pos: int):
+        while self.pending:
+            node, start = self.pending[-1]
+            if not node.children:
+                # Terminals and empty nodes are taken from the new input
+                self.pending.pop()
+                continue
+            if self.is_damaged(start, start + node.length):
+                self.breakdown()
+                continue
+            new_start = self.get_new_pos(start)
+            if new_start < pos:
+                self.breakdown()
+                continue
+            if new_start > pos:
+                return None
+            return node
+        return None
+
+    def breakdown(self):
+        node, start = self.pending.pop()
+        children = list()
+        for child in node.children:
+            children.append((child, start))
+            start += child.length
+        self.pending.extend(reversed(children))
+
+    def accept(self):
+        self.pending.pop()
+
+
+def _parse(table: list, syms: list, reuse: _SubtreeReuse=None) -> LRNode:
+    states = [0]
+    nodes = list()
+    pos = 0
+    while True:
+        sym = syms[pos] if pos < len(syms) else '$'
+        action = _get_action(table, states[-1], sym, pos)
+        if action.action == LRAction.REDUCE:
+            prod = action.info
+            length = 0 if prod.syms == ('@',) else len(prod.syms)
+            children = tuple(nodes[len(nodes) - length:])
+            del nodes[len(nodes) - length:]
+            del states[len(states) - length:]
+            node = LRNode(prod.nterm, children, states[-1],
+                          sum(child.length for child in children))
+            goto_action = _get_action(table, states[-1], prod.nterm, pos)
+            assert goto_action.action == LRAction.GOTO
+            nodes.append(node)
+            states.append(goto_action.info)
+        elif action.action == LRAction.ACCEPT:
+            return nodes[-1]
+        elif action.action == LRAction.SHIFT:
+            candidate = reuse.get_candidate(pos) if reuse else None
+            if candidate is not None:
+                # All reductions for the lookahead are done, so the state
+                # on top is the one the subtree was built upon if reusable.
+                gotos = table[states[-1]].get(candidate.sym)
+                if candidate.state == states[-1] and gotos:
+                    reuse.accept()
+                    nodes.append(candidate)
+                    states.append(tuple(gotos)[0].info)
+                    pos += candidate.length
+                else:
+                    reuse.breakdown()
+                continue
+            nodes.append(LRNode(sym, (), states[-1], 1))
+            states.append(action.info)
+            pos += 1
+        else:
+            assert False
+
+
+def parse_tree(table: list, syms: list) -> LRNode:
+    return _parse(table, syms)
+
+
+def apply_edits(syms: list, edits: list) -> list:
+    # edits[i] = (start, end, new_syms): replace syms[start:end] by new_syms.
+    # Ranges refer to the old input and must not overlap.
+    result = list()
+    pos = 0
+    for start, end, new_syms in sorted(edits, key=lambda x: x[0]):
+        result.extend(syms[pos:start])
+        result.extend(new_syms)
+        pos = end
+    result.extend(syms[pos:])
+    return result
+
+
+def reparse_tree(table: list, tree: LRNode, syms: list, edits: list) -> LRNode:
+    # tree: the result of parsing the old input with the same table
+    # syms: the new input, i.e. apply_edits(old_syms, edits)
+    return _parse(table, syms, _SubtreeReuse(tree, edits))
+
+
+def str_tree(node: LRNode, indent=0) -> str:
+    lines = list()
+    work = [(node, indent)]
+    while work:
+        node, indent = work.pop()
+        lines.append('{}{} ({})'.format('  ' * indent, node.sym, node.state))
+        work.extend((child, indent + 1) for child in reversed(node.children))
+    return '\n'.join(lines)
+
+
+def _build_table(grammar: Grammar, algo_suit_class):
+    grammar = lr.construct_argumented_grammar(grammar)
+    algo_suit = algo_suit_class(grammar)
+    states = lr.construct_states(grammar, algo_suit)
+    return lr.construct_table(grammar, states, algo_suit)
+
+
+def main():
+    import bnf_parser
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    table = _build_table(bnf_parser.parse(bnf), lr.LR1AlgorithmSuit)
+    syms = 'id * id + id'.split()
+    tree = parse_tree(table, syms)
+    print(str_tree(tree))
+
+    edits = [(2, 3, '( id + id )'.split())]
+    new_syms = apply_edits(syms, edits)
+    print(str_tree(reparse_tree(table, tree, new_syms, edits)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+import os
+import json
+import time
+import functools
+import threading
+
+# Instrumented code checks this flag before any bookkeeping, so nothing is
+# recorded and next to nothing is spent while profiling is disabled.
+enabled = False
+_trace_memory = False  # tracemalloc is only imported for it, at a cost
+_started_tracemalloc = False
+_records = list()
+# The phases open in the thread, so that threads parsing at once while
+# profiling each nest their own; the records of all of them go to _records
+_local = threading.local()
+
+
+def _get_stack() -> list:
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = list()
+    return stack
+
+
+class PhaseRecord:
+    __slots__ = ('name', 'depth', 'begin', 'end', 'counters', 'peak_memory',
+                 'base_memory')
+
+    def __init__(self, name: str, depth: int, begin: float):
+        self.name = name
+        self.depth = depth
+        self.begin = begin
+        self.end = None
+        self.counters = dict()
+        self.peak_memory = None  # bytes allocated on top of base_memory
+        self.base_memory = None  # bytes allocated when the phase began
+
+    @property
+    def elapsed(self) -> float:
+        return self.end - self.begin
+
+    def __repr__(self):
+        return "PhaseRecord({}, {})".format(self.name, self.counters)
+
+
+def _begin(name: str):
+    stack = _get_stack()
+    record = PhaseRecord(name, len(stack), time.perf_counter())
+    if _trace_memory:
+        import tracemalloc
+        # Fold the peak so far into the enclosing phases before restarting
+        # it for this one
+        current, peak = tracemalloc.get_traced_memory()
+        for parent in stack:
+            parent.peak_memory = max(parent.peak_memory, peak - parent.base_memory)
+        record.base_memory = current
+        record.peak_memory = 0
+        tracemalloc.reset_peak()
+    _records.append(record)
+    stack.append(record)
+
+
+def _end():
+    stack = _get_stack()
+    record = stack.pop()
+    record.end = time.perf_counter()
+    if _trace_memory:
+        import tracemalloc
+        peak = tracemalloc.get_traced_memory()[1]
+        for phase in stack + [record]:
+            phase.peak_memory = max(phase.peak_memory, peak - phase.base_memory)
+
+
+class _Phase:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        _begin(self.name)
+
+    def __exit__(self, *args):
+        _end()
+
+
+class _NullPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def phase(name: str):
+    # with instrument.phase('name'): ...
+    if not enabled:
+        return _NULL_PHASE
+    return _Phase(name)
+
+
+def timed(name: str):
+    # Decorator recording every call of the function as a phase
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _Phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value=1):
+    counters = _get_stack()[-1].counters
+    counters[name] = counters.get(name, 0) + value
+
+
+def maximum(name: str, value):
+    counters = _get_stack()[-1].counters
+    counters[name] = max(counters.get(name, value), value)
+
+
+def add_time(name: str, elapsed: float):
+    # Time spent in a step repeated too often to be a phase of its own
+    count(name + '_time', elapsed)
+
+
+def enable(trace_memory=False):
+    global enabled, _trace_memory, _started_tracemalloc
+    del _records[:]
+    del _get_stack()[:]
+    _trace_memory = trace_memory
+    _started_tracemalloc = False
+    if trace_memory:
+        import tracemalloc
+        _started_tracemalloc = not tracemalloc.is_tracing()
+        if _started_tracemalloc:
+            tracemalloc.start()
+    enabled = True
+    _begin('total')
+
+
+def disable() -> list:
+    # Returns the PhaseRecords in the order the phases began
+    global enabled
+    while _get_stack():
+        _end()
+    if _started_tracemalloc:
+        import tracemalloc
+        tracemalloc.stop()
+    enabled = False
+    return list(_records)
+
+
+def _format_counter(name: str, value) -> str:
+    if name.endswith('_time'):
+        return '{}={:.2f}ms'.format(name, value * 1000)
+    return '{}={}'.format(name, value)
+
+
+def iter_summary(records: list):
+    yield '  {:40} {:>11} {:>11}  {}'.format('Phase', 'Time (ms)', 'Peak (KiB)',
+                                            'Counters')
+    for record in records:
+        name = '  ' * record.depth + record.name
+        peak = '' if record.peak_memory is None \
+            else '{:.1f}'.format(record.peak_memory / 1024)
+        counters = ' '.join(_format_counter(key, value)
+                            for key, value in sorted(record.counters.items()))
+        yield '  {:40} {:11.3f} {:>11}  {}'.format(
+            name, record.elapsed * 1000, peak, counters)
+
+
+def str_summary(records: list) -> str:
+    return '\n'.join(iter_summary(records))
+
+
+def dump_chrome_trace(records: list, export_file):
+    # Complete events of the Trace Event Format, viewable in chrome://tracing
+    # or Perfetto; counters and peak memory go to the event arguments.
+    origin = records[0].begin if records else 0
+    events = list()
+    for record in records:
+        args = dict(record.counters)
+        if record.peak_memory is not None:
+            args['peak_memory'] = record.peak_memory
+        events.append(dict(name=record.name, ph='X', pid=os.getpid(), tid=0,
+                           ts=(record.begin - origin) * 1e6,
+                           dur=record.elapsed * 1e6, args=args))
+    json.dump(dict(traceEvents=events, displayTimeUnit='ms'), export_file)
+
+
+def main():
+    # Run as a script this is __main__, not the instrument module lr uses
+    import instrument
+    import bnf_parser
+    import lr
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    instrument.enable(trace_memory=True)
+    grammar = lr.construct_argumented_grammar(bnf_parser.parse(bnf))
+    algo_suit = lr.LR1AlgorithmSuit(grammar)
+    states = lr.construct_states(grammar, algo_suit)
+    lr.construct_table(grammar, states, algo_suit)
+    print(instrument.str_summary(instrument.disable()))
+
+if __name__ == '__main__':
+    main()
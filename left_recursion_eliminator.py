@@ -1,17 +1,91 @@
 #!/usr/bin/env python
+from collections import defaultdict
 from grammar import Grammar, Production
+import instrument
 
 
 class _EliminateLeftRecursion:
     def __init__(self, grammar: Grammar):
         self.grammar = grammar
+        # prods[nterm] = the productions changed or added, grammar is left
+        # as it is
+        self.prods = dict()
         self.nterms = tuple(grammar.prods.keys())
+        self.decl_order = dict((nterm, i) for i, nterm in enumerate(self.nterms))
 
-        for elim_idx, elim in enumerate(self.nterms):
-            prods = self.grammar.prods[elim]
-            prods = self.elim_indirect(elim, elim_idx, prods)
-            prods = self.elim_direct(elim, prods)
-            self.grammar.prods[elim] = prods
+        # Only nonterminals inside a left-recursive cycle need substitution;
+        # everything else is left untouched.
+        for scc in self.find_recursive_sccs():
+            order = self.order_scc(scc)
+            for elim_idx, elim in enumerate(order):
+                prods = self.get_prods(elim)
+                prods = self.elim_indirect(elim, order[:elim_idx], prods)
+                prods = self.elim_direct(elim, prods)
+                self.prods[elim] = tuple(prods)
+
+    def get_prods(self, nterm):
+        if nterm in self.prods:
+            return self.prods[nterm]
+        return self.grammar.prods[nterm]
+
+    def is_nonterminal(self, sym):
+        return sym in self.prods or self.grammar.is_nonterminal(sym)
+
+    def get_left_corners(self, nterm):
+        result = list()
+        for prod in self.get_prods(nterm):
+            sym = prod.syms[0]
+            if self.is_nonterminal(sym) and sym not in result:
+                result.append(sym)
+        return result
+
+    def find_recursive_sccs(self):
+        # Iterative Tarjan over the left-corner graph (A -> B iff A := B ...)
+        index = dict()
+        lowlink = dict()
+        on_stack = set()
+        stack = list()
+        sccs = list()
+        for root in self.nterms:
+            if root in index:
+                continue
+            work = [(root, iter(self.get_left_corners(root)))]
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                nterm, succs = work[-1]
+                for succ in succs:
+                    if succ not in index:
+                        index[succ] = lowlink[succ] = len(index)
+                        stack.append(succ)
+                        on_stack.add(succ)
+                        work.append((succ, iter(self.get_left_corners(succ))))
+                        break
+                    if succ in on_stack:
+                        lowlink[nterm] = min(lowlink[nterm], index[succ])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[nterm])
+                    if lowlink[nterm] == index[nterm]:
+                        scc = list()
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            scc.append(member)
+                            if member == nterm:
+                                break
+                        if len(scc) > 1 or nterm in self.get_left_corners(nterm):
+                            sccs.append(scc)
+        return sccs
+
+    def order_scc(self, scc):
+        # Substituting A_j into A_i copies all productions of A_j, so members
+        # with fewer productions go first to keep the blowup small.
+        return sorted(scc, key=lambda x: (len(self.get_prods(x)),
+                                          self.decl_order[x]))
 
     def elim_direct(self, elim, elim_prods):
         recur_prods = list()
@@ -25,43 +99,107 @@ class _EliminateLeftRecursion:
             return nonrecur_prods
 
         new_nterm = self.grammar.get_alt_nonterminal(elim)
+        while new_nterm in self.prods:
+            new_nterm += "'"
 
+        new_syms_list = list()
         for recur_prod in recur_prods:
             syms = list(recur_prod.syms[1:])
             syms.append(new_nterm)
-            self.grammar.add_production(new_nterm, syms)
-        self.grammar.add_production(new_nterm, '@')
+            new_syms_list.append(syms)
+        new_syms_list.append(['@'])
+        self.prods[new_nterm] = tuple(Production(new_nterm, syms) for syms in new_syms_list)
 
         new_prods = list()
         for prod in nonrecur_prods:
             syms = list(prod.syms)
             syms.append(new_nterm)
             new_prods.append(Production(elim, syms))
-        return new_prods
+        return _dedup(new_prods)
 
-    def elim_indirect(self, elim, elim_idx, elim_prods):
-        new_prods = list()
-        replaced = [False] * len(elim_prods)
-        for chk in self.nterms[:elim_idx]:
-            chk_prods = self.grammar.prods[chk]
-            for prod_idx, prod in enumerate(elim_prods):
+    def elim_indirect(self, elim, earlier, elim_prods):
+        # Paull's substitution restricted to the members of the same SCC
+        for chk in earlier:
+            chk_prods = self.get_prods(chk)
+            new_prods = list()
+            for prod in elim_prods:
                 if prod.syms[0] == chk:
                     # Replace prod.nterm -> chk other_syms
                     # with prod.nterm -> chk.syms other_syms
                     for chk_prod in chk_prods:
-                        new_syms = chk_prod.syms + prod.syms[1:]
+                        new_syms = list(chk_prod.syms) + list(prod.syms[1:])
                         new_prods.append(Production(elim, new_syms))
-                    replaced[prod_idx] = True
-        for prod_idx, prod in enumerate(elim_prods):
-            if not replaced[prod_idx]:
-                new_prods.append(prod)
-        return new_prods
+                else:
+                    new_prods.append(prod)
+            elim_prods = _dedup(new_prods)
+        return elim_prods
+
+
+def _dedup(prods: list) -> list:
+    seen = set()
+    result = list()
+    for prod in prods:
+        if prod not in seen:
+            seen.add(prod)
+            result.append(prod)
+    return result
+
+
+def _find_nullable(grammar: Grammar) -> set:
+    nullable = set()
+    changed = True
+    while changed:
+        changed = False
+        for nterm, prods in grammar.prods.items():
+            if nterm not in nullable and any(
+                    all(sym == '@' or sym in nullable for sym in prod.syms) for prod in prods):
+                nullable.add(nterm)
+                changed = True
+    return nullable
+
+
+def find_left_recursion(grammar: Grammar, first=None):
+    # A nonterminal that may expand to itself before matching anything, or
+    # None; the parsers trying the productions top down (packrat, ll_star)
+    # would try it again forever. Unlike the left corners eliminated, the
+    # nullable symbols are looked past. first: the FIRST sets of ll1, if
+    # already built, tell the nullable nonterminals.
+    if first is not None:
+        nullable = set(nterm for nterm in grammar.prods if '@' in first[nterm])
+    else:
+        nullable = _find_nullable(grammar)
+    lefts = defaultdict(set)
+    for nterm, prods in grammar.prods.items():
+        for prod in prods:
+            for sym in prod.syms:
+                if sym in grammar.prods:
+                    lefts[nterm].add(sym)
+                if sym not in nullable:
+                    break
+    done = set()
+    for nterm in list(lefts):
+        path = set()
+        stack = [(nterm, False)]
+        while stack:
+            nterm, leaving = stack.pop()
+            if leaving:
+                path.discard(nterm)
+                done.add(nterm)
+                continue
+            if nterm in path:
+                return nterm
+            if nterm in done:
+                continue
+            path.add(nterm)
+            stack.append((nterm, True))
+            stack.extend((sym, False) for sym in lefts[nterm])
+    return None
 
 
+@instrument.timed('left_recursion_eliminator.eliminate')
 def eliminate(grammar: Grammar):
-    dup = grammar.duplicate()
-    elim = _EliminateLeftRecursion(dup)
-    return elim.grammar
+    elim = _EliminateLeftRecursion(grammar)
+    return grammar.derive(prods=elim.prods)
 
 
 def main():
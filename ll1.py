@@ -1,6 +1,8 @@
 #!/usr/bin/env python
-import bnf_parser
+import instrument
 from grammar import Grammar, Production
+from parse_error import ParseError
+import parse_error
 
 
 def _update_set(dst: set, to_add: set) -> bool:
@@ -9,21 +11,22 @@ def _update_set(dst: set, to_add: set) -> bool:
     return old_len != len(dst)
 
 
-def construct_first(grammar: Grammar) -> list:
-    def construct_first_nterm(nterm: str) -> bool:
-        changed = False
-        for prod in grammar.prods[nterm]:
-            for sym in prod.syms:
-                if sym != '@' and tuple(first[sym]) != ('@',):
-                    if _update_set(first[nterm], first[sym]):
-                        changed = True
-                    break
-            else:
-                if _update_set(first[nterm], {'@'}):
-                    first[nterm].add('@')
-                    changed = True
-        return changed
+def _construct_first_nterm(grammar: Grammar, first: dict, nterm: str) -> bool:
+    changed = False
+    for prod in grammar.prods[nterm]:
+        for sym in prod.syms:
+            if _update_set(first[nterm], first[sym] - {'@'}):
+                changed = True
+            if '@' not in first[sym]:
+                break
+        else:
+            if _update_set(first[nterm], {'@'}):
+                changed = True
+    return changed
 
+
+@instrument.timed('ll1.construct_first')
+def construct_first(grammar: Grammar) -> list:
     first = dict([(sym, set()) for sym in grammar.prods])
     first['@'] = {'@'}
     # FIRST(a) = {a}
@@ -31,14 +34,78 @@ def construct_first(grammar: Grammar) -> list:
         first[term] = {term}
 
     changed = True
+    rounds = 0
     while changed:
         changed = False
+        rounds += 1
         for nterm in grammar.prods:
-            if construct_first_nterm(nterm):
+            if _construct_first_nterm(grammar, first, nterm):
                 changed = True
+    if instrument.enabled:
+        instrument.count('rounds', rounds)
+        instrument.count('nterms', len(grammar.prods))
     return first
 
 
+def _index_occurrences(grammar: Grammar) -> dict:
+    # occurrences[sym] = list of Productions whose right hand side has sym
+    occurrences = dict()
+    for prodlist in grammar.prods.values():
+        for prod in prodlist:
+            for sym in set(prod.syms):
+                occurrences.setdefault(sym, list()).append(prod)
+    return occurrences
+
+
+@instrument.timed('ll1.update_first')
+def update_first(grammar: Grammar, first: dict, changed_nterms) -> tuple:
+    # Recompute FIRST only for the changed nonterminals and the nonterminals
+    # whose FIRST may be derived from them. Returns the new FIRST and the
+    # set of nonterminals whose FIRST actually changed.
+    occurrences = _index_occurrences(grammar)
+    # A changed nonterminal may also have lost all its productions and be a
+    # terminal now, so it is tracked in dirty but not in affected.
+    dirty = set(changed_nterms)
+    maybe_nullable = lambda sym: sym in dirty or '@' in first.get(sym, ())
+    work = list(dirty)
+    while work:
+        sym = work.pop()
+        for prod in occurrences.get(sym, ()):
+            if prod.nterm in dirty:
+                continue
+            for prefix_sym in prod.syms:
+                if prefix_sym in dirty:
+                    dirty.add(prod.nterm)
+                    work.append(prod.nterm)
+                    break
+                if not maybe_nullable(prefix_sym):
+                    break
+    affected = set(filter(grammar.is_nonterminal, dirty))
+
+    result = dict()
+    for nterm in grammar.prods:
+        result[nterm] = set() if nterm in affected else first[nterm]
+    result['@'] = {'@'}
+    for term in grammar.terms:
+        result[term] = {term}
+
+    changed = True
+    rounds = 0
+    while changed:
+        changed = False
+        rounds += 1
+        for nterm in affected:
+            if _construct_first_nterm(grammar, result, nterm):
+                changed = True
+    first_changed = set(filter(lambda x: x in result and result[x] != first.get(x),
+                               dirty))
+    if instrument.enabled:
+        instrument.count('rounds', rounds)
+        instrument.count('affected', len(affected))
+        instrument.count('first_changed', len(first_changed))
+    return result, first_changed
+
+
 # returns {'@'} on empty syms
 def get_first_from_syms(first: list, syms: list) -> set:
     # First, assume that eps is already in FIRST
@@ -52,39 +119,100 @@ def get_first_from_syms(first: list, syms: list) -> set:
     return result
 
 
-def construct_follow(grammar: Grammar, first: list) -> list:
-    def construct_follow_nterm(prod: Production) -> bool:
-        changed = False
-        i = 0
-        while i < len(prod.syms):
-            nterm = prod.syms[i]
-            # Only process nonterminals
-            if not grammar.is_nonterminal(nterm):
-                i += 1
-                continue
-            i += 1
-
-            remaining_syms = prod.syms[i:]
-            remaining_first = get_first_from_syms(first, remaining_syms)
-            if _update_set(follow[nterm], remaining_first - {'@'}):
+def _construct_follow_prod(grammar: Grammar, first: dict, follow: dict,
+                           prod: Production, only=None) -> bool:
+    changed = False
+    i = 0
+    while i < len(prod.syms):
+        nterm = prod.syms[i]
+        i += 1
+        # Only process nonterminals
+        if not grammar.is_nonterminal(nterm):
+            continue
+        if only is not None and nterm not in only:
+            continue
+
+        remaining_syms = prod.syms[i:]
+        remaining_first = get_first_from_syms(first, remaining_syms)
+        if _update_set(follow[nterm], remaining_first - {'@'}):
+            changed = True
+        if '@' in remaining_first:
+            if _update_set(follow[nterm], follow[prod.nterm]):
                 changed = True
-            if '@' in remaining_first:
-                if _update_set(follow[nterm], follow[prod.nterm]):
-                    changed = True
-        return changed
+    return changed
+
 
+@instrument.timed('ll1.construct_follow')
+def construct_follow(grammar: Grammar, first: list) -> list:
     follow = dict([(sym, set()) for sym in grammar.prods])
     follow[grammar.start] = {'$'}
     changed = True
+    rounds = 0
     while changed:
         changed = False
+        rounds += 1
         for prodlist in grammar.prods.values():
             for prod in prodlist:
-                if construct_follow_nterm(prod):
+                if _construct_follow_prod(grammar, first, follow, prod):
                     changed = True
+    if instrument.enabled:
+        instrument.count('rounds', rounds)
     return follow
 
 
+@instrument.timed('ll1.update_follow')
+def update_follow(grammar: Grammar, first: dict, follow: dict,
+                  changed_prods, first_changed) -> dict:
+    # changed_prods: the removed and added Productions
+    # first_changed: nonterminals whose FIRST changed, see update_first()
+    occurrences = _index_occurrences(grammar)
+    affected = set()
+    for prod in changed_prods:
+        affected.update(filter(grammar.is_nonterminal, prod.syms))
+    for sym in first_changed:
+        for prod in occurrences.get(sym, ()):
+            last = len(prod.syms) - 1 - prod.syms[::-1].index(sym)
+            for prefix_sym in prod.syms[:last]:
+                if grammar.is_nonterminal(prefix_sym):
+                    affected.add(prefix_sym)
+    affected.update(filter(lambda x: x not in follow, grammar.prods))
+
+    # FOLLOW(A) flows into every B at a nullable tail of A's productions
+    work = list(affected)
+    while work:
+        nterm = work.pop()
+        for prod in grammar.prods[nterm]:
+            for sym in reversed(prod.syms):
+                if grammar.is_nonterminal(sym) and sym not in affected:
+                    affected.add(sym)
+                    work.append(sym)
+                if '@' not in first[sym]:
+                    break
+
+    result = dict()
+    for nterm in grammar.prods:
+        result[nterm] = set() if nterm in affected else follow[nterm]
+    if grammar.start in affected:
+        result[grammar.start] = {'$'}
+
+    prods = set()
+    for nterm in affected:
+        prods.update(occurrences.get(nterm, ()))
+    changed = True
+    rounds = 0
+    while changed:
+        changed = False
+        rounds += 1
+        for prod in prods:
+            if _construct_follow_prod(grammar, first, result, prod, affected):
+                changed = True
+    if instrument.enabled:
+        instrument.count('rounds', rounds)
+        instrument.count('affected', len(affected))
+    return result
+
+
+@instrument.timed('ll1.construct_table')
 def construct_table(grammar: Grammar, first: list, follow: list) -> dict:
     # table[nterm][term] = Production
     table = dict([(sym, list()) for sym in grammar.prods])
@@ -98,6 +226,8 @@ def construct_table(grammar: Grammar, first: list, follow: list) -> dict:
                             table[nterm].append((term, prod))
                 else:
                     table[nterm].append((term, prod))
+    if instrument.enabled:
+        instrument.count('entries', sum(len(pairs) for pairs in table.values()))
     return table
 
 
@@ -113,40 +243,76 @@ def construct_conflicts(table: dict) -> list:
     return result
 
 
-def _str_first_or_follow(grammar: Grammar, first: list, title) -> str:
-    result = '  ' + title + ':'
+# Column names of the rows yielded by the iter_*_rows() functions
+FIRST_COLUMNS = ('nterm', 'sym')
+TABLE_COLUMNS = ('nterm', 'term', 'prod')
+
+
+def _iter_first_or_follow(grammar: Grammar, first: list, title):
+    yield '  ' + title + ':'
     for sym in grammar.prods:
-        result += '\n    {}: {}'.format(sym, ' '.join(first[sym]))
-    return result
+        yield '    {}: {}'.format(sym, ' '.join(first[sym]))
+
+
+def iter_first_rows(grammar: Grammar, first: list):
+    for nterm in grammar.prods:
+        for sym in first[nterm]:
+            yield nterm, sym
+
+
+def iter_follow(grammar: Grammar, follow: list):
+    return _iter_first_or_follow(grammar, follow, 'FOLLOW')
+
+
+def iter_first(grammar: Grammar, first: list):
+    return _iter_first_or_follow(grammar, first, 'FIRST')
 
 
 def str_follow(grammar: Grammar, follow: list) -> str:
-    return _str_first_or_follow(grammar, follow, 'FOLLOW')
+    return '\n'.join(iter_follow(grammar, follow))
 
 
 def str_first(grammar: Grammar, first: list) -> str:
-    return _str_first_or_follow(grammar, first, 'FIRST')
+    return '\n'.join(iter_first(grammar, first))
 
 
-def str_table(table: dict) -> str:
-    result = '  Table:'
+def iter_table_rows(table: dict):
     for nterm, pairs in table.items():
-        result += '\n    {}:'.format(nterm)
         for term, prod in sorted(pairs, key=lambda x: x[0]):
-            result += '\n      {}: {}'.format(term, prod)
-    return result
+            yield nterm, term, str(prod)
 
 
-def str_conflicts(conflicts: list) -> str:
-    result = ''
+def iter_table(table: dict):
+    yield '  Table:'
+    for nterm, pairs in table.items():
+        yield '    {}:'.format(nterm)
+        for term, prod in sorted(pairs, key=lambda x: x[0]):
+            yield '      {}: {}'.format(term, prod)
+
+
+def str_table(table: dict) -> str:
+    return '\n'.join(iter_table(table))
+
+
+def iter_conflicts_rows(conflicts: list):
     for nterm, term, prods in conflicts:
-        result += '\n    {}, {}:'.format(nterm, term)
         for prod in prods:
-            result += '\n      ' + str(prod)
-    if result:
-        return '  Conflicts:' + result
-    else:
-        return '  Conflicts: None'
+            yield nterm, term, str(prod)
+
+
+def iter_conflicts(conflicts: list):
+    if not conflicts:
+        yield '  Conflicts: None'
+        return
+    yield '  Conflicts:'
+    for nterm, term, prods in conflicts:
+        yield '    {}, {}:'.format(nterm, term)
+        for prod in prods:
+            yield '      ' + str(prod)
+
+
+def str_conflicts(conflicts: list) -> str:
+    return '\n'.join(iter_conflicts(conflicts))
 
 
 def str_ll1(grammar: Grammar) -> str:
@@ -155,67 +321,188 @@ def str_ll1(grammar: Grammar) -> str:
     table = construct_table(grammar, first, follow)
     conflicts = construct_conflicts(table)
 
-    result = 'LL(1):'
-    result += '\n' + str_first(grammar, first)
-    result += '\n' + str_follow(grammar, follow)
-    result += '\n' + str_table(table)
-    result += '\n' + str_conflicts(conflicts)
-    return result
+    return '\n'.join(['LL(1):', str_first(grammar, first),
+                      str_follow(grammar, follow), str_table(table),
+                      str_conflicts(conflicts)])
+
+
+def get_expected(table: dict, top: str) -> tuple:
+    # Terminals with an entry in the row of a nonterminal
+    return tuple(sorted(set(term for term, _ in table[top])))
+
 
+def _get_production(table: dict, top: str, sym: str):
+    return next((prod for term, prod in table[top] if term == sym), None)
 
-def parse(grammar: Grammar, table: dict, syms: list, callback):
+
+def _simulate(grammar: Grammar, table: dict, stack: list, syms: list) -> bool:
+    # Whether syms parse from the configuration of stack. The stack is left
+    # alone: popping it only lowers depth, expansions go to pushed.
+    depth = len(stack)
+    pushed = list()
+    for sym in syms:
+        while True:
+            if pushed:
+                top = pushed.pop()
+            elif depth:
+                depth -= 1
+                top = stack[depth]
+            else:
+                return sym == '$'
+            if grammar.is_terminal(top):
+                if top != sym:
+                    return False
+                break
+            prod = _get_production(table, top, sym)
+            if prod is None:
+                return False
+            if prod.syms != ('@',):
+                pushed.extend(reversed(prod.syms))
+    return True
+
+
+def _recover_panic(grammar: Grammar, table: dict, follow: dict, stack: list,
+                   syms: list, pos: int, error: ParseError, failed=False) -> int:
+    # A missing terminal is taken as inserted. For a nonterminal, input is
+    # skipped up to a symbol it expands on or one of its FOLLOW set, which
+    # pops it. failed: the nonterminal already failed to expand at pos,
+    # which then is skipped unless it pops it. Returns the new position.
+    top = stack[-1]
+    if grammar.is_terminal(top):
+        stack.pop()
+        error.recovery = 'insert ' + top
+        return pos
+    start = pos
+    while True:
+        sym = syms[pos] if pos < len(syms) else '$'
+        if _get_production(table, top, sym) is not None and not (failed and pos == start):
+            error.recovery = 'skip {} symbol(s)'.format(pos - start)
+            return pos
+        if sym == '$' or sym in follow[top]:
+            stack.pop()
+            error.recovery = 'skip {} symbol(s), pop {}'.format(pos - start, top)
+            return pos
+        pos += 1
+
+
+@instrument.timed('ll1.parse')
+def parse(grammar: Grammar, table: dict, syms: list, callback=None, stats=None,
+          recovery=None, predictor=None):
+    # stats: a parse_stats.ParseStats, the nonterminals expanded are counted
+    # as the visited states
+    # predictor: an ll_star.Predictor picking the production of the entries
+    # with conflicts by looking further ahead; otherwise the first one wins
+    # Raises ParseError on the first syntax error unless recovery (a
+    # parse_error.Recovery) is given; returns the list of errors recovered from.
     stack = [grammar.start]
     pos = 0
-    callback('INIT', stack, pos, None)
+    n = len(syms)
+    sym = syms[0] if n else '$'
+    inserted = False  # sym was inserted by a repair and is not in the input
+    follow = recovery.follow if recovery is not None else None
+    last_error = None
+    errors = parse_error.ErrorList(recovery)
+    if callback:
+        callback('INIT', stack, pos, None)
     while stack:
-        sym = '$'
-        if pos < len(syms):
-            sym = syms[pos]
-        top = stack.pop()
+        top = stack[-1]
+        failed = False  # top has an entry for sym but the predictor found no parse
         if grammar.is_terminal(top):
-            assert sym == top
-            pos += 1
-            if pos > len(syms):
-                pos = len(syms)
-            callback('MATCH', stack, pos, sym)
+            if sym != top:
+                error = ParseError(sym, pos, (top,))
+            else:
+                stack.pop()
+                if inserted:
+                    inserted = False
+                else:
+                    pos += 1
+                sym = syms[pos] if pos < n else '$'
+                if callback:
+                    callback('MATCH', stack, pos, top)
+                continue
         else:
-            prod = list(filter(lambda x: x[0] == sym, table[top]))[0]
-            prod = prod[1]
-            stack_syms = prod.syms[-1::-1]
-            if tuple(stack_syms) != ('@',):
-                stack.extend(stack_syms)
-            callback('OUTPUT', stack, pos, prod)
+            if predictor is not None and (top, sym) in predictor.conflicts \
+               and not inserted:
+                prod = predictor.predict(top, stack, syms, pos)
+                failed = prod is None
+            else:
+                prod = _get_production(table, top, sym)
+            if prod is not None:
+                stack.pop()
+                if prod.syms != ('@',):
+                    stack.extend(reversed(prod.syms))
+                if callback:
+                    callback('OUTPUT', stack, pos, prod)
+                if stats is not None:
+                    stats.visits[top] += 1
+                    stats.productions[prod] += 1
+                    if len(stack) > stats.max_depth:
+                        stats.max_depth = len(stack)
+                continue
+            error = ParseError(sym, pos, get_expected(table, top))
+        if recovery is None:
+            raise error
+        # An error with the position and stack of the last one got no
+        # further: the symbol there is skipped unless the top is popped
+        repeated = last_error is not None and last_error[0] == pos and last_error[1] == stack
+        last_error = (pos, list(stack))
+        inserted = False
+        repair = None
+        if recovery.mode == 'repair' and not repeated:
+            repair = parse_error.find_repair(
+                lambda x: _simulate(grammar, table, stack, x), error.expected,
+                syms, pos, recovery)
+        if repair:
+            deleted, inserted_sym = repair
+            error.recovery = parse_error.str_repair(syms, pos, deleted, inserted_sym)
+            pos += deleted
+            inserted = inserted_sym is not None
+            sym = inserted_sym if inserted else syms[pos] if pos < n else '$'
+        else:
+            if follow is None:
+                follow = construct_follow(grammar, construct_first(grammar))
+            pos = _recover_panic(grammar, table, follow, stack, syms, pos, error,
+                                 failed or repeated)
+            sym = syms[pos] if pos < n else '$'
+        errors.add(error)
+        errors.resume(pos)
+    if pos < n:
+        error = ParseError(sym, pos, ('$',))
+        if recovery is None:
+            raise error
+        error.recovery = 'skip {} symbol(s)'.format(n - pos)
+        errors.add(error)
+    if stats is not None:
+        stats.tokens += n
+    return errors
+
+
+def iter_parse(grammar: Grammar, table: dict, syms: list, page_size=50):
+    # The steps of the parse, every page of page_size steps with its own
+    # column widths, like lr.iter_parse. A syntax error ends them with its
+    # message.
+    import parse_trace
+    trace = parse_trace.record_ll1(grammar, table, syms)
+    replay = parse_trace.TraceReplay(trace)
+    for begin in range(0, len(trace), page_size):
+        rows = [(' '.join(syms[trace.positions[step]:]) + ' $',
+                 ' '.join(stack[-1::-1]) + ' $', parse_trace._str_action(trace, step))
+                for step, _, stack in replay.iter_stacks(begin, begin + page_size)]
+        inputs_length = max([len(row[0]) for row in rows])
+        stacks_length = max([len(row[1]) for row in rows])
+        for input_val, stack, action in rows:
+            yield '  {} | {} | {}'.format(
+                input_val.rjust(inputs_length), stack.rjust(stacks_length), action)
+    if trace.error:
+        yield '  ' + trace.error
 
 
 def str_parse(grammar: Grammar, table: dict, syms: list):
-    def callback(action, stack, pos, info):
-        str_action = ''
-        if action == 'MATCH':
-            str_action = 'match  ' + info
-        elif action == 'OUTPUT':
-            str_action = 'output '  + str(info)
-        inputs.append(' '.join(syms[pos:]) + ' $')
-        stacks.append(' '.join(stack[-1::-1]) + ' $')
-        actions.append(str_action)
-
-    inputs = list()
-    stacks = list()
-    actions = list()
-    parse(grammar, table, syms, callback)
-
-    get_length = lambda arr: max([len(t) for t in arr])
-    inputs_length = get_length(inputs)
-    stacks_length = get_length(stacks)
-
-    result = ''
-    for i, input_val in enumerate(inputs):
-        result += '  {} | {} | {}\n'.format(
-            input_val.rjust(inputs_length), stacks[i].rjust(stacks_length),
-            actions[i])
-    return result
+    return '\n'.join(iter_parse(grammar, table, syms))
 
 
 def _demo_construction(bnf):
+    import bnf_parser
     grammar = bnf_parser.parse(bnf)
     print(grammar)
     print(str_ll1(grammar))
@@ -231,6 +518,7 @@ def _demo_parse(grammar: Grammar, syms: str):
 
 
 def main():
+    import bnf_parser
     bnf = '''
     E  := T E'
     E' := + T E' | @
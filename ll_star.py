@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+from collections import OrderedDict
+from grammar import Grammar
+import left_recursion_eliminator
+import ll1
+
+# Adaptive prediction (ALL(*), Parr et al.) for the conflicting entries of
+# an LL(1) table. The productions of the nonterminal are simulated in
+# parallel over the input until the ones left agree. A configuration is
+# (alt, stack) with alt the index of the production in grammar.prods[nterm]
+# and stack the symbols left to match, as (sym, rest) pairs ending with
+#   (_FOLLOW, nterm): whatever may follow nterm, which makes the prediction
+#                     independent of the parse so that it can be cached
+#   (_DEPTH, depth):  stack[:depth] of the parser, for the full context
+#                     prediction the cached one falls back to on conflicts
+# Every nonterminal has a lookahead DFA whose states are sets of
+# configurations, built lazily as inputs need them.
+
+_FOLLOW = object()
+_DEPTH = object()
+_ACCEPTED = ('$', None)  # the stack of the configurations that matched '$'
+
+_UNDECIDED = None
+_CONFLICT = -1  # the configurations of several alts only differ by the alt
+_NO_ALT = -2  # no production matches
+
+
+class _DFAState:
+    __slots__ = ('configs', 'edges', 'alt')
+
+    def __init__(self, configs: frozenset, alt):
+        self.configs = configs
+        self.edges = dict()  # edges[term] = _DFAState
+        self.alt = alt
+
+
+class PredictionStats:
+    def __init__(self):
+        self.predictions = 0
+        self.hits = 0  # DFA edges found in the cache
+        self.misses = 0  # DFA edges computed
+        self.full_context = 0  # predictions that fell back to the full context
+        self.evictions = 0  # DFAs dropped to stay under max_states
+        self.lookahead = 0  # terminals looked at over all the predictions
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def _push(syms, stack) -> tuple:
+    for sym in reversed(syms):
+        if sym != '@':
+            stack = (sym, stack)
+    return stack
+
+
+def _decide(configs: frozenset, sym: str):
+    alts = dict()
+    for alt, stack in configs:
+        alts.setdefault(alt, set()).add(stack)
+    if not alts:
+        return _NO_ALT
+    if len(alts) == 1:
+        return next(iter(alts))
+    stacks = list(alts.values())
+    if sym == '$' or all(x == stacks[0] for x in stacks[1:]):
+        return _CONFLICT
+    return _UNDECIDED
+
+
+class Predictor:
+    # Passed to ll1.parse to predict the entries of the table with more than
+    # one production. max_states bounds the DFA states over all the
+    # nonterminals; beyond, the DFAs used the least recently are dropped.
+    # Like ALL(*), left recursion is not supported: raises ValueError on
+    # left recursive grammars, see left_recursion_eliminator.
+    def __init__(self, grammar: Grammar, table: dict, max_states=10000):
+        nterm = left_recursion_eliminator.find_left_recursion(grammar)
+        if nterm is not None:
+            raise ValueError('Left recursive nonterminal {} cannot be '
+                             'predicted'.format(nterm))
+        self.grammar = grammar
+        self.max_states = max_states
+        # cells[(nterm, term)] = the productions of the table entry
+        self.cells = dict()
+        for nterm, pairs in table.items():
+            for term, prod in pairs:
+                self.cells.setdefault((nterm, term), list()).append(prod)
+        self.conflicts = frozenset(key for key, prods in self.cells.items() if len(prods) > 1)
+        # follows[nterm] = [(nterm of the production, symbols after nterm)]
+        self.follows = dict()
+        for prodlist in grammar.prods.values():
+            for prod in prodlist:
+                for i, sym in enumerate(prod.syms):
+                    if sym in grammar.prods:
+                        self.follows.setdefault(sym, list()).append(
+                            (prod.nterm, prod.syms[i + 1:]))
+        self.dfas = OrderedDict()  # dfas[nterm] = (start state, {configs: state})
+        self.n_states = 0
+        self.stats = PredictionStats()
+
+    def _move(self, configs, sym: str, stack: list) -> frozenset:
+        # The configurations after matching sym, with the stack of the
+        # parser for the full context ones
+        result = set()
+        is_terminal = self.grammar.is_terminal
+        for alt, config_stack in configs:
+            pending = [config_stack]
+            seen = set()
+            while pending:
+                config_stack = pending.pop()
+                if config_stack in seen:
+                    continue
+                seen.add(config_stack)
+                top, rest = config_stack
+                if top is _FOLLOW:
+                    if rest == self.grammar.start and sym == '$':
+                        result.add((alt, _ACCEPTED))
+                    for nterm, syms in self.follows.get(rest, ()):
+                        pending.append(_push(syms, (_FOLLOW, nterm)))
+                elif top is _DEPTH:
+                    if rest == 0:
+                        if sym == '$':
+                            result.add((alt, _ACCEPTED))
+                    else:
+                        pending.append((stack[rest - 1], (_DEPTH, rest - 1)))
+                elif is_terminal(top):
+                    if top == sym:
+                        result.add((alt, rest))
+                else:
+                    for prod in self.cells.get((top, sym), ()):
+                        pending.append(_push(prod.syms, rest))
+        return frozenset(result)
+
+    def _get_start_configs(self, nterm: str, bottom: tuple) -> frozenset:
+        return frozenset((alt, _push(prod.syms, bottom))
+                         for alt, prod in enumerate(self.grammar.prods[nterm]))
+
+    def _get_dfa(self, nterm: str) -> tuple:
+        dfa = self.dfas.get(nterm)
+        if dfa is None:
+            configs = self._get_start_configs(nterm, (_FOLLOW, nterm))
+            start = _DFAState(configs, _UNDECIDED)
+            dfa = self.dfas[nterm] = (start, {configs: start})
+            self.n_states += 1
+        else:
+            self.dfas.move_to_end(nterm)
+        return dfa
+
+    def _evict(self, nterm: str):
+        # Drops the DFAs used the least recently but the one of nterm
+        while self.n_states >= self.max_states and len(self.dfas) > 1:
+            lru = next(iter(self.dfas))
+            if lru == nterm:
+                self.dfas.move_to_end(nterm)
+                continue
+            self.n_states -= len(self.dfas.pop(lru)[1])
+            self.stats.evictions += 1
+        if self.n_states >= self.max_states:
+            self.n_states -= len(self.dfas.pop(nterm)[1])
+            self.stats.evictions += 1
+
+    def _predict_full_context(self, nterm: str, stack: list, syms: list, pos: int):
+        self.stats.full_context += 1
+        configs = self._get_start_configs(nterm, (_DEPTH, len(stack) - 1))
+        while True:
+            sym = syms[pos] if pos < len(syms) else '$'
+            configs = self._move(configs, sym, stack)
+            self.stats.lookahead += 1
+            alt = _decide(configs, sym)
+            if alt == _CONFLICT:
+                # Ambiguous: like a table, the first production wins
+                return min(alt for alt, _ in configs)
+            if alt is not _UNDECIDED:
+                return alt
+            pos += 1
+
+    def predict(self, nterm: str, stack: list, syms: list, pos: int):
+        # The production of nterm to expand at syms[pos], or None if none
+        # parses; stack is the one of ll1.parse, nterm on top
+        self.stats.predictions += 1
+        start, states = self._get_dfa(nterm)
+        state = start
+        n = len(syms)
+        start_pos = pos
+        while True:
+            sym = syms[pos] if pos < n else '$'
+            next_state = state.edges.get(sym)
+            if next_state is None:
+                self.stats.misses += 1
+                configs = self._move(state.configs, sym, None)
+                next_state = states.get(configs)
+                if next_state is None:
+                    if self.n_states >= self.max_states:
+                        self._evict(nterm)
+                        start, states = self._get_dfa(nterm)
+                    next_state = states[configs] = _DFAState(configs, _decide(configs, sym))
+                    self.n_states += 1
+                state.edges[sym] = next_state
+            else:
+                self.stats.hits += 1
+            self.stats.lookahead += 1
+            state = next_state
+            if state.alt is not _UNDECIDED:
+                break
+            pos += 1
+        alt = state.alt
+        if alt == _NO_ALT:
+            return None
+        if alt == _CONFLICT:
+            alt = self._predict_full_context(nterm, stack, syms, start_pos)
+            if alt == _NO_ALT:
+                return None
+        return self.grammar.prods[nterm][alt]
+
+
+# Column names of the rows yielded by iter_stats_rows()
+STATS_COLUMNS = ('name', 'value')
+
+
+def iter_stats_rows(predictor: Predictor):
+    stats = predictor.stats
+    yield 'predictions', stats.predictions
+    yield 'hit rate', round(stats.get_hit_rate(), 4)
+    yield 'hits', stats.hits
+    yield 'misses', stats.misses
+    yield 'full context', stats.full_context
+    yield 'lookahead', stats.lookahead
+    yield 'states', predictor.n_states
+    yield 'evictions', stats.evictions
+
+
+def iter_stats(predictor: Predictor):
+    for name, value in iter_stats_rows(predictor):
+        yield '  {:13}: {}'.format(name.capitalize(), value)
+
+
+def str_stats(predictor: Predictor) -> str:
+    return '\n'.join(iter_stats(predictor))
+
+
+def main():
+    # Telling the statements apart takes the whole path
+    import bnf_parser
+    bnf = '''
+    Stmts := Stmt More
+    More  := ; Stmt More | @
+    Stmt  := Path = Path | Path ( ) | Path
+    Path  := id Rest
+    Rest  := . id Rest | @
+    '''
+    grammar = bnf_parser.parse(bnf)
+    first = ll1.construct_first(grammar)
+    table = ll1.construct_table(grammar, first, ll1.construct_follow(grammar, first))
+    print(ll1.str_conflicts(ll1.construct_conflicts(table)))
+    predictor = Predictor(grammar, table)
+    syms = 'id . id = id ; id . id . id ( ) ; id ; id . id = id'.split()
+    ll1.parse(grammar, table, syms, predictor=predictor)
+    print(str_stats(predictor))
+
+
+if __name__ == '__main__':
+    main()
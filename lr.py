@@ -1,14 +1,30 @@
 #!/usr/bin/env python
+import time
 from collections import defaultdict
 from grammar import Grammar, Production
-import bnf_parser
+from parse_error import ParseError, Recovery
+import instrument
 import ll1
+import parse_error
 
 
 class LR0Item:
+    # next_sym is the symbol after the dot or None at the end. It, the hash
+    # and the item after the dot moved are kept since the closure and goto
+    # loops ask for them over and over.
+    __slots__ = ('prod', 'pos', 'next_sym', '_hash', '_next_item')
+
     def __init__(self, prod: Production=None, pos=0):
         self.prod = prod
         self.pos = pos
+        self.next_sym = None
+        if prod is not None and pos < len(prod.syms) and prod.syms[pos] != '@':
+            self.next_sym = prod.syms[pos]
+        self._hash = hash(prod) ^ hash(pos)
+        self._next_item = None
+
+    def __reduce__(self):
+        return LR0Item, (self.prod, self.pos)
 
     def __eq__(self, other):
         return self.prod == other.prod and self.pos == other.pos
@@ -17,7 +33,7 @@ class LR0Item:
         return not self == other
 
     def __hash__(self):
-        return hash(self.prod) ^ hash(self.pos)
+        return self._hash
 
     def get_next_syms(self):
         if self.pos >= len(self.prod.syms):
@@ -28,6 +44,11 @@ class LR0Item:
         return result
 
     def get_next_item(self):
+        if self._next_item is None:
+            self._next_item = self._build_next_item()
+        return self._next_item
+
+    def _build_next_item(self):
         return LR0Item(self.prod, self.pos + 1)
 
     def __repr__(self):
@@ -40,15 +61,21 @@ class LR0Item:
 
 
 class LR1Item(LR0Item):
+    __slots__ = ('lookahead',)
+
     def __init__(self, prod: Production=None, pos=0, lookahead=frozenset()):
         LR0Item.__init__(self, prod, pos)
         self.lookahead = lookahead
+        self._hash ^= hash(lookahead)
+
+    def __reduce__(self):
+        return LR1Item, (self.prod, self.pos, self.lookahead)
 
     def __eq__(self, other):
         return LR0Item.__eq__(self, other) and self.lookahead == other.lookahead
 
     def __hash__(self):
-        return LR0Item.__hash__(self) ^ hash(self.lookahead)
+        return self._hash
 
     def __repr__(self):
         return "LR1Item{}".format(str(self))
@@ -56,7 +83,7 @@ class LR1Item(LR0Item):
     def __str__(self):
         return "[{}, {}]".format(LR0Item.__str__(self), '/'.join(self.lookahead))
 
-    def get_next_item(self):
+    def _build_next_item(self):
         return LR1Item(self.prod, self.pos + 1, self.lookahead)
 
 
@@ -83,13 +110,12 @@ class LRState:
             closure.update(edge.src_items)
         return closure
 
-    @staticmethod
-    def find_kernel_index(states, kernel):
-        kernels = [i.kernel for i in states]
-        try:
-            return kernels.index(kernel)
-        except ValueError:
-            return -1
+    def iter_nonkernel(self):
+        # Every closure item belongs to exactly one edge
+        for edge in self.edges.values():
+            for item in edge.src_items:
+                if item not in self.kernel:
+                    yield item
 
 
 class LRAction:
@@ -146,11 +172,18 @@ class LR0AlgorithmSuit:
 
     def __init__(self, grammar: Grammar):
         self.grammar = grammar
+        self._items = dict()  # the items built, shared by the states
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_items'] = dict()
+        return state
 
     def build_item(self, prod: Production, parent: LR0Item=None):
-        self = self
-        parent = parent
-        return LR0Item(prod)
+        result = self._items.get(prod)
+        if result is None:
+            result = self._items[prod] = LR0Item(prod)
+        return result
 
     def build_reduce(self, actions: defaultdict, edge: LREdge):
         # Just simply reduce!
@@ -162,10 +195,11 @@ class LR0AlgorithmSuit:
 class SLR1AlgorithmSuit(LR0AlgorithmSuit):
     NAME = 'SLR(1)'
 
-    def __init__(self, grammar: Grammar):
+    def __init__(self, grammar: Grammar, first=None, follow=None):
         LR0AlgorithmSuit.__init__(self, grammar)
-        first = ll1.construct_first(grammar)
-        self.follow = ll1.construct_follow(grammar, first)
+        self.first = first if first is not None else ll1.construct_first(grammar)
+        self.follow = follow if follow is not None \
+            else ll1.construct_follow(grammar, self.first)
 
     def build_reduce(self, actions: defaultdict, edge: LREdge):
         # Reduce by consulting the FOLLOW set
@@ -177,18 +211,38 @@ class SLR1AlgorithmSuit(LR0AlgorithmSuit):
 class LR1AlgorithmSuit:
     NAME = 'LR(1)'
 
-    def __init__(self, grammar: Grammar):
-        self.first = ll1.construct_first(grammar)
+    def __init__(self, grammar: Grammar, first=None):
+        self.first = first if first is not None else ll1.construct_first(grammar)
+        self._suffix_first = dict()  # [(prod, pos)] = FIRST after the next symbol
+        self._lookaheads = dict()  # [(prod, pos, lookahead)] = lookahead of children
+        self._items = dict()  # [(prod, lookahead)] = item, shared by the states
+
+    def __getstate__(self):
+        return dict(first=self.first, _suffix_first=dict(), _lookaheads=dict(),
+                    _items=dict())
+
+    def _get_lookahead(self, parent: LR1Item) -> frozenset:
+        key = (parent.prod, parent.pos, parent.lookahead)
+        result = self._lookaheads.get(key)
+        if result is None:
+            suffix_key = (parent.prod, parent.pos)
+            suffix_first = self._suffix_first.get(suffix_key)
+            if suffix_first is None:
+                suffix_first = frozenset(ll1.get_first_from_syms(
+                    self.first, parent.prod.syms[parent.pos + 1:]))
+                self._suffix_first[suffix_key] = suffix_first
+            result = suffix_first
+            if '@' in result:
+                result = (result - {'@'}) | parent.lookahead
+            self._lookaheads[key] = result
+        return result
 
     def build_item(self, prod: Production, parent: LR1Item=None):
-        if not parent:
-            return LR1Item(prod, 0, frozenset({'$'}))
-
-        lookaheads = ll1.get_first_from_syms(self.first, parent.get_next_syms()[1:])
-        if '@' in lookaheads:
-            lookaheads.discard('@')
-            lookaheads.update(parent.lookahead)
-        result = LR1Item(prod, 0, frozenset(lookaheads))
+        lookahead = self._get_lookahead(parent) if parent else frozenset({'$'})
+        key = (prod, lookahead)
+        result = self._items.get(key)
+        if result is None:
+            result = self._items[key] = LR1Item(prod, 0, lookahead)
         return result
 
     def build_reduce(self, actions: defaultdict, edge: LREdge):
@@ -210,11 +264,10 @@ def get_closure(grammar: Grammar, item, algo_suit) -> set:
         item = new_items.pop()
         result.add(item)
 
-        next_syms = item.get_next_syms()
-        if not next_syms or \
-            not grammar.is_nonterminal(next_syms[0]):
+        next_sym = item.next_sym
+        if next_sym is None or not grammar.is_nonterminal(next_sym):
             continue
-        for prod in grammar.prods[next_syms[0]]:
+        for prod in grammar.prods[next_sym]:
             new_item = algo_suit.build_item(prod, item)
             if new_item not in result:
                 new_items.add(new_item)
@@ -223,35 +276,39 @@ def get_closure(grammar: Grammar, item, algo_suit) -> set:
 
 def construct_argumented_grammar(grammar: Grammar) -> Grammar:
     START_NTERM = '!S'
-    g = grammar.duplicate()
-    g.add_production(START_NTERM, (g.start,))
-    g.start = START_NTERM
-    return g
+    return grammar.derive(START_NTERM,
+                          {START_NTERM: (Production(START_NTERM, (grammar.start,)),)})
 
 
 def _construct_state_transition_dict(grammar: Grammar, src_state: LRState, algo_suit):
     src_closure_items = get_closure(grammar, src_state.kernel, algo_suit)
+    return _group_by_next_sym(src_closure_items)
+
 
+def _group_by_next_sym(src_closure_items):
     src_dict = defaultdict(set)  # edge_src_state[sym] = set(src_items)
     dst_dict = defaultdict(set)  # edge_dst_state[sym] = set(dst_items)
     for item in src_closure_items:
-        next_syms = item.get_next_syms()
-        if next_syms:
-            src_dict[next_syms[0]].add(item)
-            dst_dict[next_syms[0]].add(item.get_next_item())
+        next_sym = item.next_sym
+        if next_sym is not None:
+            src_dict[next_sym].add(item)
+            dst_dict[next_sym].add(item.get_next_item())
         else:
             src_dict[''].add(item)
     return src_dict, dst_dict
 
 
-def _construct_edge(states: list, src_dict: dict, dst_dict: dict):
+def _construct_edge(states: list, kernels: dict, src_dict: dict, dst_dict: dict):
+    # New states are numbered in symbol order, not in the order of the sets,
+    # so that the numbering does not depend on the hash seed
     edges = dict()
-    for sym in dst_dict:
+    for sym in sorted(dst_dict):
         src_items = frozenset(src_dict[sym])
         dst_items = frozenset(dst_dict[sym])
-        dst_index = LRState.find_kernel_index(states, dst_items)
+        dst_index = kernels.get(dst_items, -1)
         if dst_index == -1:
             dst_index = len(states)
+            kernels[dst_items] = dst_index
             states.append(LRState(dst_items))
         edges[sym] = LREdge(src_items, dst_index)
     if '' in src_dict:
@@ -259,21 +316,115 @@ def _construct_edge(states: list, src_dict: dict, dst_dict: dict):
     return edges
 
 
+def _construct_state_profiled(grammar: Grammar, states: list, kernels: dict,
+                              src_state: LRState, algo_suit):
+    # Same as the loop body of construct_states, timing every step
+    begin = time.perf_counter()
+    src_closure_items = get_closure(grammar, src_state.kernel, algo_suit)
+    closure_end = time.perf_counter()
+    src_dict, dst_dict = _group_by_next_sym(src_closure_items)
+    goto_end = time.perf_counter()
+    src_state.edges = _construct_edge(states, kernels, src_dict, dst_dict)
+    instrument.add_time('kernel_lookup', time.perf_counter() - goto_end)
+    instrument.add_time('goto', goto_end - closure_end)
+    instrument.add_time('closure', closure_end - begin)
+    instrument.count('kernel_items', len(src_state.kernel))
+    instrument.count('closure_items', len(src_closure_items))
+    instrument.maximum('max_closure', len(src_closure_items))
+    instrument.count('edges', len(src_state.edges))
+
+
+@instrument.timed('lr.construct_states')
 def construct_states(grammar: Grammar, algo_suit):
     states = list()
     initial_kernel = algo_suit.build_item(grammar.get_start_prodctions()[0])
     states.append(LRState(frozenset({initial_kernel})))
+    kernels = {states[0].kernel: 0}  # kernels[kernel] = state index
 
+    profiling = instrument.enabled
     state_idx = 0
     while state_idx < len(states):
         src_state = states[state_idx]
-        src_dict, dst_dict \
-            = _construct_state_transition_dict(grammar, src_state, algo_suit)
-        src_state.edges = _construct_edge(states, src_dict, dst_dict)
+        if profiling:
+            _construct_state_profiled(grammar, states, kernels, src_state, algo_suit)
+        else:
+            src_dict, dst_dict \
+                = _construct_state_transition_dict(grammar, src_state, algo_suit)
+            src_state.edges = _construct_edge(states, kernels, src_dict, dst_dict)
         state_idx += 1
+    if profiling:
+        instrument.count('states', len(states))
     return states
 
 
+def _is_state_dirty(state: LRState, changed_nterms, first_changed) -> bool:
+    for item in state.get_closure():
+        next_sym = item.next_sym
+        if next_sym is None:
+            continue
+        # The closure predicts a nonterminal whose productions changed
+        if next_sym in changed_nterms:
+            return True
+        # Lookaheads of the predicted items depend on a changed FIRST
+        if not first_changed.isdisjoint(item.prod.syms[item.pos + 1:]):
+            return True
+    return False
+
+
+@instrument.timed('lr.update_states')
+def update_states(grammar: Grammar, old_states: list, algo_suit,
+                  changed_nterms, first_changed=frozenset()):
+    # Rebuild the states after the productions of changed_nterms have been
+    # edited. States whose closure does not involve the change keep their
+    # transitions; surviving states keep their relative order and the new
+    # ones are numbered after them.
+    old_index = dict((state.kernel, i) for i, state in enumerate(old_states))
+    initial_item = algo_suit.build_item(grammar.get_start_prodctions()[0])
+    kernels = [frozenset({initial_item})]
+    seen = set(kernels)
+    transitions = dict()  # transitions[kernel][sym] = (src_items, dst_kernel)
+
+    kernel_idx = 0
+    while kernel_idx < len(kernels):
+        kernel = kernels[kernel_idx]
+        kernel_idx += 1
+        old_id = old_index.get(kernel)
+        trans = dict()
+        if old_id is not None and \
+           not _is_state_dirty(old_states[old_id], changed_nterms, first_changed):
+            if instrument.enabled:
+                instrument.count('reused_states')
+            for sym, edge in old_states[old_id].edges.items():
+                dst = old_states[edge.dst_state].kernel if sym != '' else None
+                trans[sym] = (edge.src_items, dst)
+        else:
+            src_dict, dst_dict = _construct_state_transition_dict(
+                grammar, LRState(kernel), algo_suit)
+            for sym in sorted(dst_dict):
+                trans[sym] = (frozenset(src_dict[sym]), frozenset(dst_dict[sym]))
+            if '' in src_dict:
+                trans[''] = (frozenset(src_dict['']), None)
+            if instrument.enabled:
+                instrument.count('rebuilt_states')
+        transitions[kernel] = trans
+        for _, dst in trans.values():
+            if dst is not None and dst not in seen:
+                seen.add(dst)
+                kernels.append(dst)
+
+    order = sorted(filter(lambda x: x in old_index, kernels), key=old_index.get)
+    order.extend(filter(lambda x: x not in old_index, kernels))
+    numbering = dict((kernel, i) for i, kernel in enumerate(order))
+    states = list()
+    for kernel in order:
+        edges = dict()
+        for sym, (src_items, dst) in transitions[kernel].items():
+            edges[sym] = LREdge(src_items, numbering[dst] if dst is not None else -1)
+        states.append(LRState(kernel, edges))
+    return states
+
+
+@instrument.timed('lr.construct_table')
 def construct_table(grammar: Grammar, states: list, algo_suit):
     final_item = LR0Item(grammar.get_start_prodctions()[0], 1)
     table = list()  # table[src_state][sym] = set(LRAction)
@@ -299,103 +450,280 @@ def construct_table(grammar: Grammar, states: list, algo_suit):
             else:
                 # Reduce
                 algo_suit.build_reduce(actions, edge)
+    if instrument.enabled:
+        instrument.count('actions', sum(len(actions) for row in table
+                                        for actions in row.values()))
+        instrument.count('conflicts', sum(1 for row in table
+                                          for actions in row.values() if len(actions) > 1))
     return table
 
 
-def parse(table: list, input_syms: list, callback):
+def get_expected(row: dict) -> tuple:
+    # Terminals with an action in a table row, all other entries are gotos
+    return tuple(sorted(sym for sym, actions in row.items()
+                        if actions and tuple(actions)[0].action != LRAction.GOTO))
+
+
+def _simulate(table: list, states: list, input_syms: list) -> bool:
+    # Whether input_syms parse from the configuration of states. The stack
+    # is left alone: popping it only lowers depth, pushes go to pushed.
+    depth = len(states)
+    pushed = list()
+    for sym in input_syms:
+        while True:
+            actions = table[pushed[-1] if pushed else states[depth - 1]].get(sym)
+            if not actions:
+                return False
+            action = tuple(actions)[0]
+            if action.action == LRAction.SHIFT:
+                pushed.append(action.info)
+                break
+            elif action.action == LRAction.REDUCE:
+                length = 0 if action.info.syms == ('@',) else len(action.info.syms)
+                popped = min(length, len(pushed))
+                del pushed[len(pushed) - popped:]
+                depth -= length - popped
+                state = pushed[-1] if pushed else states[depth - 1]
+                pushed.append(tuple(table[state][action.info.nterm])[0].info)
+            elif action.action == LRAction.ACCEPT:
+                return True
+    return True
+
+
+def _get_gotos(table: list, gotos: dict, state: int) -> list:
+    # [(nterm, target state)] of the gotos of state, cached in gotos
+    result = gotos.get(state)
+    if result is None:
+        result = list()
+        for nterm, actions in table[state].items():
+            if actions and tuple(actions)[0].action == LRAction.GOTO:
+                result.append((nterm, tuple(actions)[0].info))
+        gotos[state] = result
+    return result
+
+
+def _recover_panic(table: list, gotos: dict, states: list, syms: list,
+                   input_syms: list, start: int, pos: int, error: ParseError):
+    # Pops states until one with a goto on some A whose target takes the
+    # lookahead, skipping input until there is one. The terminals of the
+    # target row are those following A in that context, a subset of FOLLOW(A).
+    # Returns the new position or None if the input ran out.
+    while True:
+        sym = input_syms[pos] if pos < len(input_syms) else '$'
+        for depth in range(len(states), 0, -1):
+            for nterm, target in _get_gotos(table, gotos, states[depth - 1]):
+                if table[target].get(sym):
+                    error.recovery = 'skip {} symbol(s), pop {} state(s), goto {}'.format(
+                        pos - start, len(states) - depth, nterm)
+                    del states[depth:]
+                    del syms[depth:]
+                    states.append(target)
+                    syms.append(nterm)
+                    return pos
+        if pos >= len(input_syms):
+            error.recovery = 'stop'
+            return None
+        pos += 1
+
+
+def _recover(table: list, gotos: dict, states: list, syms: list, input_syms: list,
+             pos: int, recovery: Recovery, error: ParseError, repeated: bool):
+    # Returns (new position, inserted symbol or None), or None to stop.
+    # repeated: the last recovery was at pos as well and got no further, so
+    # the symbol there is skipped or, at the end of the input, parsing stops.
+    if repeated:
+        if pos >= len(input_syms):
+            error.recovery = 'stop'
+            return None
+        pos = _recover_panic(table, gotos, states, syms, input_syms, pos, pos + 1, error)
+        return None if pos is None else (pos, None)
+    if recovery.mode == 'repair':
+        repair = parse_error.find_repair(
+            lambda x: _simulate(table, states, x), error.expected,
+            input_syms, pos, recovery)
+        if repair:
+            deleted, inserted = repair
+            error.recovery = parse_error.str_repair(input_syms, pos, deleted, inserted)
+            return pos + deleted, inserted
+    pos = _recover_panic(table, gotos, states, syms, input_syms, pos, pos, error)
+    return None if pos is None else (pos, None)
+
+
+@instrument.timed('lr.parse')
+def parse(table: list, input_syms: list, callback=None, stats=None, recovery=None):
+    # stats: a parse_stats.ParseStats counting state visits, reductions and
+    # the stack depth, cheaper to leave on than a callback
+    # Raises ParseError on the first syntax error unless recovery (a
+    # parse_error.Recovery) is given; returns the list of errors recovered from.
     states = [0]
     syms = ['$']
     pos = 0
+    n = len(input_syms)
+    sym = input_syms[0] if n else '$'
+    inserted = False  # sym was inserted by a repair and is not in the input
+    last_error = None
+    gotos = dict()
+    errors = parse_error.ErrorList(recovery)
 
     while True:
-        if pos < len(input_syms):
-            sym = input_syms[pos]
-        else:
-            sym = '$'
         state = states[-1]
-        action = tuple(table[state][sym])[0]
+        if stats is not None:
+            stats.visits[state] += 1
+        actions = table[state].get(sym)
+        if not actions:
+            error = ParseError(sym, pos, get_expected(table[state]))
+            if recovery is None:
+                raise error
+            recovered = _recover(table, gotos, states, syms, input_syms, pos,
+                                 recovery, error, pos == last_error)
+            errors.add(error)
+            last_error = pos
+            if recovered is None:
+                return errors
+            pos, sym = recovered
+            errors.resume(pos)
+            inserted = sym is not None
+            if not inserted:
+                sym = input_syms[pos] if pos < n else '$'
+            continue
+        action = tuple(actions)[0]
         if action.action == LRAction.SHIFT:
-            callback(action, states, syms, pos)
+            if callback:
+                callback(action, states, syms, pos)
             states.append(action.info)
             syms.append(sym)
-            pos += 1
-            if pos > len(input_syms):
-                pos = len(input_syms)
+            if inserted:
+                inserted = False
+            else:
+                pos += 1
+            sym = input_syms[pos] if pos < n else '$'
+            if stats is not None and len(states) > stats.max_depth:
+                stats.max_depth = len(states)
         elif action.action == LRAction.REDUCE:
-            callback(action, states, syms, pos)
-            length = len(action.info.syms)
-            syms = syms[:-length] + list(action.info.nterm)
-            states = states[:-length]
+            if callback:
+                callback(action, states, syms, pos)
+            length = 0 if action.info.syms == ('@',) else len(action.info.syms)
+            del syms[len(syms) - length:]
+            syms.append(action.info.nterm)
+            del states[len(states) - length:]
             goto_action = tuple(table[states[-1]][action.info.nterm])[0]
             assert goto_action.action == LRAction.GOTO
             states.append(goto_action.info)
+            if stats is not None:
+                stats.productions[action.info] += 1
+                if len(states) > stats.max_depth:
+                    stats.max_depth = len(states)
         elif action.action == LRAction.ACCEPT:
-            callback(action, states, syms, pos)
-            return
+            if callback:
+                callback(action, states, syms, pos)
+            if stats is not None:
+                stats.tokens += n
+            return errors
         else:
             assert False
 
 
-def dump_dfa(states: list, export_file):
-    export_file.write('digraph {\n  rankdir = "LR";')
-
+def iter_dfa(states: list, node_attrs=None):
+    # node_attrs: {state: {attribute: value}} added to the nodes
+    yield 'digraph {\n  rankdir = "LR";'
     for i, state in enumerate(states):
-        export_file.write('  "node{}" [\n'.format(i))
-        export_file.write('    shape = "record"\n')
-        export_file.write(r'    label = "I{}\n|'.format(i))
-        export_file.write(r'\l'.join([str(t) for t in state.kernel]))
-        nonkernel = state.get_closure() - state.kernel
-        export_file.write(r'\l')
+        yield '  "node{}" [\n'.format(i)
+        yield '    shape = "record"\n'
+        if node_attrs and i in node_attrs:
+            for key, value in node_attrs[i].items():
+                yield '    {} = "{}"\n'.format(key, value)
+        yield r'    label = "I{}\n|'.format(i)
+        yield r'\l'.join([str(t) for t in state.kernel])
+        nonkernel = list(state.iter_nonkernel())
+        yield r'\l'
         if nonkernel:
-            export_file.write('|')
-            export_file.write(r'\l'.join([str(t) for t in nonkernel]))
-            export_file.write(r'\l')
-        export_file.write('"\n  ];\n')
-    export_file.write('\n\n')
+            yield '|'
+            yield r'\l'.join([str(t) for t in nonkernel])
+            yield r'\l'
+        yield '"\n  ];\n'
+    yield '\n\n'
     for src_state, state in enumerate(states):
         for sym, edge in state.edges.items():
             if sym == '':
                 continue
-            line = '  "node{}" -> "node{}" [label="{}"]\n'.format(
+            yield '  "node{}" -> "node{}" [label="{}"]\n'.format(
                 src_state, edge.dst_state, sym)
-            export_file.write(line)
+    yield '}'
 
-    export_file.write('}')
 
+def dump_dfa(states: list, export_file, node_attrs=None):
+    for chunk in iter_dfa(states, node_attrs):
+        export_file.write(chunk)
 
-def str_states(states: list) -> str:
-    result = '  States:'
+
+# Column names of the rows yielded by the iter_*_rows() functions
+STATES_COLUMNS = ('state', 'kind', 'item')
+TRANSITIONS_COLUMNS = ('src', 'sym', 'dst')
+TABLE_COLUMNS = ('state', 'sym', 'action')
+
+
+def iter_states(states: list):
+    yield '  States:'
     for i, state in enumerate(states):
-        result += '\n    {}:'.format(i)
+        yield '    {}:'.format(i)
         for item in state.kernel:
-            result += '\n      {}'.format(item)
-        nonkernel = state.get_closure() - state.kernel
+            yield '      {}'.format(item)
+        nonkernel = list(state.iter_nonkernel())
         if nonkernel:
-            result += '\n      (Nonkernel)'
+            yield '      (Nonkernel)'
             for item in nonkernel:
-                result += '\n      {}'.format(item)
-    return result
+                yield '      {}'.format(item)
 
 
-def str_transitions(states: list) -> str:
-    result = '  Transitions:'
+def iter_states_rows(states: list):
+    for i, state in enumerate(states):
+        for item in state.kernel:
+            yield i, 'kernel', str(item)
+        for item in state.iter_nonkernel():
+            yield i, 'nonkernel', str(item)
+
+
+def str_states(states: list) -> str:
+    return '\n'.join(iter_states(states))
+
+
+def iter_transitions_rows(states: list):
     for src_state, state in enumerate(states):
         for sym, edge in state.edges.items():
             if sym == '':
                 continue
-            result += '\n    {} {} {}'.format(src_state, sym, edge.dst_state)
-    return result
+            yield src_state, sym, edge.dst_state
 
 
-def str_table(table: list):
-    result = '  Table:'
+def iter_transitions(states: list):
+    yield '  Transitions:'
+    for row in iter_transitions_rows(states):
+        yield '    {} {} {}'.format(*row)
+
+
+def str_transitions(states: list) -> str:
+    return '\n'.join(iter_transitions(states))
+
+
+def iter_table_rows(table: list):
+    for src_state, row in enumerate(table):
+        for sym, actions in row.items():
+            for action in actions:
+                yield src_state, sym, str(action)
+
+
+def iter_table(table: list):
+    yield '  Table:'
     for src_state, row in enumerate(table):
         for sym, actions in row.items():
             header = '{} - {}'.format(src_state, sym)
             for action in actions:
-                result += '\n    ' + header + ': ' + str(action)
+                yield '    ' + header + ': ' + str(action)
                 header = '!' * len(header)
-    return result
+
+
+def str_table(table: list):
+    return '\n'.join(iter_table(table))
 
 
 def str_lr(grammar: Grammar, algo_suit_class):
@@ -404,11 +732,8 @@ def str_lr(grammar: Grammar, algo_suit_class):
     states = construct_states(grammar, algo_suit)
     table = construct_table(grammar, states, algo_suit)
 
-    result = algo_suit_class.NAME + ':'
-    result += '\n' + str_states(states)
-    result += '\n' + str_transitions(states)
-    result += '\n' + str_table(table)
-    return result
+    return '\n'.join([algo_suit_class.NAME + ':', str_states(states),
+                      str_transitions(states), str_table(table)])
 
 
 def dump_lr(grammar: Grammar, algo_suit_class, export_file):
@@ -418,64 +743,47 @@ def dump_lr(grammar: Grammar, algo_suit_class, export_file):
     dump_dfa(states, export_file)
 
 
-def _str_parse_cptt(table: list, input_syms: list):
-    stack_str = list()
-    symbol_str = list()
-    input_str = list()
-    action_str = list()
-    def callback(action, states, syms, pos):
-        stack_str.append(' '.join([str(i) for i in states]))
-        symbol_str.append(' '.join(syms))
-        input_str.append(' '.join(input_syms[pos:]))
-        action_str.append(str(action))
-    parse(table, input_syms, callback)
-
-    get_length = lambda arr: max([len(t) for t in arr])
-    stack_length = get_length(stack_str)
-    symbol_length = get_length(symbol_str)
-    input_length = get_length(input_str)
-
-    result = ''
-    for i, input_val in enumerate(input_str):
-        result += '  {} | {} | {} $ | {}\n'.format(
-            stack_str[i].ljust(stack_length),
-            symbol_str[i].ljust(symbol_length),
-            input_val.rjust(input_length),
-            action_str[i])
-    return result
-
-
-def _str_parse_old(table: list, input_syms: list):
-    overview_str = list()
-    input_str = list()
-    action_str = list()
-    def callback(action, states, syms, pos):
-        overview = str(states[0])
-        for i, sym in enumerate(syms[1:]):
-            overview += ' ' + str(sym) + ' ' + str(states[i + 1])
-        input_str.append(' '.join(input_syms[pos:]))
-        overview_str.append(overview)
-        action_str.append(action)
-    parse(table, input_syms, callback)
-
-    get_length = lambda arr: max([len(t) for t in arr])
-    overview_length = get_length(overview_str)
-    input_length = get_length(input_str)
-
-    result = ''
-    for i, input_val in enumerate(input_str):
-        result += '  {} | {} | {}\n'.format(
-            overview_str[i].ljust(overview_length),
-            input_val.rjust(input_length),
-            action_str[i])
-    return result
+def _iter_parse_rows(trace, replay, input_syms: list, begin: int, end: int,
+                     use_old_style: bool):
+    import parse_trace
+    for step, states, syms in replay.iter_stacks(begin, end):
+        rest = ' '.join(input_syms[trace.positions[step]:])
+        action = parse_trace._str_action(trace, step)
+        if use_old_style:
+            overview = [str(states[0])]
+            for i in range(1, len(states)):
+                overview.append(syms[i])
+                overview.append(str(states[i]))
+            yield ' '.join(overview), rest, action
+        else:
+            yield ' '.join([str(i) for i in states]), ' '.join(syms), rest, action
+
+
+def iter_parse(table: list, input_syms: list, use_old_style=True, page_size=50):
+    # The steps of the parse, every page of page_size steps with its own
+    # column widths: the parse is recorded by parse_trace and only a page
+    # is formatted at a time. A syntax error ends them with its message.
+    import parse_trace
+    trace = parse_trace.record_lr(table, input_syms)
+    replay = parse_trace.TraceReplay(trace)
+    for begin in range(0, len(trace), page_size):
+        rows = list(_iter_parse_rows(trace, replay, input_syms, begin, begin + page_size,
+                                     use_old_style))
+        widths = [max([len(row[i]) for row in rows]) for i in range(len(rows[0]) - 1)]
+        for row in rows:
+            if use_old_style:
+                yield '  {} | {} | {}'.format(
+                    row[0].ljust(widths[0]), row[1].rjust(widths[1]), row[2])
+            else:
+                yield '  {} | {} | {} $ | {}'.format(
+                    row[0].ljust(widths[0]), row[1].ljust(widths[1]),
+                    row[2].rjust(widths[2]), row[3])
+    if trace.error:
+        yield '  ' + trace.error
 
 
 def str_parse(table: list, input_syms: list, use_old_style=True):
-    if use_old_style:
-        return _str_parse_old(table, input_syms)
-    else:
-        return _str_parse_cptt(table, input_syms)
+    return '\n'.join(iter_parse(table, input_syms, use_old_style))
 
 
 def demo_parse(grammar: Grammar, algo_suit_class, input_syms: list,
@@ -490,6 +798,7 @@ def demo_parse(grammar: Grammar, algo_suit_class, input_syms: list,
 
 
 def main():
+    import bnf_parser
     bnf = '''
     E := E + T | T
     T := T * F | F
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+from collections import defaultdict
+from grammar import Grammar
+from lr import LRAction, LREdge, LRState
+import instrument
+import lr
+import packed_table
+
+# Two states of an LR table are equivalent when they have the same actions
+# and their shifts and gotos lead to equivalent states: the driver then
+# does the same whichever is on the stack. The states are partitioned
+# Hopcroft-style: first by their actions without the targets, then the
+# blocks are split by the predecessors of every block for every symbol
+# until none splits.
+
+
+def _is_transition(action: LRAction) -> bool:
+    return action.action == LRAction.SHIFT or action.action == LRAction.GOTO
+
+
+def _get_signature(row: dict) -> frozenset:
+    # The actions of a row, but the targets of the shifts and gotos
+    return frozenset((sym, action.action, None if _is_transition(action) else action.info)
+                     for sym, actions in row.items() for action in actions)
+
+
+def construct_partition(table: list) -> list:
+    # block_of[state] = the block of the state
+    blocks = list()
+    block_of = list()
+    signatures = dict()
+    # sources[sym][dst] = the states with a shift or goto to dst on sym
+    sources = defaultdict(lambda: defaultdict(list))
+    entering = defaultdict(set)  # entering[dst] = the symbols of those
+    for state, row in enumerate(table):
+        block = signatures.setdefault(_get_signature(row), len(blocks))
+        if block == len(blocks):
+            blocks.append(set())
+        blocks[block].add(state)
+        block_of.append(block)
+        for sym, actions in row.items():
+            for action in actions:
+                if _is_transition(action):
+                    sources[sym][action.info].append(state)
+                    entering[action.info].add(sym)
+
+    # The splitters: a block with no transition to it on sym splits nothing
+    pending = list(set((block_of[dst], sym) for dst, syms in entering.items()
+                       for sym in syms))
+    while pending:
+        block, sym = pending.pop()
+        sym_sources = sources[sym]
+        # The states going to the block on sym, by their own blocks
+        splits = defaultdict(set)
+        for dst in blocks[block]:
+            for src in sym_sources.get(dst, ()):
+                splits[block_of[src]].add(src)
+        for split_block, inside in splits.items():
+            if len(inside) == len(blocks[split_block]):
+                continue
+            # The smaller part is the new block; both parts of a pending
+            # splitter are then pending, and for the others the smaller is
+            # enough
+            if len(inside) * 2 > len(blocks[split_block]):
+                inside = blocks[split_block] - inside
+            new_block = len(blocks)
+            blocks[split_block] -= inside
+            blocks.append(inside)
+            for state in inside:
+                block_of[state] = new_block
+            pending.extend((new_block, other) for other in
+                           set().union(*(entering[state] for state in inside)))
+    return block_of
+
+
+@instrument.timed('lr_minimize.minimize_table')
+def minimize_table(table: list) -> tuple:
+    # Returns (table, mapping): the table of the equivalent states merged,
+    # with mapping[old state] = new state. The states keep their order, the
+    # first of a block giving its row, so state 0 stays the initial one.
+    block_of = construct_partition(table)
+    new_ids = dict()
+    mapping = [new_ids.setdefault(block, len(new_ids)) for block in block_of]
+    result = list()
+    for state, row in enumerate(table):
+        if mapping[state] < len(result):
+            continue
+        actions = defaultdict(set)
+        for sym, action_set in row.items():
+            for action in action_set:
+                if _is_transition(action):
+                    action = LRAction(action.action, mapping[action.info])
+                actions[sym].add(action)
+        result.append(actions)
+    if instrument.enabled:
+        instrument.count('states', len(table))
+        instrument.count('merged', len(table) - len(result))
+    return result, mapping
+
+
+def merge_states(states: list, mapping: list) -> list:
+    # The states of the automaton of the minimized table, for str_states or
+    # dump_dfa: the items of the merged states together
+    kernels = [set() for _ in range(max(mapping) + 1)] if mapping else []
+    edges = [dict() for _ in kernels]
+    for state, new_state in zip(states, mapping):
+        kernels[new_state].update(state.kernel)
+        for sym, edge in state.edges.items():
+            dst = mapping[edge.dst_state] if edge.dst_state >= 0 else -1
+            if sym in edges[new_state]:
+                edges[new_state][sym][0].update(edge.src_items)
+            else:
+                edges[new_state][sym] = (set(edge.src_items), dst)
+    return [LRState(frozenset(kernel), dict(
+        (sym, LREdge(frozenset(src_items), dst)) for sym, (src_items, dst) in state_edges.items()))
+        for kernel, state_edges in zip(kernels, edges)]
+
+
+# Column names of the rows yielded by iter_sizes_rows()
+SIZES_COLUMNS = ('measure', 'before', 'after')
+
+
+def _get_packed_bytes(grammar: Grammar, table: list) -> int:
+    width = len(packed_table.construct_terms(grammar)) + len(grammar.prods)
+    return len(table) * width * 4
+
+
+def iter_sizes_rows(grammar: Grammar, table: list, minimized: list):
+    # grammar: the argumented grammar of the tables
+    yield 'states', len(table), len(minimized)
+    yield 'actions', sum(len(actions) for row in table for actions in row.values()), \
+        sum(len(actions) for row in minimized for actions in row.values())
+    yield 'packed bytes', _get_packed_bytes(grammar, table), \
+        _get_packed_bytes(grammar, minimized)
+
+
+def iter_sizes(grammar: Grammar, table: list, minimized: list):
+    yield '  Minimization:'
+    for name, before, after in iter_sizes_rows(grammar, table, minimized):
+        yield '    {:12}: {} -> {}'.format(name.capitalize(), before, after)
+
+
+def str_sizes(grammar: Grammar, table: list, minimized: list) -> str:
+    return '\n'.join(iter_sizes(grammar, table, minimized))
+
+
+def main():
+    # Some LR(1) item sets are built twice, with their lookaheads grouped
+    # differently, e.g. [Value → Array ·, ]/,] and [Value → Array ·, ,],
+    # [Value → Array ·, ]]
+    import bnf_parser
+    bnf = '''
+    Value   := Object | Array | str | num
+    Object  := { ObjRest
+    ObjRest := } | Pair Pairs }
+    Pairs   := Pairs , Pair | @
+    Pair    := str : Value
+    Array   := [ ArrRest
+    ArrRest := ] | Value Values ]
+    Values  := Values , Value | @
+    '''
+    grammar = lr.construct_argumented_grammar(bnf_parser.parse(bnf))
+    algo_suit = lr.LR1AlgorithmSuit(grammar)
+    states = lr.construct_states(grammar, algo_suit)
+    table = lr.construct_table(grammar, states, algo_suit)
+    minimized, mapping = minimize_table(table)
+    print(str_sizes(grammar, table, minimized))
+    print('  Mapping: ' + ' '.join('{}->{}'.format(old, new)
+                                   for old, new in enumerate(mapping) if old != new))
+    merged = merge_states(states, mapping)
+    print('  State {}: {}'.format(mapping[-1], ' '.join(map(str, merged[mapping[-1]].kernel))))
+
+
+if __name__ == '__main__':
+    main()
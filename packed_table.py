@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+import sys
+import json
+import struct
+from array import array
+from grammar import Grammar
+from lr import LRAction
+from parse_error import ParseError
+
+# Packed LR actions: the low two bits hold the kind, the rest the argument
+ERROR = 0
+ACCEPT = 4
+SHIFT = 1
+REDUCE = 2
+GOTO = 3
+
+
+def _to_le_bytes(arr: array) -> bytes:
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_le_bytes(typecode: str, buf) -> array:
+    result = array(typecode)
+    result.frombytes(buf)
+    if sys.byteorder != 'little':
+        result.byteswap()
+    return result
+
+
+def _index_productions(grammar: Grammar) -> list:
+    prods = list()
+    for prodlist in grammar.prods.values():
+        prods.extend(prodlist)
+    return prods
+
+
+# The files of packed tables, token streams, parse traces and table stores
+# start alike: magic, the header length as a little endian uint32, then the
+# JSON header, padded with spaces to a multiple of align bytes so that the
+# arrays after it can be cast in place from a mapped file.
+def _pack_header(magic: bytes, header: dict, arr: array=None, align=1) -> bytes:
+    # The header, followed by arr little endian if given
+    header = json.dumps(header, separators=(',', ':')).encode()
+    header += b' ' * (-(len(header) + 8) % align)
+    result = magic + struct.pack('<I', len(header)) + header
+    return result if arr is None else result + _to_le_bytes(arr)
+
+
+def _unpack_header(magic: bytes, buf, name='packed table') -> tuple:
+    # (header, the rest of buf); raises ValueError unless buf starts with
+    # magic
+    if bytes(buf[:4]) != magic:
+        raise ValueError('Not a ' + name)
+    header_len = struct.unpack_from('<I', buf, 4)[0]
+    header = json.loads(bytes(buf[8:8 + header_len]).decode())
+    return header, buf[8 + header_len:]
+
+
+class PackedLRTable:
+    # actions[state * width + sym_id], terminals (including '$') come first
+    MAGIC = b'LRT1'
+
+    def __init__(self, terms, nterms, prods, actions: array):
+        self.terms = tuple(terms)
+        self.nterms = tuple(nterms)
+        self.prods = tuple((nterm, tuple(syms)) for nterm, syms in prods)
+        self.actions = actions
+        self.width = len(self.terms) + len(self.nterms)
+        self.n_states = len(actions) // self.width if self.width else 0
+        self.sym_ids = dict((sym, i) for i, sym in
+                            enumerate(self.terms + self.nterms))
+        self.prod_lhs = tuple(self.sym_ids[nterm] for nterm, _ in self.prods)
+        self.prod_len = tuple(0 if syms == ('@',) else len(syms)
+                              for _, syms in self.prods)
+
+    def get_action(self, state: int, sym_id: int) -> int:
+        return self.actions[state * self.width + sym_id]
+
+    def to_bytes(self) -> bytes:
+        header = dict(terms=self.terms, nterms=self.nterms, prods=self.prods)
+        return _pack_header(self.MAGIC, header, self.actions)
+
+    @staticmethod
+    def from_bytes(buf: bytes):
+        header, data = _unpack_header(PackedLRTable.MAGIC, buf)
+        return PackedLRTable(header['terms'], header['nterms'], header['prods'],
+                             _from_le_bytes('I', data))
+
+
+def construct_terms(grammar: Grammar) -> list:
+    # Terminal ids of the packed tables, '$' comes last
+    return sorted(grammar.terms) + ['$']
+
+
+def pack_lr_table(grammar: Grammar, table: list) -> PackedLRTable:
+    # grammar: the argumented grammar the table was built from. Conflicts
+    # are resolved the same way as lr.parse does, by taking the first action.
+    terms = construct_terms(grammar)
+    nterms = list(grammar.prods)
+    prods = _index_productions(grammar)
+    prod_ids = dict((prod, i) for i, prod in enumerate(prods))
+    sym_ids = dict((sym, i) for i, sym in enumerate(terms + nterms))
+    width = len(sym_ids)
+
+    actions = array('I', bytes(4 * width * len(table)))
+    for state, row in enumerate(table):
+        for sym, action_set in row.items():
+            if not action_set:
+                continue
+            action = tuple(action_set)[0]
+            if action.action == LRAction.SHIFT:
+                packed = action.info << 2 | SHIFT
+            elif action.action == LRAction.REDUCE:
+                packed = prod_ids[action.info] << 2 | REDUCE
+            elif action.action == LRAction.GOTO:
+                packed = action.info << 2 | GOTO
+            else:
+                packed = ACCEPT
+            actions[state * width + sym_ids[sym]] = packed
+    return PackedLRTable(terms, nterms, [(p.nterm, p.syms) for p in prods], actions)
+
+
+class PackedLL1Table:
+    # table[nterm_id * n_terms + term_id] = production id + 1, or 0 on error
+    MAGIC = b'LL11'
+
+    def __init__(self, start, terms, nterms, prods, table: array):
+        self.start = start
+        self.terms = tuple(terms)
+        self.nterms = tuple(nterms)
+        self.prods = tuple((nterm, tuple(syms)) for nterm, syms in prods)
+        self.table = table
+        self.sym_ids = dict((sym, i) for i, sym in
+                            enumerate(self.terms + self.nterms))
+
+    def get_production(self, nterm_id: int, term_id: int) -> int:
+        return self.table[nterm_id * len(self.terms) + term_id] - 1
+
+    def to_bytes(self) -> bytes:
+        header = dict(start=self.start, terms=self.terms, nterms=self.nterms,
+                      prods=self.prods)
+        return _pack_header(self.MAGIC, header, self.table)
+
+    @staticmethod
+    def from_bytes(buf: bytes):
+        header, data = _unpack_header(PackedLL1Table.MAGIC, buf)
+        return PackedLL1Table(header['start'], header['terms'], header['nterms'],
+                              header['prods'], _from_le_bytes('I', data))
+
+
+def pack_ll1_table(grammar: Grammar, table: dict) -> PackedLL1Table:
+    # Conflicts are resolved like ll1.parse does, by taking the first entry
+    terms = construct_terms(grammar)
+    nterms = list(grammar.prods)
+    prods = _index_productions(grammar)
+    prod_ids = dict((prod, i) for i, prod in enumerate(prods))
+    term_ids = dict((term, i) for i, term in enumerate(terms))
+
+    packed = array('I', bytes(4 * len(terms) * len(nterms)))
+    for nterm_id, nterm in enumerate(nterms):
+        for term, prod in reversed(table[nterm]):
+            packed[nterm_id * len(terms) + term_ids[term]] = prod_ids[prod] + 1
+    return PackedLL1Table(grammar.start, terms, nterms,
+                          [(p.nterm, p.syms) for p in prods], packed)
+
+
+def _raise_error(terms: tuple, sym: int, pos: int, expected):
+    raise ParseError(terms[sym], pos, sorted(terms[i] for i in expected))
+
+
+def parse_lr(packed: PackedLRTable, ids) -> list:
+    # ids: a sequence of terminal ids of packed.terms without the final '$',
+    # like the memoryview of token_stream.TokenStream.get_ids. Returns the
+    # ids of the reduced productions, in reduction order.
+    actions = packed.actions
+    width = packed.width
+    prod_lhs = packed.prod_lhs
+    prod_len = packed.prod_len
+    eof = len(packed.terms) - 1
+    n = len(ids)
+    stack = [0]
+    output = []
+    pos = 0
+    sym = ids[0] if n else eof
+    while True:
+        action = actions[stack[-1] * width + sym]
+        kind = action & 3
+        if kind == SHIFT:
+            stack.append(action >> 2)
+            pos += 1
+            sym = ids[pos] if pos < n else eof
+        elif kind == REDUCE:
+            prod = action >> 2
+            length = prod_len[prod]
+            if length:
+                del stack[-length:]
+            stack.append(actions[stack[-1] * width + prod_lhs[prod]] >> 2)
+            output.append(prod)
+        elif action == ACCEPT:
+            return output
+        else:
+            row = stack[-1] * width
+            _raise_error(packed.terms, sym, pos,
+                         [i for i in range(len(packed.terms)) if actions[row + i]])
+
+
+def parse_ll1(packed: PackedLL1Table, ids) -> list:
+    # Like parse_lr, returns the ids of the expanded productions in leftmost
+    # order
+    n_terms = len(packed.terms)
+    table = packed.table
+    # prod_rhs[prod_id] = symbol ids of the right hand side, reversed
+    prod_rhs = tuple(tuple(packed.sym_ids[sym] for sym in reversed(syms) if sym != '@')
+                     for _, syms in packed.prods)
+    eof = n_terms - 1
+    n = len(ids)
+    stack = [packed.sym_ids[packed.start]]
+    output = []
+    pos = 0
+    sym = ids[0] if n else eof
+    while stack:
+        top = stack.pop()
+        if top < n_terms:
+            if top != sym:
+                _raise_error(packed.terms, sym, pos, (top,))
+            pos += 1
+            sym = ids[pos] if pos < n else eof
+        else:
+            row = (top - n_terms) * n_terms
+            prod = table[row + sym] - 1
+            if prod < 0:
+                _raise_error(packed.terms, sym, pos,
+                             [i for i in range(n_terms) if table[row + i]])
+            stack.extend(prod_rhs[prod])
+            output.append(prod)
+    if pos < n:
+        _raise_error(packed.terms, sym, pos, (eof,))
+    return output
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+import struct
+from array import array
+from grammar import Grammar
+from parse_error import ParseError
+import instrument
+import left_recursion_eliminator
+import ll1
+
+# A PEG reading of the grammars: the alternatives of a nonterminal are an
+# ordered choice, the first one that matches wins and the others are never
+# tried, so every nonterminal matches at most one way at every position. The
+# packrat parser remembers the result of every nonterminal tried at every
+# position, which makes the parse linear in the input: a result is the end
+# of the match and its node, [production, the nodes of its nonterminals],
+# which the nonterminals finding it in the memo take as it is. The
+# productions are only listed from the nodes of the whole match. The memo
+# is a table of rows, one per position and a column per nonterminal; with a
+# memory limit, the rows are reused for the positions the row count apart,
+# a sliding window over the input in which the parse stays linear as long
+# as it does not go back further than the window.
+
+_UNKNOWN = 0
+_FAILED = 1  # the memo holds the end of a match plus 2 otherwise
+_POINTER_SIZE = struct.calcsize('P')
+
+
+class PackratStats:
+    def __init__(self):
+        self.parses = 0
+        self.lookups = 0  # nonterminals tried where the memo was looked at
+        self.hits = 0  # results found in the memo
+        self.evictions = 0  # results dropped for the row of a new position
+        self.peak_entries = 0  # results in the memo at once
+        self.peak_memo_bytes = 0  # size of the memo arrays
+        self.peak_depth = 0  # nonterminals being matched at once
+
+    def get_hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+class _Memo:
+    __slots__ = ('rows', 'width', 'ends', 'nodes', 'owners', 'counts', 'entries',
+                 'stats', 'farthest', 'expected')
+
+    def __init__(self, rows: int, width: int, stats: PackratStats):
+        self.rows = rows
+        self.width = width
+        # ends[row * width + nterm_id]: _UNKNOWN, _FAILED or the end plus 2
+        self.ends = array('I', bytes(4 * rows * width))
+        self.nodes = [None] * (rows * width)  # the nodes of the matches
+        self.owners = array('I', bytes(4 * rows))  # the position of a row plus 1
+        self.counts = array('I', bytes(4 * rows))  # the results in a row
+        self.entries = 0
+        self.stats = stats
+        self.farthest = 0  # the farthest position a terminal was expected at
+        self.expected = set()
+
+    def store(self, nterm: int, start: int, end: int, node):
+        width = self.width
+        row = start % self.rows
+        if self.owners[row] != start + 1:
+            if self.owners[row]:
+                self.stats.evictions += self.counts[row]
+                self.entries -= self.counts[row]
+                self.ends[row * width:(row + 1) * width] = array('I', bytes(4 * width))
+                self.nodes[row * width:(row + 1) * width] = [None] * width
+                self.counts[row] = 0
+            self.owners[row] = start + 1
+        index = row * width + nterm
+        if self.ends[index] == _UNKNOWN:
+            self.counts[row] += 1
+            self.entries += 1
+            if self.entries > self.stats.peak_entries:
+                self.stats.peak_entries = self.entries
+        self.ends[index] = end + 2 if end >= 0 else _FAILED
+        self.nodes[index] = node
+
+    def expect(self, pos: int, terms):
+        if pos >= self.farthest:
+            if pos > self.farthest:
+                self.farthest = pos
+                self.expected = set()
+            self.expected.update(terms)
+
+
+class PackratParser:
+    # memory_limit: bytes of the memo, unbounded by default. Raises
+    # ValueError on left recursive grammars, see left_recursion_eliminator.
+    def __init__(self, grammar: Grammar, memory_limit=None):
+        first = ll1.construct_first(grammar)
+        nterm = left_recursion_eliminator.find_left_recursion(grammar, first)
+        if nterm is not None:
+            raise ValueError('Left recursive nonterminal {} cannot be parsed '
+                             'as a PEG'.format(nterm))
+        self.grammar = grammar
+        self.memory_limit = memory_limit
+        self.nterms = tuple(grammar.prods)
+        nterm_ids = dict((nterm, i) for i, nterm in enumerate(self.nterms))
+        self.start = nterm_ids[grammar.start]
+        self.prods = tuple(grammar.prods[nterm] for nterm in self.nterms)
+        # alts[nterm_id] = the symbols of every production, in order, with the
+        # nonterminals as their ids and the terminals as strings
+        self.alts = tuple(
+            tuple(tuple(nterm_ids.get(sym, sym) for sym in prod.syms if sym != '@')
+                  for prod in prods)
+            for prods in self.prods)
+        # The alternatives that may match, in order: choices[nterm_id][term]
+        # for the ones starting with term or nullable, nullable[nterm_id] for
+        # the nullable ones. Skipping the others keeps the ordered choice.
+        self.choices = list()
+        self.nullable = list()
+        for prods in self.prods:
+            firsts = [ll1.get_first_from_syms(first, prod.syms) for prod in prods]
+            choices = dict()
+            for term in set().union(*firsts) - {'@'}:
+                choices[term] = tuple(alt for alt, alt_first in enumerate(firsts)
+                                      if term in alt_first or '@' in alt_first)
+            self.choices.append(choices)
+            self.nullable.append(tuple(alt for alt, alt_first in enumerate(firsts)
+                                       if '@' in alt_first))
+        self.stats = PackratStats()
+
+    def get_row_bytes(self) -> int:
+        # A row: the results of every nonterminal (end and node reference),
+        # the position owning it and the count of its results; the nodes
+        # themselves are the size of the output
+        return len(self.nterms) * (4 + _POINTER_SIZE) + 8
+
+    def _new_memo(self, n: int) -> _Memo:
+        rows = n + 1
+        if self.memory_limit is not None:
+            rows = max(1, min(rows, self.memory_limit // self.get_row_bytes()))
+        stats = self.stats
+        stats.peak_memo_bytes = max(stats.peak_memo_bytes, rows * self.get_row_bytes())
+        return _Memo(rows, len(self.nterms), stats)
+
+    def _match(self, memo: _Memo, nterm: int, pos: int, syms, n: int) -> tuple:
+        # (end, node) of the match of nterm at pos, or (-1, None); the
+        # results of the nonterminals tried are left in the memo
+        alts = self.alts
+        prods = self.prods
+        choices = self.choices
+        nullable = self.nullable
+        rows = memo.rows
+        width = memo.width
+        ends = memo.ends
+        nodes = memo.nodes
+        owners = memo.owners
+        stats = self.stats
+        lookups = 0
+        hits = 0
+        # The nonterminals being matched below the current one, as
+        # (nterm, start, choice, k, body, index, node)
+        stack = list()
+        start = pos
+        choice = choices[nterm].get(syms[pos] if pos < n else None, nullable[nterm])
+        k = -1  # the alternative tried is choice[k]
+        body = ()
+        index = 0
+        node = None
+        while True:
+            if k >= 0:
+                while index < len(body):
+                    sym = body[index]
+                    if sym.__class__ is str:
+                        if pos < n and syms[pos] == sym:
+                            pos += 1
+                            index += 1
+                            continue
+                        memo.expect(pos, (sym,))
+                        break
+                    lookups += 1
+                    row = pos % rows
+                    end = ends[row * width + sym] if owners[row] == pos + 1 else _UNKNOWN
+                    if end == _UNKNOWN:
+                        stack.append((nterm, start, choice, k, body, index, node))
+                        if len(stack) > stats.peak_depth:
+                            stats.peak_depth = len(stack)
+                        nterm = sym
+                        start = pos
+                        choice = choices[nterm].get(syms[pos] if pos < n else None,
+                                                    nullable[nterm])
+                        k = -1
+                        break
+                    hits += 1
+                    if end == _FAILED:
+                        break
+                    node.append(nodes[row * width + sym])
+                    pos = end - 2
+                    index += 1
+                else:
+                    # Matched: back to the nonterminals below with the end
+                    memo.store(nterm, start, pos, node)
+                    if not stack:
+                        stats.lookups += lookups
+                        stats.hits += hits
+                        return pos, node
+                    child = node
+                    nterm, start, choice, k, body, index, node = stack.pop()
+                    node.append(child)
+                    index += 1
+                    continue
+            # The alternative fails, or none was tried yet: the next one is
+            # tried from start
+            k += 1
+            while k == len(choice):
+                if not choice:
+                    memo.expect(start, choices[nterm])
+                memo.store(nterm, start, -1, None)
+                if not stack:
+                    stats.lookups += lookups
+                    stats.hits += hits
+                    return -1, None
+                nterm, start, choice, k, body, index, node = stack.pop()
+                k += 1
+            alt = choice[k]
+            body = alts[nterm][alt]
+            index = 0
+            pos = start
+            node = [prods[nterm][alt]]
+
+    @instrument.timed('packrat.parse')
+    def parse(self, syms) -> list:
+        # The productions matched, in leftmost order; raises ParseError
+        # unless the start symbol matches all of syms
+        n = len(syms)
+        self.stats.parses += 1
+        memo = self._new_memo(n)
+        end, root = self._match(memo, self.start, 0, syms, n)
+        if end != n:
+            pos = memo.farthest
+            expected = memo.expected
+            if end > pos:
+                pos = end
+                expected = set()
+            if end == pos:
+                expected.add('$')
+            raise ParseError(syms[pos] if pos < n else '$', pos, sorted(expected))
+        output = list()
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            output.append(node[0])
+            pending.extend(reversed(node[1:]))
+        if instrument.enabled:
+            instrument.count('productions', len(output))
+        return output
+
+
+# Column names of the rows yielded by iter_stats_rows()
+STATS_COLUMNS = ('name', 'value')
+
+
+def iter_stats_rows(parser: PackratParser):
+    stats = parser.stats
+    yield 'parses', stats.parses
+    yield 'hit rate', round(stats.get_hit_rate(), 4)
+    yield 'lookups', stats.lookups
+    yield 'hits', stats.hits
+    yield 'evictions', stats.evictions
+    yield 'peak entries', stats.peak_entries
+    yield 'peak memo bytes', stats.peak_memo_bytes
+    yield 'peak depth', stats.peak_depth
+
+
+def iter_stats(parser: PackratParser):
+    for name, value in iter_stats_rows(parser):
+        yield '  {:15}: {}'.format(name.capitalize(), value)
+
+
+def str_stats(parser: PackratParser) -> str:
+    return '\n'.join(iter_stats(parser))
+
+
+def main():
+    # The statement kind is known after the path; the path is matched once
+    # and taken from the memo by the next alternatives
+    import bnf_parser
+    bnf = '''
+    Stmts := Stmt More
+    More  := ; Stmt More | @
+    Stmt  := Path = Path | Path ( ) | Path
+    Path  := id Rest
+    Rest  := . id Rest | @
+    '''
+    parser = PackratParser(bnf_parser.parse(bnf))
+    syms = 'id . id = id ; id . id . id ( ) ; id ; id . id = id'.split()
+    for prod in parser.parse(syms):
+        print('  ' + str(prod))
+    print(str_stats(parser))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+import os
+import concurrent.futures
+from grammar import Grammar
+from lr import LR0Item, LR1Item, LREdge, LRState
+from packed_table import _index_productions
+import instrument
+import lr
+
+# Items cross the process boundary as (production id, pos) or, for LR(1)
+# items, (production id, pos, lookaheads) tuples, which pickle much smaller
+# than the item objects.
+
+_worker = None  # (grammar, algo_suit, productions, production ids) of a worker
+
+
+def _init_worker(grammar: Grammar, algo_suit):
+    global _worker
+    prods = _index_productions(grammar)
+    _worker = (grammar, algo_suit, prods, dict((prod, i) for i, prod in enumerate(prods)))
+
+
+def _encode_items(prod_ids: dict, items) -> tuple:
+    result = list()
+    for item in items:
+        if isinstance(item, LR1Item):
+            result.append((prod_ids[item.prod], item.pos, tuple(item.lookahead)))
+        else:
+            result.append((prod_ids[item.prod], item.pos))
+    return tuple(result)
+
+
+def _decode_item(prods: list, encoded: tuple):
+    if len(encoded) == 3:
+        return LR1Item(prods[encoded[0]], encoded[1], frozenset(encoded[2]))
+    return LR0Item(prods[encoded[0]], encoded[1])
+
+
+def _expand(kernels: list) -> list:
+    # Runs in the workers: for every kernel, [(sym, src items, dst kernel)]
+    # in the order construct_states numbers the new states, then the
+    # reducing items under '' with None as the kernel
+    grammar, algo_suit, prods, prod_ids = _worker
+    result = list()
+    for kernel in kernels:
+        state = LRState(frozenset(_decode_item(prods, x) for x in kernel))
+        src_dict, dst_dict = lr._construct_state_transition_dict(grammar, state, algo_suit)
+        edges = [(sym, _encode_items(prod_ids, src_dict[sym]),
+                  _encode_items(prod_ids, dst_dict[sym])) for sym in sorted(dst_dict)]
+        if '' in src_dict:
+            edges.append(('', _encode_items(prod_ids, src_dict['']), None))
+        result.append(edges)
+    return result
+
+
+def _decode_items(prods: list, items: dict, encoded: tuple) -> frozenset:
+    # items caches the decoded items, so that states share them
+    result = list()
+    for x in encoded:
+        item = items.get(x)
+        if item is None:
+            item = items[x] = _decode_item(prods, x)
+        result.append(item)
+    return frozenset(result)
+
+
+@instrument.timed('parallel_lr.construct_states')
+def construct_states(grammar: Grammar, algo_suit, workers=None, chunk_size=None) -> list:
+    # Same states, numbering and edges as lr.construct_states. The states
+    # are expanded a frontier at a time: the workers compute the closures
+    # and goto sets, this process dedupes the kernels and numbers the new
+    # states in the order of the frontier.
+    prods = _index_productions(grammar)
+    prod_ids = dict((prod, i) for i, prod in enumerate(prods))
+    initial_kernel = frozenset({algo_suit.build_item(grammar.get_start_prodctions()[0])})
+    states = [LRState(initial_kernel)]
+    kernels = {initial_kernel: 0}  # kernels[kernel] = state index
+    encoded = [_encode_items(prod_ids, initial_kernel)]  # encoded[state index]
+    items = dict()
+
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(grammar, algo_suit)) as executor:
+        frontier = [0]
+        while frontier:
+            size = chunk_size or max(1, len(frontier) // (workers * 4))
+            chunks = [frontier[i:i + size] for i in range(0, len(frontier), size)]
+            results = executor.map(_expand, [[encoded[i] for i in chunk] for chunk in chunks])
+            frontier = list()
+            for chunk, chunk_result in zip(chunks, results):
+                for src_index, state_edges in zip(chunk, chunk_result):
+                    edges = dict()
+                    for sym, src_items, dst_kernel in state_edges:
+                        src_items = _decode_items(prods, items, src_items)
+                        if dst_kernel is None:
+                            edges[sym] = LREdge(src_items, -1)
+                            continue
+                        dst_items = _decode_items(prods, items, dst_kernel)
+                        dst_index = kernels.get(dst_items, -1)
+                        if dst_index == -1:
+                            dst_index = len(states)
+                            kernels[dst_items] = dst_index
+                            states.append(LRState(dst_items))
+                            encoded.append(dst_kernel)
+                            frontier.append(dst_index)
+                        edges[sym] = LREdge(src_items, dst_index)
+                    states[src_index].edges = edges
+            if instrument.enabled:
+                instrument.count('rounds')
+                instrument.count('chunks', len(chunks))
+    if instrument.enabled:
+        instrument.count('states', len(states))
+    return states
+
+
+def _get_structure(states: list) -> list:
+    return [(state.kernel, dict((sym, (edge.src_items, edge.dst_state))
+                                for sym, edge in state.edges.items()))
+            for state in states]
+
+
+def main():
+    import bnf_parser
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    grammar = lr.construct_argumented_grammar(bnf_parser.parse(bnf))
+    algo_suit = lr.LR1AlgorithmSuit(grammar)
+    states = construct_states(grammar, algo_suit, 2)
+    serial = lr.construct_states(grammar, algo_suit)
+    print('{} states, same as the serial build: {}'.format(
+        len(states), _get_structure(states) == _get_structure(serial)))
+    print(lr.str_transitions(states))
+
+
+if __name__ == '__main__':
+    main()
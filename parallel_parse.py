@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+import os
+import concurrent.futures
+from lr import LRAction
+from parse_error import ParseError
+import instrument
+import lr
+
+# The input is cut into chunks that begin right after a synchronizing
+# terminal of the grammar (%sync in the BNF). The workers parse every chunk
+# speculatively, from the stack the parser had after shifting the first
+# synchronizing terminal of the input, with holes for what lies below it,
+# and send back the values of the subtrees they completed. This process
+# then runs the parser over the input again, taking a subtree in a single
+# step where it was built upon the state now on top of the stack, as the
+# incremental parser does. A chunk started from the wrong stack is simply
+# parsed again here, so the result is always the one of a sequential parse.
+
+_HOLE = object()  # stands for the stack below the start of a chunk
+_worker = None  # (table, sync, reduce) of a worker
+
+
+def build_tuple(prod, values: list) -> tuple:
+    # The default reduce: trees of (nterm, children) tuples, with the
+    # terminals as strings
+    return prod.nterm, tuple(values)
+
+
+def _init_worker(table: list, sync, reduce):
+    global _worker
+    _worker = (table, frozenset(sync), reduce)
+
+
+def _parse_chunk(args) -> list:
+    # Runs in the workers. syms: the chunk followed by its lookahead, the
+    # next synchronizing terminal, if any; end: the length of the chunk.
+    # Returns the subtrees completed in the chunk in input order, as
+    # (start, nterm, state below, length, value).
+    syms, end, start_states = args
+    table, sync, reduce = _worker
+    states = list(start_states)
+    # The stack entries above states[0]: nterms is None for the terminals
+    values = [_HOLE] * (len(states) - 1)
+    nterms = [None] * (len(states) - 1)
+    starts = [0] * (len(states) - 1)
+    result = list()
+
+    def add_subtrees(first: int, end: int):
+        # The nonempty subtrees among the entries from first up, the last
+        # of which ends at end
+        for i in range(first, len(values)):
+            length = (starts[i + 1] if i + 1 < len(starts) else end) - starts[i]
+            if nterms[i] is not None and values[i] is not _HOLE and length:
+                result.append((starts[i], nterms[i], states[i], length, values[i]))
+
+    pos = 0
+    while True:
+        sym = syms[pos] if pos < len(syms) else '$'
+        actions = table[states[-1]].get(sym)
+        if not actions:
+            break
+        action = tuple(actions)[0]
+        if action.action == LRAction.SHIFT:
+            if pos == end:
+                break
+            # Nodes over a synchronizing terminal are left to the stitching
+            # like those over the holes, which keeps the subtrees small
+            values.append(_HOLE if sym in sync else sym)
+            nterms.append(None)
+            starts.append(pos)
+            states.append(action.info)
+            pos += 1
+        elif action.action == LRAction.REDUCE:
+            prod = action.info
+            length = 0 if prod.syms == ('@',) else len(prod.syms)
+            first = len(values) - length
+            if _HOLE in values[first:]:
+                # Only the children of the node after the holes are done
+                add_subtrees(first, pos)
+                value = _HOLE
+            else:
+                value = reduce(prod, values[first:])
+            start = starts[first] if length else pos
+            del values[first:]
+            del nterms[first:]
+            del starts[first:]
+            del states[first + 1:]
+            values.append(value)
+            nterms.append(prod.nterm)
+            starts.append(start)
+            states.append(tuple(table[states[-1]][prod.nterm])[0].info)
+        else:
+            break
+    add_subtrees(0, pos)
+    return result
+
+
+def _stitch(table: list, syms, reduce, subtrees: list):
+    # lr.parse keeping a stack of values; subtrees are taken whole where
+    # they were built upon the state on top. Without subtrees, this is the
+    # sequential parse.
+    states = [0]
+    values = list()
+    n = len(syms)
+    pos = 0
+    next_subtree = 0
+    reused = 0
+    while True:
+        sym = syms[pos] if pos < n else '$'
+        actions = table[states[-1]].get(sym)
+        if not actions:
+            raise ParseError(sym, pos, lr.get_expected(table[states[-1]]))
+        action = tuple(actions)[0]
+        if action.action == LRAction.SHIFT:
+            while next_subtree < len(subtrees) and subtrees[next_subtree][0] < pos:
+                next_subtree += 1
+            if next_subtree < len(subtrees) and subtrees[next_subtree][0] == pos:
+                _, nterm, state, length, value = subtrees[next_subtree]
+                next_subtree += 1
+                # All reductions for the lookahead are done, so the state on
+                # top is the one the subtree was built upon if reusable
+                if state == states[-1]:
+                    values.append(value)
+                    states.append(tuple(table[state][nterm])[0].info)
+                    pos += length
+                    reused += 1
+                    continue
+            values.append(sym)
+            states.append(action.info)
+            pos += 1
+        elif action.action == LRAction.REDUCE:
+            prod = action.info
+            length = 0 if prod.syms == ('@',) else len(prod.syms)
+            first = len(values) - length
+            value = reduce(prod, values[first:])
+            del values[first:]
+            del states[first + 1:]
+            values.append(value)
+            states.append(tuple(table[states[-1]][prod.nterm])[0].info)
+        elif action.action == LRAction.ACCEPT:
+            if instrument.enabled:
+                instrument.count('reused', reused)
+            return values[-1]
+
+
+def parse_values(table: list, syms, reduce=build_tuple):
+    # The sequential parse: the value reduce gives the start symbol, reduce
+    # being called with each reduced production and the values of its
+    # symbols, the terminals being their own values
+    return _stitch(table, syms, reduce, [])
+
+
+def _get_start_states(table: list, syms, sync_pos: int):
+    # The states after shifting syms[sync_pos], or None on a syntax error
+    states = [0]
+    pos = 0
+    while pos <= sync_pos:
+        actions = table[states[-1]].get(syms[pos])
+        if not actions:
+            return None
+        action = tuple(actions)[0]
+        if action.action == LRAction.SHIFT:
+            states.append(action.info)
+            pos += 1
+        elif action.action == LRAction.REDUCE:
+            prod = action.info
+            length = 0 if prod.syms == ('@',) else len(prod.syms)
+            del states[len(states) - length:]
+            states.append(tuple(table[states[-1]][prod.nterm])[0].info)
+        else:
+            return None
+    return tuple(states)
+
+
+def split_chunks(syms, sync, size: int) -> list:
+    # [(start, end)]: every chunk but the first begins right after a
+    # synchronizing terminal and, but the last, is at least size symbols
+    # long. The terminal ending a chunk belongs to none.
+    result = list()
+    start = 0
+    for pos, sym in enumerate(syms):
+        if sym in sync and pos - start >= size:
+            result.append((start, pos))
+            start = pos + 1
+    result.append((start, len(syms)))
+    return result
+
+
+@instrument.timed('parallel_parse.parse')
+def parse(table: list, sync, syms, reduce=build_tuple, workers=None, chunk_size=None):
+    # Same value as parse_values, or the same ParseError. sync: the
+    # synchronizing terminals, e.g. grammar.sync. reduce runs in the
+    # workers, so it must be picklable, e.g. a function of a module.
+    n = len(syms)
+    workers = workers or os.cpu_count() or 1
+    chunks = split_chunks(syms, sync, chunk_size or max(1, n // (workers * 4)))
+    start_states = None
+    if len(chunks) > 1:
+        first_sync = next(pos for pos, sym in enumerate(syms) if sym in sync)
+        start_states = _get_start_states(table, syms, first_sync)
+    if start_states is None:
+        return parse_values(table, syms, reduce)
+
+    tasks = [(syms[start:end + 1], end - start, start_states if start else (0,))
+             for start, end in chunks]
+    subtrees = list()
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(table, sync, reduce)) as executor:
+        for (start, _), chunk_subtrees in zip(chunks, executor.map(_parse_chunk, tasks)):
+            subtrees.extend((start + subtree[0],) + subtree[1:] for subtree in chunk_subtrees)
+    if instrument.enabled:
+        instrument.count('chunks', len(chunks))
+        instrument.count('subtrees', len(subtrees))
+    return _stitch(table, syms, reduce, subtrees)
+
+
+def main():
+    import bnf_parser
+    bnf = '''
+    S := S ; R | R
+    R := let id = E | print E
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    %sync ;
+    '''
+    grammar = bnf_parser.parse(bnf)
+    lr_grammar = lr.construct_argumented_grammar(grammar)
+    algo_suit = lr.LR1AlgorithmSuit(lr_grammar)
+    table = lr.construct_table(lr_grammar, lr.construct_states(lr_grammar, algo_suit),
+                               algo_suit)
+    syms = ' ; '.join(['let id = id * ( id + id )', 'print id + id'] * 50).split()
+    tree = parse(table, grammar.sync, syms, workers=2)
+    print('{} symbols, same tree as the sequential parse: {}'.format(
+        len(syms), tree == parse_values(table, syms)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+MODES = ('panic', 'repair')
+
+
+class ParseError(SyntaxError):
+    def __init__(self, sym: str, pos: int, expected=()):
+        msg = 'Unexpected symbol {} at {}'.format(sym, pos)
+        if expected:
+            msg += ', expected ' + ' '.join(expected)
+        super().__init__(msg)
+        self.sym = sym
+        self.pos = pos
+        self.expected = tuple(expected)
+        self.recovery = None  # how the parser went on, set by the drivers
+
+
+class Recovery:
+    # Passed to lr.parse and ll1.parse to collect every syntax error instead
+    # of raising the first one.
+    #   panic:  skip input up to a synchronizing symbol of the FOLLOW set
+    #   repair: delete and insert at most max_cost symbols so that the next
+    #           window symbols parse, or fall back to panic mode
+    # follow: the FOLLOW set of the grammar for ll1.parse, computed on the
+    # first error of every parse if not given
+    def __init__(self, mode='repair', max_cost=2, window=3, follow=None):
+        if mode not in MODES:
+            raise ValueError('Unknown recovery mode ' + mode)
+        self.mode = mode
+        self.max_cost = max_cost
+        self.window = window
+        self.follow = follow
+
+
+class ErrorList(list):
+    # The errors of a parse. Like in yacc, an error less than window symbols
+    # after the position the last recovery resumed at is taken as caused by
+    # it and folded into that error rather than reported on its own.
+    def __init__(self, recovery: Recovery=None):
+        super().__init__()
+        self.window = recovery.window if recovery is not None else 0
+        self.quiet_until = 0
+
+    def add(self, error: ParseError):
+        if self and error.pos < self.quiet_until:
+            self[-1].recovery += '; ' + error.recovery
+        else:
+            self.append(error)
+
+    def resume(self, pos: int):
+        self.quiet_until = pos + self.window
+
+
+def _get_following(input_syms: list, pos: int, window: int) -> list:
+    result = list(input_syms[pos:pos + window])
+    if len(result) < window:
+        result.append('$')
+    return result
+
+
+def find_repair(check, expected, input_syms: list, pos: int, recovery: Recovery):
+    # Returns (number of deleted symbols, inserted symbol or None) of the
+    # cheapest repair at pos, or None. check(syms) tells whether the parser
+    # takes syms from the error configuration. At the same cost insertions
+    # come first, as they keep more of the input.
+    n = len(input_syms)
+    for cost in range(1, recovery.max_cost + 1):
+        deleted = cost - 1
+        if pos + deleted <= n:
+            following = _get_following(input_syms, pos + deleted, recovery.window)
+            for sym in expected:
+                if sym != '$' and check([sym] + following):
+                    return deleted, sym
+        deleted = cost
+        if pos + deleted <= n:
+            if check(_get_following(input_syms, pos + deleted, recovery.window)):
+                return deleted, None
+    return None
+
+
+def str_repair(input_syms: list, pos: int, deleted: int, inserted) -> str:
+    actions = list()
+    if deleted:
+        actions.append('delete ' + ' '.join(input_syms[pos:pos + deleted]))
+    if inserted is not None:
+        actions.append('insert ' + inserted)
+    return ', '.join(actions)
+
+
+# Column names of the rows yielded by iter_errors_rows()
+ERRORS_COLUMNS = ('pos', 'sym', 'expected', 'recovery')
+
+
+def iter_errors(errors: list):
+    for error in errors:
+        yield '  {}; {}'.format(error.msg, error.recovery)
+    yield '  {} error(s)'.format(len(errors))
+
+
+def iter_errors_rows(errors: list):
+    for error in errors:
+        yield error.pos, error.sym, ' '.join(error.expected), error.recovery
+
+
+def str_errors(errors: list) -> str:
+    return '\n'.join(iter_errors(errors))
+
+
+def main():
+    import bnf_parser
+    import lr
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    grammar = lr.construct_argumented_grammar(bnf_parser.parse(bnf))
+    algo_suit = lr.LR1AlgorithmSuit(grammar)
+    states = lr.construct_states(grammar, algo_suit)
+    table = lr.construct_table(grammar, states, algo_suit)
+    syms = 'id + * id ) + ( id id'.split()
+    for mode in MODES:
+        print('{}:'.format(mode))
+        print(str_errors(lr.parse(table, syms, recovery=Recovery(mode))))
+
+
+if __name__ == '__main__':
+    main()
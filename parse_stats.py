@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+import math
+import time
+from collections import Counter
+from grammar import Grammar
+import ll1
+import lr
+
+
+class ParseStats:
+    # Filled by lr.parse and ll1.parse when passed as stats; several parses
+    # may be accumulated in the same object.
+    def __init__(self):
+        self.visits = Counter()  # visits[LR state or LL(1) nonterminal]
+        self.productions = Counter()  # reductions or expansions of Productions
+        self.max_depth = 0
+        self.tokens = 0
+        self.parses = 0
+        self.elapsed = 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+    def merge(self, other):
+        self.visits.update(other.visits)
+        self.productions.update(other.productions)
+        self.max_depth = max(self.max_depth, other.max_depth)
+        self.tokens += other.tokens
+        self.parses += other.parses
+        self.elapsed += other.elapsed
+
+
+def _collect(stats: ParseStats, func) -> ParseStats:
+    stats = stats if stats is not None else ParseStats()
+    begin = time.perf_counter()
+    func(stats)
+    stats.elapsed += time.perf_counter() - begin
+    stats.parses += 1
+    return stats
+
+
+def collect_lr(table: list, syms: list, stats: ParseStats=None) -> ParseStats:
+    return _collect(stats, lambda x: lr.parse(table, syms, stats=x))
+
+
+def collect_ll1(grammar: Grammar, table: dict, syms: list,
+                stats: ParseStats=None) -> ParseStats:
+    return _collect(stats, lambda x: ll1.parse(grammar, table, syms, stats=x))
+
+
+# Column names of the rows yielded by the iter_*_rows() functions
+STATES_COLUMNS = ('rank', 'state', 'visits', 'share')
+PRODUCTIONS_COLUMNS = ('rank', 'production', 'count', 'share')
+
+
+def _iter_ranked(counter: Counter, top=None):
+    total = sum(counter.values())
+    for rank, (key, value) in enumerate(counter.most_common(top), 1):
+        yield rank, key, value, value / total
+
+
+def iter_states_rows(stats: ParseStats, top=None):
+    return _iter_ranked(stats.visits, top)
+
+
+def iter_productions_rows(stats: ParseStats, top=None):
+    for rank, prod, value, share in _iter_ranked(stats.productions, top):
+        yield rank, str(prod), value, share
+
+
+def iter_report(stats: ParseStats, top=20):
+    yield '  Parses: {}, tokens: {}, time: {:.2f} ms, {:.0f} tokens/s'.format(
+        stats.parses, stats.tokens, stats.elapsed * 1000, stats.tokens_per_second)
+    yield '  Max stack depth: {}'.format(stats.max_depth)
+    yield '  Hot states:'
+    for row in iter_states_rows(stats, top):
+        yield '    {:4}. {:>10} {:10} {:7.2%}'.format(*row)
+    yield '  Hot productions:'
+    for row in iter_productions_rows(stats, top):
+        yield '    {:4}. {:10} {:7.2%} {}'.format(row[0], row[2], row[3], row[1])
+
+
+def str_report(stats: ParseStats, top=20) -> str:
+    return '\n'.join(iter_report(stats, top))
+
+
+def construct_heat(stats: ParseStats, levels=9) -> dict:
+    # Node attributes for lr.dump_dfa coloring the visited states on a log
+    # scale with the graphviz reds color scheme, unvisited states stay white
+    if not stats.visits:
+        return dict()
+    peak = math.log1p(max(stats.visits.values()))
+    result = dict()
+    for state, visits in stats.visits.items():
+        level = 1 + round((levels - 1) * math.log1p(visits) / peak)
+        result[state] = dict(style='filled', colorscheme='reds{}'.format(levels),
+                             fillcolor=level, xlabel=visits)
+    return result
+
+
+def dump_heat_dfa(states: list, stats: ParseStats, export_file):
+    lr.dump_dfa(states, export_file, construct_heat(stats))
+
+
+def main():
+    import bnf_parser
+    import workloads
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    grammar = lr.construct_argumented_grammar(bnf_parser.parse(bnf))
+    algo_suit = lr.LR1AlgorithmSuit(grammar)
+    states = lr.construct_states(grammar, algo_suit)
+    table = lr.construct_table(grammar, states, algo_suit)
+
+    stats = ParseStats()
+    for seed in range(10):
+        collect_lr(table, workloads.gen_sentence(grammar, 1000, seed), stats)
+    print(str_report(stats, 5))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+import bisect
+from array import array
+from grammar import Production
+from packed_table import _pack_header, _unpack_header, _to_le_bytes, _from_le_bytes
+from parse_error import ParseError
+import ll1
+import lr
+
+# A trace keeps a few integers per step of a parse, where str_parse keeps
+# the formatted stacks and input of every step: the action, the state on
+# top of the LR stack after it, the production or terminal of the action
+# and the input position, plus the input as terminal ids. The view of any
+# step is rebuilt by replaying the trace from the nearest of the stacks
+# saved on the way, and rendered a page at a time with the column widths of
+# the page.
+#
+# Layout of the files: the header of packed_table._pack_header aligned to
+# 4 bytes, then the arrays named in the header, little endian, each padded
+# to 4 bytes.
+MAGIC = b'PTR1'
+
+SHIFT = 1
+REDUCE = 2
+ACCEPT = 4
+INIT = 5
+MATCH = 6
+OUTPUT = 7
+
+_LR_ACTIONS = dict([(lr.LRAction.SHIFT, SHIFT), (lr.LRAction.REDUCE, REDUCE),
+                    (lr.LRAction.ACCEPT, ACCEPT)])
+_LL1_ACTIONS = dict(INIT=INIT, MATCH=MATCH, OUTPUT=OUTPUT)
+_ARRAYS = ('actions', 'states', 'infos', 'positions', 'input')
+
+
+def _get_typecode(max_value: int) -> str:
+    return 'B' if max_value < 0x100 else 'H' if max_value < 0x10000 else 'I'
+
+
+class ParseTrace:
+    # kind: 'lr' or 'll1'. Step i: actions[i], states[i] the state on top
+    # of the stack after the action (LR), infos[i] the id of the production
+    # reduced or expanded or of the terminal matched, positions[i] the input
+    # position.
+    # LR steps are seen before their action, like the callback of
+    # lr.parse, LL(1) steps after it, like the one of ll1.parse.
+    def __init__(self, kind: str, terms=(), prods=(), start=None, error=None):
+        self.kind = kind
+        self.terms = list(terms)
+        self.prods = list(prods)  # (nterm, syms) pairs
+        self.start = start  # the start symbol of LL(1) traces
+        self.error = error  # the message of the syntax error ending the parse
+        self.actions = array('B')
+        self.states = array('I')
+        self.infos = array('I')
+        self.positions = array('I')
+        self.input = array('I')
+
+    def __len__(self):
+        return len(self.actions)
+
+    def shrink(self):
+        # Stores the arrays with the smallest typecodes for their values
+        for name in _ARRAYS:
+            arr = getattr(self, name)
+            typecode = _get_typecode(max(arr, default=0))
+            if typecode != arr.typecode:
+                setattr(self, name, array(typecode, arr))
+
+    def get_byte_size(self) -> int:
+        return sum(len(getattr(self, name)) * getattr(self, name).itemsize
+                   for name in _ARRAYS)
+
+    def to_bytes(self) -> bytes:
+        arrays = [getattr(self, name) for name in _ARRAYS]
+        chunks = [_pack_header(MAGIC, dict(
+            kind=self.kind, terms=self.terms, prods=self.prods, start=self.start,
+            error=self.error, arrays=[(name, arr.typecode, len(arr))
+                                      for name, arr in zip(_ARRAYS, arrays)]), align=4)]
+        for arr in arrays:
+            data = _to_le_bytes(arr)
+            chunks.append(data + bytes(-len(data) % 4))
+        return b''.join(chunks)
+
+    @staticmethod
+    def from_bytes(buf: bytes):
+        header, data = _unpack_header(MAGIC, buf, 'parse trace')
+        trace = ParseTrace(header['kind'], header['terms'],
+                           [(nterm, tuple(syms)) for nterm, syms in header['prods']],
+                           header['start'], header['error'])
+        begin = 0
+        for name, typecode, count in header['arrays']:
+            end = begin + count * array(typecode).itemsize
+            setattr(trace, name, _from_le_bytes(typecode, data[begin:end]))
+            begin = end + (-end % 4)
+        return trace
+
+
+class _Recorder:
+    def __init__(self, trace: ParseTrace, syms):
+        self.trace = trace
+        self.term_ids = dict()
+        self.prod_ids = dict()
+        trace.input.extend(self.get_term_id(sym) for sym in syms)
+
+    def get_term_id(self, term: str) -> int:
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.trace.terms)
+            self.trace.terms.append(term)
+        return term_id
+
+    def get_prod_id(self, prod: Production) -> int:
+        prod_id = self.prod_ids.get(prod)
+        if prod_id is None:
+            prod_id = self.prod_ids[prod] = len(self.trace.prods)
+            self.trace.prods.append((prod.nterm, tuple(prod.syms)))
+        return prod_id
+
+    def append(self, action: int, state: int, info: int, pos: int):
+        trace = self.trace
+        trace.actions.append(action)
+        trace.states.append(state)
+        trace.infos.append(info)
+        trace.positions.append(pos)
+
+
+def record_lr(table: list, syms) -> ParseTrace:
+    # The trace of lr.parse; a syntax error ends it and is kept in
+    # trace.error
+    trace = ParseTrace('lr')
+    recorder = _Recorder(trace, syms)
+
+    def callback(action, states, stack_syms, pos):
+        info = 0
+        state = states[-1]
+        if action.action == lr.LRAction.SHIFT:
+            state = action.info
+        elif action.action == lr.LRAction.REDUCE:
+            prod = action.info
+            info = recorder.get_prod_id(prod)
+            length = 0 if prod.syms == ('@',) else len(prod.syms)
+            state = tuple(table[states[-1 - length]][prod.nterm])[0].info
+        recorder.append(_LR_ACTIONS[action.action], state, info, pos)
+    try:
+        lr.parse(table, syms, callback)
+    except ParseError as error:
+        trace.error = str(error)
+    trace.shrink()
+    return trace
+
+
+def record_ll1(grammar, table: dict, syms) -> ParseTrace:
+    trace = ParseTrace('ll1', start=grammar.start)
+    recorder = _Recorder(trace, syms)
+
+    def callback(action, stack, pos, info):
+        if action == 'MATCH':
+            info = recorder.get_term_id(info)
+        elif action == 'OUTPUT':
+            info = recorder.get_prod_id(info)
+        else:
+            info = 0
+        recorder.append(_LL1_ACTIONS[action], 0, info, pos)
+    try:
+        ll1.parse(grammar, table, syms, callback)
+    except ParseError as error:
+        trace.error = str(error)
+    trace.shrink()
+    return trace
+
+
+class TraceReplay:
+    # Rebuilds the stacks of the steps of a trace. The stacks are saved on
+    # the way, the view of a step is then replayed from the nearest one
+    # before it. A stack is saved at least interval steps and at least its
+    # size in steps after the previous one, which keeps the saved stacks
+    # within the size of the trace however deep the parse goes.
+    def __init__(self, trace: ParseTrace, interval=1024):
+        self.trace = trace
+        self.interval = interval
+        # checkpoints[k] = the stacks before step steps[k]: the states and
+        # symbols for LR, the symbols for LL(1)
+        self.steps = [0]
+        if trace.kind == 'lr':
+            self.checkpoints = [(array('I', [0]), ['$'])]
+        else:
+            self.checkpoints = [(None, [trace.start])]
+
+    def iter_stacks(self, begin: int, end: int):
+        # Yields (step, states, syms) for the steps from begin to end, the
+        # stacks as the step sees them; they are changed by the next step
+        trace = self.trace
+        end = min(end, len(trace))
+        interval = self.interval
+        k = bisect.bisect_right(self.steps, begin) - 1
+        states, syms = self.checkpoints[k]
+        states = array(states.typecode, states) if states is not None else None
+        syms = list(syms)
+        is_lr = trace.kind == 'lr'
+        last = self.steps[-1]
+        for step in range(self.steps[k], end):
+            if step - last >= interval and step - last >= len(syms):
+                last = step
+                self.steps.append(step)
+                self.checkpoints.append((array(states.typecode, states) if is_lr else None,
+                                         list(syms)))
+            action = trace.actions[step]
+            if is_lr and step >= begin:
+                yield step, states, syms
+            if action == SHIFT:
+                syms.append(trace.terms[trace.input[trace.positions[step]]])
+                states.append(trace.states[step])
+            elif action == REDUCE:
+                nterm, prod_syms = trace.prods[trace.infos[step]]
+                length = 0 if prod_syms == ('@',) else len(prod_syms)
+                del syms[len(syms) - length:]
+                del states[len(states) - length:]
+                syms.append(nterm)
+                states.append(trace.states[step])
+            elif action == MATCH:
+                syms.pop()
+            elif action == OUTPUT:
+                prod_syms = trace.prods[trace.infos[step]][1]
+                syms.pop()
+                if prod_syms != ('@',):
+                    syms.extend(reversed(prod_syms))
+            if not is_lr and step >= begin:
+                yield step, states, syms
+
+
+def _str_syms(syms, max_syms, from_end: bool) -> str:
+    if max_syms is None or len(syms) <= max_syms:
+        return ' '.join(syms)
+    if from_end:
+        return '... ' + ' '.join(syms[len(syms) - max_syms:])
+    return ' '.join(syms[:max_syms]) + ' ...'
+
+
+def _str_action(trace: ParseTrace, step: int) -> str:
+    action = trace.actions[step]
+    info = trace.infos[step]
+    if action == SHIFT:
+        return 'Shift {}'.format(trace.states[step])
+    if action == REDUCE:
+        return 'Reduce {}'.format(Production(*trace.prods[info]))
+    if action == ACCEPT:
+        return 'Accept'
+    if action == MATCH:
+        return 'match  ' + trace.terms[info]
+    if action == OUTPUT:
+        return 'output ' + str(Production(*trace.prods[info]))
+    return ''
+
+
+# Column names of the rows yielded by iter_trace_rows()
+TRACE_COLUMNS = ('step', 'stack', 'input', 'action')
+
+
+def iter_trace_rows(trace: ParseTrace, begin=0, end=None, max_syms=16, replay=None):
+    # The stack is the states and symbols for LR, like lr.str_parse, and the
+    # symbols from the top for LL(1), like ll1.str_parse. Only the max_syms
+    # symbols nearest to the top of the stack and to the input position are
+    # shown, or all if None.
+    replay = replay or TraceReplay(trace)
+    end = len(trace) if end is None else end
+    terms = trace.terms
+    for step, states, syms in replay.iter_stacks(begin, end):
+        pos = trace.positions[step]
+        if max_syms is None or pos + max_syms >= len(trace.input):
+            rest = ' '.join([terms[term_id] for term_id in trace.input[pos:]] + ['$'])
+        else:
+            rest = ' '.join([terms[term_id] for term_id in trace.input[pos:pos + max_syms]]
+                            + ['...'])
+        if trace.kind == 'lr':
+            shown = len(states) if max_syms is None else min(len(states), max_syms)
+            stack = [str(states[-shown])]
+            for i in range(len(states) - shown + 1, len(states)):
+                stack.append(syms[i])
+                stack.append(str(states[i]))
+            stack = ' '.join(stack) if shown == len(states) else '... ' + ' '.join(stack)
+        else:
+            stack = _str_syms(syms[::-1] if max_syms is None else
+                              syms[:-max_syms - 2:-1], max_syms, False) + ' $'
+        yield step, stack, rest, _str_action(trace, step)
+
+
+def get_page_count(trace: ParseTrace, page_size: int) -> int:
+    return max(1, -(-len(trace) // page_size))
+
+
+def _iter_lines(trace: ParseTrace, rows: list, prefix: str):
+    # The rows aligned on their own widths, the LR ones like lr.str_parse
+    # and the LL ones like ll1.str_parse
+    widths = [max([len(str(row[i])) for row in rows], default=0) for i in range(3)]
+    for step, stack, rest, action in rows:
+        if trace.kind == 'lr':
+            yield '{} {} | {} | {} | {}'.format(
+                prefix, str(step).rjust(widths[0]), stack.ljust(widths[1]),
+                rest.rjust(widths[2]), action)
+        else:
+            yield '{} {} | {} | {} | {}'.format(
+                prefix, str(step).rjust(widths[0]), rest.rjust(widths[2]),
+                stack.rjust(widths[1]), action)
+
+
+def iter_trace(trace: ParseTrace, page=None, page_size=50, max_syms=16, replay=None):
+    # Every page (or the page numbered page, from 1) with its own column
+    # widths, so that only a page is kept at a time
+    replay = replay or TraceReplay(trace)
+    n_pages = get_page_count(trace, page_size)
+    pages = range(1, n_pages + 1) if page is None else [page]
+    for page_number in pages:
+        rows = list(iter_trace_rows(trace, (page_number - 1) * page_size,
+                                    page_number * page_size, max_syms, replay))
+        if page is not None and n_pages > 1:
+            yield '  Page {}/{}:'.format(page_number, n_pages)
+        yield from _iter_lines(trace, rows, ' ')
+    if trace.error and (page is None or page == n_pages):
+        yield '  ' + trace.error
+
+
+def str_trace(trace: ParseTrace, page=None, page_size=50, max_syms=16) -> str:
+    return '\n'.join(iter_trace(trace, page, page_size, max_syms))
+
+
+def _get_step_key(trace: ParseTrace, step: int, compare_states: bool) -> tuple:
+    action = trace.actions[step]
+    info = trace.infos[step]
+    if action in (REDUCE, OUTPUT):
+        info = trace.prods[info]
+    elif action == MATCH:
+        info = trace.terms[info]
+    state = trace.states[step] if compare_states else None
+    return action, info, trace.positions[step], state
+
+
+def find_divergence(trace: ParseTrace, other: ParseTrace, compare_states=True):
+    # The first step where the traces differ, or None. compare_states=False
+    # compares traces of tables numbered differently, e.g. minimized ones.
+    for step in range(min(len(trace), len(other))):
+        if _get_step_key(trace, step, compare_states) != \
+           _get_step_key(other, step, compare_states):
+            return step
+    if len(trace) != len(other) or trace.error != other.error:
+        return min(len(trace), len(other))
+    return None
+
+
+def iter_diff(trace: ParseTrace, other: ParseTrace, context=3, max_syms=16,
+              compare_states=True):
+    step = find_divergence(trace, other, compare_states)
+    if step is None:
+        yield '  Same {} steps'.format(len(trace))
+        return
+    yield '  Steps differ from {}:'.format(step)
+    for mark, current in (('-', trace), ('+', other)):
+        rows = list(iter_trace_rows(current, max(0, step - context), step + context + 1,
+                                    max_syms))
+        yield from _iter_lines(current, rows, mark)
+        if current.error and step + context >= len(current):
+            yield '{} {}'.format(mark, current.error)
+
+
+def str_diff(trace: ParseTrace, other: ParseTrace, context=3, max_syms=16,
+             compare_states=True) -> str:
+    return '\n'.join(iter_diff(trace, other, context, max_syms, compare_states))
+
+
+def main():
+    import bnf_parser
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    grammar = lr.construct_argumented_grammar(bnf_parser.parse(bnf))
+    algo_suit = lr.LR1AlgorithmSuit(grammar)
+    table = lr.construct_table(grammar, lr.construct_states(grammar, algo_suit), algo_suit)
+    syms = ' + '.join(['id * ( id + id )'] * 200).split()
+    trace = record_lr(table, syms)
+    print('  {} symbols, {} steps, {} bytes'.format(
+        len(syms), len(trace), trace.get_byte_size()))
+    print(str_trace(trace, page=4, page_size=8))
+    broken = record_lr(table, syms[:40] + ['+'] + syms[40:])
+    print(str_diff(trace, broken, context=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+import csv
+import json
+
+FORMATS = ('text', 'jsonl', 'csv')
+
+
+def write_lines(lines, output_file):
+    for line in lines:
+        output_file.write(line)
+        output_file.write('\n')
+
+
+def write_rows(name: str, columns: tuple, rows, output_file, fmt='jsonl'):
+    # Every JSON line carries the report name so that several reports can
+    # share one stream; CSV output starts each report with a header row.
+    if fmt == 'jsonl':
+        for row in rows:
+            record = dict(zip(columns, row))
+            record['report'] = name
+            output_file.write(json.dumps(record, ensure_ascii=False))
+            output_file.write('\n')
+    elif fmt == 'csv':
+        writer = csv.writer(output_file, lineterminator='\n')
+        writer.writerow(('report',) + tuple(columns))
+        for row in rows:
+            writer.writerow((name,) + tuple(row))
+    else:
+        raise ValueError('Unknown report format ' + fmt)
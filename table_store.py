@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+import sys
+import mmap
+import hashlib
+from array import array
+from packed_table import PackedLRTable, SHIFT, REDUCE, GOTO, ACCEPT
+from packed_table import _pack_header, _unpack_header
+from parse_error import ParseError
+
+# A store of packed LR tables for a family of similar grammars, e.g. the
+# dialects of a language, memory-mapped from one file. The tables share
+# their numbering: the columns are the terminals then the nonterminals of
+# all the grammars, and the productions are numbered in a pool of all of
+# them, so that the rows and lists alike in several grammars are equal and
+# kept once. Every uint32 array of the file, a row, the row offsets of a
+# table or the productions of a grammar, is stored once by its content.
+#
+# Layout: the header of packed_table._pack_header aligned to 4 bytes, then
+# the arrays as little endian uint32. The header has the symbols, the
+# productions and for every table the offset and length of its arrays, in
+# uint32 from the end of the header.
+MAGIC = b'TBS1'
+
+
+class _StoreBuilder:
+    def __init__(self):
+        self.data = array('I')
+        self.offsets = dict()  # offsets[digest of an array] = its offset
+        self.arrays = 0  # arrays stored, whether new or not
+
+    def add(self, arr: array) -> list:
+        # [offset, length] of arr in data
+        self.arrays += 1
+        buf = arr.tobytes()
+        digest = hashlib.blake2b(buf, digest_size=16).digest()
+        offset = self.offsets.get(digest)
+        if offset is None:
+            offset = self.offsets[digest] = len(self.data)
+            self.data.frombytes(buf)
+        return [offset, len(arr)]
+
+
+def _align_states(packed: PackedLRTable, reference: PackedLRTable) -> list:
+    # numbers[state] = the number of the state in the store: the number of
+    # the state of reference reached by the same symbols where there is
+    # one, so that the rows of the states alike in both tables are equal
+    pairs = dict()
+    pending = [(0, 0)]
+    while pending:
+        state, ref_state = pending.pop()
+        if state in pairs:
+            continue
+        pairs[state] = ref_state
+        row = state * packed.width
+        ref_row = ref_state * reference.width
+        for sym, sym_id in packed.sym_ids.items():
+            ref_sym_id = reference.sym_ids.get(sym)
+            if ref_sym_id is None:
+                continue
+            action = packed.actions[row + sym_id]
+            ref_action = reference.actions[ref_row + ref_sym_id]
+            if action & 3 in (SHIFT, GOTO) and ref_action & 3 == action & 3:
+                pending.append((action >> 2, ref_action >> 2))
+    # The numbers must stay those of the states, the ones taken twice or
+    # out of range are given the numbers left
+    numbers = [None] * packed.n_states
+    taken = set()
+    for state, ref_state in sorted(pairs.items()):
+        if ref_state < packed.n_states and ref_state not in taken:
+            numbers[state] = ref_state
+            taken.add(ref_state)
+    free = iter(number for number in range(packed.n_states) if number not in taken)
+    return [next(free) if number is None else number for number in numbers]
+
+
+def write_table_store(tables: dict, output_file):
+    # tables[name] = the PackedLRTable of the grammar named name
+    terms = sorted(set(term for packed in tables.values() for term in packed.terms
+                       if term != '$')) + ['$']
+    nterms = sorted(set(nterm for packed in tables.values() for nterm in packed.nterms))
+    syms = terms + nterms
+    sym_ids = dict((sym, i) for i, sym in enumerate(syms))
+    prod_ids = dict()
+    builder = _StoreBuilder()
+    directory = dict()
+    # The states are numbered like those of the first table, which the
+    # others are expected to be variants of
+    reference = None
+    for name, packed in tables.items():
+        prods = array('I', (prod_ids.setdefault(prod, len(prod_ids))
+                            for prod in packed.prods))
+        columns = [sym_ids[sym] for sym in packed.terms + packed.nterms]
+        if reference is None:
+            reference = packed
+        numbers = _align_states(packed, reference)
+        rows = array('I', bytes(4 * packed.n_states))
+        for state in range(packed.n_states):
+            row = array('I', bytes(4 * len(syms)))
+            begin = state * packed.width
+            for sym_id, action in enumerate(packed.actions[begin:begin + packed.width]):
+                kind = action & 3
+                if kind == REDUCE:
+                    action = prods[action >> 2] << 2 | REDUCE
+                elif kind == SHIFT or kind == GOTO:
+                    action = numbers[action >> 2] << 2 | kind
+                row[columns[sym_id]] = action
+            rows[numbers[state]] = builder.add(row)[0]
+        directory[name] = dict(
+            prods=builder.add(prods),
+            terms=builder.add(array('I', (sym_ids[term] for term in packed.terms))),
+            rows=builder.add(rows))
+
+    # prods[prod_id] = [nterm id, [symbol ids]], '@' left out
+    prods = [None] * len(prod_ids)
+    for (nterm, prod_syms), prod_id in prod_ids.items():
+        prods[prod_id] = [sym_ids[nterm], [sym_ids[sym] for sym in prod_syms if sym != '@']]
+    output_file.write(_pack_header(MAGIC, dict(syms=syms, n_terms=len(terms), prods=prods,
+                                               tables=directory, arrays=builder.arrays),
+                                   align=4))
+    data = builder.data
+    if sys.byteorder != 'little':
+        data.byteswap()
+    data.tofile(output_file)
+
+
+class StoredTable:
+    # The table of a grammar of a TableStore: the action of state on the
+    # symbol numbered sym_id in store.syms is
+    # data[data[rows_offset + state] + sym_id] with data = store.data,
+    # packed as in packed_table with the productions numbered in
+    # store.prods. No view of the data is kept, so that the store can be
+    # closed while tables are referenced.
+    def __init__(self, store, name: str, entry: dict):
+        self.store = store
+        self.name = name
+        self.rows_offset, self.n_states = entry['rows']
+        self._entry = entry
+
+    def get_action(self, state: int, sym_id: int) -> int:
+        data = self.store.data
+        return data[data[self.rows_offset + state] + sym_id]
+
+    def get_rows(self) -> tuple:
+        # The offsets of the rows of the states in store.data
+        return self.store.get_array(self._entry['rows'])
+
+    def get_terms(self) -> tuple:
+        # The terminals of the grammar, '$' last
+        syms = self.store.syms
+        return tuple(syms[sym_id] for sym_id in self.store.get_array(self._entry['terms']))
+
+    def get_prods(self) -> tuple:
+        # The productions of the grammar as (nterm, syms), in the order of
+        # the packed table it was stored from
+        prods = self.store.prods
+        return tuple(prods[prod_id] for prod_id in self.store.get_array(self._entry['prods']))
+
+
+class TableStore:
+    # The tables of a file written by write_table_store; data is a
+    # memoryview of the mapped file on little endian hosts.
+    def __init__(self, header: dict, data, buf=None):
+        self.syms = tuple(header['syms'])
+        self.n_terms = header['n_terms']
+        self.terms = self.syms[:self.n_terms]
+        self.term_ids = dict((term, i) for i, term in enumerate(self.terms))
+        self.prods = tuple((self.syms[nterm], tuple(self.syms[sym] for sym in syms) or ('@',))
+                           for nterm, syms in header['prods'])
+        self.prod_lhs = tuple(nterm for nterm, _ in header['prods'])
+        self.prod_len = tuple(len(syms) for _, syms in header['prods'])
+        self.data = data
+        self.n_arrays = header['arrays']
+        self._tables = header['tables']
+        self._buf = buf  # mmap kept open for data
+
+    @staticmethod
+    def from_buffer(buf):
+        header, data = _unpack_header(MAGIC, memoryview(buf), 'table store')
+        if sys.byteorder == 'little':
+            data = data.cast('I')
+        else:
+            data = array('I', data)
+            data.byteswap()
+        return TableStore(header, data, buf)
+
+    def get_array(self, location: list) -> tuple:
+        offset, length = location
+        with self.data[offset:offset + length] as view:
+            return tuple(view)
+
+    def get_names(self) -> list:
+        return list(self._tables)
+
+    def get(self, name: str) -> StoredTable:
+        # Raises KeyError for the names not in the store
+        return StoredTable(self, name, self._tables[name])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tables
+
+    def __len__(self):
+        return len(self._tables)
+
+    def close(self):
+        if isinstance(self.data, memoryview):
+            self.data.release()
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_table_store(path: str) -> TableStore:
+    with open(path, 'rb') as input_file:
+        buf = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return TableStore.from_buffer(buf)
+    except ValueError:
+        buf.close()
+        raise
+
+
+def parse_lr(table: StoredTable, ids) -> list:
+    # Like packed_table.parse_lr with ids numbered as table.store.terms;
+    # returns the ids of the reduced productions of table.store.prods
+    store = table.store
+    data = store.data
+    rows = table.rows_offset
+    prod_lhs = store.prod_lhs
+    prod_len = store.prod_len
+    eof = store.n_terms - 1
+    n = len(ids)
+    stack = [0]
+    output = []
+    pos = 0
+    sym = ids[0] if n else eof
+    while True:
+        action = data[data[rows + stack[-1]] + sym]
+        kind = action & 3
+        if kind == SHIFT:
+            stack.append(action >> 2)
+            pos += 1
+            sym = ids[pos] if pos < n else eof
+        elif kind == REDUCE:
+            prod = action >> 2
+            length = prod_len[prod]
+            if length:
+                del stack[-length:]
+            stack.append(data[data[rows + stack[-1]] + prod_lhs[prod]] >> 2)
+            output.append(prod)
+        elif action == ACCEPT:
+            return output
+        else:
+            row = data[rows + stack[-1]]
+            raise ParseError(store.terms[sym], pos, sorted(
+                store.terms[i] for i in range(store.n_terms) if data[row + i]))
+
+
+# Column names of the rows yielded by iter_stats_rows()
+STATS_COLUMNS = ('name', 'value')
+
+
+def iter_stats_rows(store: TableStore):
+    unique_rows = set()
+    rows = 0
+    for name in store.get_names():
+        table_rows = store.get(name).get_rows()
+        rows += len(table_rows)
+        unique_rows.update(table_rows)
+    yield 'tables', len(store)
+    yield 'symbols', len(store.syms)
+    yield 'productions', len(store.prods)
+    yield 'rows', rows
+    yield 'unique rows', len(unique_rows)
+    yield 'arrays', store.n_arrays
+    yield 'data bytes', len(store.data) * 4
+
+
+def iter_stats(store: TableStore):
+    for name, value in iter_stats_rows(store):
+        yield '  {:11}: {}'.format(name.capitalize(), value)
+
+
+def str_stats(store: TableStore) -> str:
+    return '\n'.join(iter_stats(store))
+
+
+def main():
+    import io
+    import bnf_parser
+    import lr
+    import packed_table
+    import workloads
+    tables = dict()
+    for n in range(4):
+        grammar = lr.construct_argumented_grammar(
+            bnf_parser.parse(workloads.gen_sql_dialect(n)))
+        algo_suit = lr.LR1AlgorithmSuit(grammar)
+        states = lr.construct_states(grammar, algo_suit)
+        tables['sql{}'.format(n)] = packed_table.pack_lr_table(
+            grammar, lr.construct_table(grammar, states, algo_suit))
+
+    output_file = io.BytesIO()
+    write_table_store(tables, output_file)
+    store = TableStore.from_buffer(output_file.getvalue())
+    print(str_stats(store))
+    table = store.get('sql3')
+    syms = 'SELECT * FROM id WHERE id > num ;'.split()
+    prods = parse_lr(table, [store.term_ids[sym] for sym in syms])
+    print('\n'.join('  {} → {}'.format(nterm, ' '.join(prod_syms))
+                    for nterm, prod_syms in (store.prods[i] for i in prods)))
+
+
+if __name__ == '__main__':
+    main()
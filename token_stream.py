@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+import sys
+import mmap
+import struct
+from array import array
+from packed_table import _pack_header, _unpack_header
+from parse_error import ParseError
+
+# Layout: the header of packed_table._pack_header aligned to 4 bytes, then
+# the terminal ids as little endian uint16 or uint32, as told by the
+# typecode in the header.
+MAGIC = b'TOK1'
+
+
+def _get_typecode(n_terms: int) -> str:
+    return 'H' if n_terms <= 0x10000 else 'I'
+
+
+def write_token_stream(syms, output_file, terms=None):
+    # syms: an iterable of terminal names. terms: the terminal table to
+    # number them with, e.g. packed_table.construct_terms(grammar) so that
+    # the ids are those of the packed tables; by default the terminals are
+    # numbered in the order they first appear.
+    terms = list(terms) if terms is not None else list()
+    term_ids = dict((term, i) for i, term in enumerate(terms))
+    fixed = bool(terms)
+    ids = array('I')
+    for pos, sym in enumerate(syms):
+        term_id = term_ids.get(sym)
+        if term_id is None:
+            if fixed:
+                raise ParseError(sym, pos, ())
+            term_id = term_ids[sym] = len(terms)
+            terms.append(sym)
+        ids.append(term_id)
+
+    typecode = _get_typecode(len(terms))
+    if typecode != 'I':
+        ids = array(typecode, ids)
+    if sys.byteorder != 'little':
+        ids.byteswap()
+    output_file.write(_pack_header(MAGIC, dict(terms=terms, typecode=typecode,
+                                               count=len(ids)), align=4))
+    ids.tofile(output_file)
+
+
+def convert(text_file, output_file, terms=None):
+    # Converts whitespace separated symbols, the input format of cli.py
+    write_token_stream((sym for line in text_file for sym in line.split()),
+                       output_file, terms)
+
+
+def is_token_stream(path: str) -> bool:
+    with open(path, 'rb') as input_file:
+        return input_file.read(4) == MAGIC
+
+
+class TokenStream:
+    # A sequence of terminal names backed by the ids of a token stream; ids
+    # is a memoryview of the mapped file on little endian hosts.
+    def __init__(self, terms, ids, buf=None):
+        self.terms = tuple(terms)
+        self.ids = ids
+        self._buf = buf  # mmap kept open for ids
+
+    @staticmethod
+    def from_buffer(buf):
+        header, data = _unpack_header(MAGIC, memoryview(buf), 'token stream')
+        end = header['count'] * struct.calcsize(header['typecode'])
+        if sys.byteorder == 'little':
+            ids = data[:end].cast(header['typecode'])
+        else:
+            ids = array(header['typecode'], data[:end])
+            ids.byteswap()
+        return TokenStream(header['terms'], ids, buf)
+
+    def get_ids(self, terms) -> list:
+        # The ids numbered as in terms (e.g. PackedLRTable.terms); without a
+        # copy if the stream was written with them
+        terms = tuple(terms)
+        if terms[:len(self.terms)] == self.terms:
+            return self.ids
+        term_ids = dict((term, i) for i, term in enumerate(terms))
+        remap = [term_ids.get(term, -1) for term in self.terms]
+        if -1 in remap:
+            # The first token of a terminal unknown to terms, if any
+            for pos, term_id in enumerate(self.ids):
+                if remap[term_id] < 0:
+                    raise ParseError(self.terms[term_id], pos, ())
+        return array('I', (remap[term_id] for term_id in self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self.terms[term_id] for term_id in self.ids[pos]]
+        return self.terms[self.ids[pos]]
+
+    def __iter__(self):
+        terms = self.terms
+        return (terms[term_id] for term_id in self.ids)
+
+    def close(self):
+        if isinstance(self.ids, memoryview):
+            self.ids.release()
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_token_stream(path: str) -> TokenStream:
+    with open(path, 'rb') as input_file:
+        buf = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return TokenStream.from_buffer(buf)
+    except ValueError:
+        buf.close()
+        raise
+
+
+def main():
+    import io
+    import bnf_parser
+    import lr
+    import packed_table
+    bnf = '''
+    E := E + T | T
+    T := T * F | F
+    F := ( E ) | id
+    '''
+    grammar = lr.construct_argumented_grammar(bnf_parser.parse(bnf))
+    algo_suit = lr.LR1AlgorithmSuit(grammar)
+    states = lr.construct_states(grammar, algo_suit)
+    packed = packed_table.pack_lr_table(
+        grammar, lr.construct_table(grammar, states, algo_suit))
+
+    output_file = io.BytesIO()
+    convert(io.StringIO('id * ( id + id )\n+ id'), output_file, packed.terms)
+    stream = TokenStream.from_buffer(output_file.getvalue())
+    print('{} tokens: {}'.format(len(stream), ' '.join(stream)))
+    prods = packed_table.parse_lr(packed, stream.get_ids(packed.terms))
+    print('\n'.join('  {} → {}'.format(nterm, ' '.join(syms))
+                    for nterm, syms in (packed.prods[i] for i in prods)))
+
+
+if __name__ == '__main__':
+    main()
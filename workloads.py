@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+import random
+from grammar import Grammar
+import bnf_parser
+
+
+def gen_layered(n: int) -> str:
+    # A_i starts with A_(i-1) in every alternative but nothing is recursive;
+    # substituting in declaration order doubles the rules at every layer.
+    lines = ['A0 := x0 | y0']
+    for i in range(1, n):
+        lines.append('A{} := A{} a{} | A{} b{} | c{}'.format(i, i - 1, i, i - 1, i, i))
+    return '\n'.join(lines)
+
+
+def gen_expr_cycles(n: int) -> str:
+    # n independent copies of a left-recursive E/T/F tower with an indirect
+    # cycle through F.
+    lines = ['S := ' + ' | '.join('E{}'.format(i) for i in range(n))]
+    for i in range(n):
+        lines.append('E{0} := E{0} + T{0} | T{0}'.format(i))
+        lines.append('T{0} := T{0} * F{0} | F{0}'.format(i))
+        lines.append('F{0} := ( E{0} ) | G{0} x | id{0}'.format(i))
+        lines.append('G{0} := F{0} y | z{0}'.format(i))
+    return '\n'.join(lines)
+
+
+def gen_expr_tower(n: int) -> str:
+    # n left-recursive binary operator precedence levels
+    lines = []
+    for i in range(n):
+        lines.append('E{0} := E{0} op{0} E{1} | E{1}'.format(i, i + 1))
+    lines.append('E{} := ( E0 ) | id | num'.format(n))
+    return '\n'.join(lines)
+
+
+def gen_chain(n: int) -> str:
+    # A list of chains of n unit productions
+    lines = ['S := S ; C0 | C0']
+    for i in range(n):
+        lines.append('C{0} := C{1} | t{0}'.format(i, i + 1))
+    lines.append('C{0} := t{0}'.format(n))
+    return '\n'.join(lines)
+
+
+def gen_wide(n: int) -> str:
+    # A list of statements, each picked from n alternatives
+    lines = ['S := S ; A | A']
+    lines.append('A := ' + ' | '.join('k{} V'.format(i) for i in range(n)))
+    lines.append('V := id | num')
+    return '\n'.join(lines)
+
+
+def gen_long(n: int) -> str:
+    # A list of 8 statement kinds, each a sequence of n keywords and
+    # expressions
+    lines = ['S := S ; R | R', 'R := ' + ' | '.join('R{}'.format(i) for i in range(8))]
+    for i in range(8):
+        lines.append('R{} := '.format(i) + ' '.join(
+            'k{}_{} E'.format(i, j) if j % 2 else 'k{}_{}'.format(i, j) for j in range(n)))
+    lines.append('E := E + P | P')
+    lines.append('P := ( E ) | id')
+    return '\n'.join(lines)
+
+
+def gen_paths(n: int) -> str:
+    # n statement kinds starting with a dotted path: not LL(k) for any k, the
+    # kind is known only after the path
+    kinds = ' | '.join('Path op{} Path'.format(i) for i in range(n))
+    return '''
+    Stmts := Stmt More
+    More  := ; Stmt More | @
+    Stmt  := {} | Path
+    Path  := id Rest
+    Rest  := . id Rest | @
+    '''.format(kinds)
+
+
+def gen_json(n: int=0) -> str:
+    return '''
+    Value   := Object | Array | str | num | true | false | null
+    Object  := { ObjRest
+    ObjRest := } | Pair Pairs }
+    Pairs   := Pairs , Pair | @
+    Pair    := str : Value
+    Array   := [ ArrRest
+    ArrRest := ] | Value Values ]
+    Values  := Values , Value | @
+    '''
+
+
+def gen_sql(n: int=0) -> str:
+    return '''
+    Stmts   := Stmts Stmt | Stmt
+    Stmt    := Select ; | Insert ; | Delete ;
+    Select  := SELECT Cols FROM Tables Where
+    Insert  := INSERT INTO id VALUES ( Exprs )
+    Delete  := DELETE FROM id Where
+    Cols    := * | Exprs
+    Exprs   := Exprs , Or | Or
+    Tables  := Tables , Table | Table
+    Table   := id Alias
+    Alias   := AS id | @
+    Where   := WHERE Or | @
+    Or      := Or OR And | And
+    And     := And AND Cmp | Cmp
+    Cmp     := Add Rel
+    Rel     := = Add | < Add | @
+    Add     := Add + Prim | Prim
+    Prim    := Col | num | str | ( Or )
+    Col     := id Qual
+    Qual    := . id | @
+    '''
+
+
+# Extensions of the sql grammar: (line, extended line)
+_SQL_EXTENSIONS = (
+    ('Rel     := = Add | < Add | @', 'Rel     := = Add | < Add | > Add | @'),
+    ('Cols    := * | Exprs', 'Cols    := * | Exprs | DISTINCT Exprs'),
+    ('Add     := Add + Prim | Prim', 'Add     := Add + Prim | Add - Prim | Prim'),
+    ('Table   := id Alias', 'Table   := id Alias | ( Select ) Alias'),
+    ('Stmt    := Select ; | Insert ; | Delete ;',
+     'Stmt    := Select ; | Insert ; | Delete ; | Update ;\n'
+     '    Update  := UPDATE id SET Col = Or Where'),
+)
+
+
+def gen_sql_dialect(n: int) -> str:
+    # The sql grammar with the extensions of the bits of n: the 32 dialects
+    # differ by a few productions
+    bnf = gen_sql()
+    for i, (line, extended) in enumerate(_SQL_EXTENSIONS):
+        if n >> i & 1:
+            bnf = bnf.replace(line, extended)
+    return bnf
+
+
+def gen_ambiguous(n: int) -> str:
+    # E op E for n operators without precedence
+    ops = ' | '.join('E op{} E'.format(i) for i in range(n))
+    return 'E := {} | ( E ) | id'.format(ops)
+
+
+# name: (grammar generator, default size)
+GRAMMARS = dict(
+    layered=(gen_layered, 8),
+    expr_cycles=(gen_expr_cycles, 4),
+    expr_tower=(gen_expr_tower, 8),
+    chain=(gen_chain, 50),
+    long=(gen_long, 20),
+    wide=(gen_wide, 200),
+    json=(gen_json, 0),
+    sql=(gen_sql, 0),
+    sql_dialect=(gen_sql_dialect, 31),
+    ambiguous=(gen_ambiguous, 4),
+    paths=(gen_paths, 8),
+)
+
+
+def _construct_min_lengths(grammar: Grammar) -> tuple:
+    # Returns ({nterm: length of its shortest sentence}, {nterm: production
+    # deriving it}). Updating only on strict improvement keeps the chosen
+    # productions acyclic, so following them always terminates.
+    lengths = dict()
+    best = dict()
+    changed = True
+    while changed:
+        changed = False
+        for nterm, prodlist in grammar.prods.items():
+            for prod in prodlist:
+                length = 0
+                for sym in prod.syms:
+                    if sym == '@':
+                        continue
+                    if not grammar.is_nonterminal(sym):
+                        length += 1
+                    elif sym in lengths:
+                        length += lengths[sym]
+                    else:
+                        break
+                else:
+                    if nterm not in lengths or length < lengths[nterm]:
+                        lengths[nterm] = length
+                        best[nterm] = prod
+                        changed = True
+    return lengths, best
+
+
+def _get_length(grammar: Grammar, lengths: dict, prod) -> int:
+    result = 0
+    for sym in prod.syms:
+        if sym == '@':
+            continue
+        result += lengths[sym] if grammar.is_nonterminal(sym) else 1
+    return result
+
+
+def _construct_growing(grammar: Grammar, lengths: dict, prodlists: dict) -> dict:
+    # Returns {nterm: productions that make the sentence longer than the
+    # shortest one, directly or through a nonterminal they contain}.
+    # Nonterminals that derive a finite set of sentences have none.
+    result = dict()
+    for nterm, prodlist in prodlists.items():
+        longer = [prod for prod, length in prodlist if length > lengths[nterm]]
+        if longer:
+            result[nterm] = longer
+    changed = True
+    while changed:
+        changed = False
+        for nterm, prodlist in prodlists.items():
+            if nterm in result:
+                continue
+            growing = [prod for prod, _ in prodlist
+                       if any(sym in result for sym in prod.syms)]
+            if growing:
+                result[nterm] = growing
+                changed = True
+    return result
+
+
+def gen_sentence(grammar: Grammar, length: int, seed=0) -> list:
+    # Derives a random sentence of about length terminals, leftmost first.
+    # Productions are picked at random, except that the last nonterminal
+    # able to grow the sentence is kept until the shortest completion of
+    # what is left reaches length; after that only the shortest ones are.
+    rng = random.Random(seed)
+    lengths, best = _construct_min_lengths(grammar)
+    prodlists = dict()
+    for nterm, prodlist in grammar.prods.items():
+        if nterm in lengths:
+            prodlists[nterm] = [
+                (prod, _get_length(grammar, lengths, prod)) for prod in prodlist
+                if all(sym not in grammar.prods or sym in lengths for sym in prod.syms)]
+    growing = _construct_growing(grammar, lengths, prodlists)
+    shortest = dict((nterm, [prod for prod, prod_length in prodlist
+                             if prod_length == lengths[nterm]])
+                    for nterm, prodlist in prodlists.items())
+
+    result = list()
+    stack = [grammar.start]
+    pending = lengths[grammar.start]
+    n_growing = 1 if grammar.start in growing else 0
+    stall = 0
+    while stack:
+        sym = stack.pop()
+        if sym == '@':
+            continue
+        if not grammar.is_nonterminal(sym):
+            result.append(sym)
+            pending -= 1
+            stall = 0
+            continue
+        if sym in growing:
+            n_growing -= 1
+        # Unit cycles can be expanded forever without growing the sentence
+        stall += 1
+        if stall > 32:
+            prod = best[sym]
+        elif len(result) + pending >= length:
+            prod = rng.choice(shortest[sym])
+        else:
+            prod = rng.choice(prodlists[sym])[0]
+            if not n_growing and sym in growing and prod not in growing[sym]:
+                prod = rng.choice(growing[sym])
+        prod_length = _get_length(grammar, lengths, prod)
+        if prod_length > lengths[sym]:
+            pending += prod_length - lengths[sym]
+            stall = 0
+        n_growing += sum(1 for child in prod.syms if child in growing)
+        stack.extend(reversed(prod.syms))
+    return result
+
+
+def corrupt_sentence(syms: list, terms: list, rate: float, seed=0) -> list:
+    # Deletes, inserts or replaces about rate * len(syms) symbols; the
+    # inserted ones are picked from terms
+    rng = random.Random(seed)
+    result = list()
+    for sym in syms:
+        if rng.random() >= rate:
+            result.append(sym)
+            continue
+        edit = rng.randrange(3)
+        if edit == 1:
+            result.append(rng.choice(terms))
+            result.append(sym)
+        elif edit == 2:
+            result.append(rng.choice(terms))
+    return result
+
+
+def main():
+    for name, (gen, size) in GRAMMARS.items():
+        grammar = bnf_parser.parse(gen(size))
+        print('{} ({}):'.format(name, size))
+        print('  ' + ' '.join(gen_sentence(grammar, 20)))
+
+
+if __name__ == '__main__':
+    main()